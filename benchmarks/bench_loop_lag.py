@@ -0,0 +1,126 @@
+"""
+Measures how long the event loop stalls while the legacy search path
+waits on postgres.
+
+Replays the database calls of a single roboragi_old anime request (two
+cache probes, the request stats and logging the request) from many
+concurrent coroutines. It runs once with DatabaseHandler called on the
+loop, as it used to be, and once through `DatabaseHandler.runInThread`.
+A ticker sleeping 5ms at a time records how late it wakes up.
+
+Needs roboragi_old/Config.py pointing at a scratch database; the rows
+go into a `bench_loop_lag` schema that is dropped afterwards. Run from
+the repository root:
+    python -m benchmarks.bench_loop_lag --rows 500000
+"""
+from argparse import ArgumentParser
+from asyncio import gather, get_event_loop, sleep
+from sys import path
+from time import perf_counter
+
+path.insert(0, 'roboragi_old')
+
+import DatabaseHandler  # noqa: E402
+
+SCHEMA = 'bench_loop_lag'
+
+TABLES = f"""
+DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;
+CREATE SCHEMA {SCHEMA};
+SET search_path TO {SCHEMA};
+CREATE TABLE requests (
+id SERIAL PRIMARY KEY,
+name varchar(320),
+type varchar(16),
+requester varchar(50),
+server varchar(50),
+requesttimestamp timestamp DEFAULT current_timestamp
+);
+CREATE TABLE anilistanime (
+id varchar(16) PRIMARY KEY,
+name varchar(320),
+synonyms varchar(320)[],
+accesstimestamp timestamp DEFAULT current_timestamp,
+dict JSONB
+);
+CREATE INDEX ON anilistanime USING GIN (synonyms);
+CREATE INDEX ON anilistanime (name);
+CREATE TABLE malanime (LIKE anilistanime INCLUDING ALL);
+"""
+
+SYNTHETIC_ROWS = """
+INSERT INTO requests (name, type, requester, server)
+SELECT 'title ' || (random() ^ 2 * 20000)::int, 'Anime',
+(random() * 50000)::int, (random() * 2000)::int
+FROM generate_series(1, %s);
+INSERT INTO anilistanime
+SELECT g, 'title ' || g, ARRAY['title ' || g, 'synonym ' || g],
+now(), jsonb_build_object('description', repeat(md5(g::text), 40))
+FROM generate_series(1, 20000) g;
+INSERT INTO malanime SELECT * FROM anilistanime;
+ANALYZE;
+"""
+
+
+def request(title):
+    DatabaseHandler.checkForMalEntry('malanime', title)
+    DatabaseHandler.checkForMalEntry('anilistanime', title)
+    DatabaseHandler.getRequestStats(title, 'Anime')
+    DatabaseHandler.addRequest(title, 'Anime', '1', 'bench')
+
+
+async def on_loop(title):
+    request(title)
+
+
+async def in_thread(title):
+    await DatabaseHandler.runInThread(request, title)
+
+
+async def ticker(lags, interval=0.005):
+    loop = get_event_loop()
+    while True:
+        start = loop.time()
+        await sleep(interval)
+        lags.append(loop.time() - start - interval)
+
+
+async def user(run, requests, offset):
+    for i in range(requests):
+        await run(f'title {(offset * 31 + i * 7) % 20000}')
+        await sleep(0.001)
+
+
+async def measure(name, run, users, requests):
+    lags = []
+    ticking = get_event_loop().create_task(ticker(lags))
+    start = perf_counter()
+    await gather(*[user(run, requests, offset) for offset in range(users)])
+    elapsed = perf_counter() - start
+    ticking.cancel()
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)] * 1000
+    print(f'{name:>9}: {users * requests / elapsed:7.1f} requests/s, '
+          f'loop lag p99 {p99:6.1f}ms, max {lags[-1] * 1000:6.1f}ms')
+
+
+async def main(args):
+    cur = DatabaseHandler.conn.cursor()
+    cur.execute(TABLES)
+    print(f'Loading {args.rows} requests...')
+    cur.execute(SYNTHETIC_ROWS, (args.rows,))
+    DatabaseHandler.conn.commit()
+    try:
+        await measure('on loop', on_loop, args.users, args.requests)
+        await measure('in thread', in_thread, args.users, args.requests)
+    finally:
+        cur.execute(f'DROP SCHEMA {SCHEMA} CASCADE; RESET search_path;')
+        DatabaseHandler.conn.commit()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=10)
+    get_event_loop().run_until_complete(main(parser.parse_args()))
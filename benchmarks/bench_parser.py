@@ -0,0 +1,135 @@
+"""
+Compares the single pass request parser against the regex chain it
+replaced, on a corpus of real request messages.
+
+Run from the repository root:
+    python -m benchmarks.bench_parser
+"""
+from collections import Counter
+from timeit import repeat
+import re
+
+from minoshiro import Medium
+
+from cogs.search import CommandRequest, get_all_requests
+
+CORPUS = [
+    '{Nisekoi}',
+    '{{Made in Abyss}}',
+    '<Bonnouji> is so good',
+    ']Utsuro no Hako to Zero no Maria[',
+    'has anyone watched {Steins;Gate} or {Steins;Gate 0} yet?',
+    'ok but {{Kaguya-sama wa Kokurasetai}} and <<Kaguya-sama>>',
+    '{Mob Psycho 100} {One Punch Man} <One Punch Man> <Mob Psycho 100>',
+    'I need to finish ]]Spice and Wolf[[ before the remake',
+    'lol {}',
+    '{!help}',
+    '{!stats @someone}',
+    '{!sstats} {Shirobako}',
+    'check this out <https://www.youtube.com/watch?v=dQw4w9WgXcQ>',
+    'just linking <https://myanimelist.net/anime/1/> ok',
+    'The next chapter of <Berserk> <Vagabond> <Kingdom> when',
+    'rec me something like {Mushishi} or {Natsume Yuujinchou}',
+    'this message has no requests at all, just talking about anime',
+    'what about {Re:Zero kara Hajimeru Isekai Seikatsu}?',
+    ']Mushoku Tensei[ ]Overlord[ ]Log Horizon[',
+    '{{Houseki no Kuni}} is the best cgi anime',
+    '<<Oyasumi Punpun>> <<Solanin>>',
+    '{Fate/Zero} {Fate/stay night: Unlimited Blade Works}',
+    'a > b and c < d but {Gintama} anyway',
+    '{K-On!} {Hibike! Euphonium}',
+    'Anyone reading <Chainsaw Man>? {Chainsaw Man} drops next season',
+    '{Made in Abyss: Retsujitsu no Ougonkyou}',
+    '{{Shingeki no Kyojin}} <Shingeki no Kyojin> ]Shingeki no Kyojin[',
+    'nah {Boku no Hero Academia} is mid',
+    '{Cowboy Bebop}\n{Samurai Champloo}\n{Space Dandy}',
+    'I rated it 10/10 {Violet Evergarden} <3',
+    ('long message ' * 40) + '{Haikyuu!!} ' + ('and more text ' * 40),
+]
+
+# The parser as it was before the single pass rewrite, kept verbatim
+# apart from the `yield` dicts, which are turned into tuples.
+
+
+def legacy_execute_commands(cleaned_message):
+    for match in re.finditer(r"\{([^{}]*)\}|\<([^<>]*)\>|\]([^[\]]*)\[",
+                             cleaned_message, re.S):
+        command = re.sub(r'[<>{}[\]]', '', match.group(0))
+        if command.startswith('!'):
+            cleaned_message = re.sub(
+                re.escape(match.group(0)), "", cleaned_message)
+    return cleaned_message
+
+
+def legacy_get_all_searches(message, expanded_allowed):
+    all_matches = list(re.finditer(
+            r"\{{2}([^}]*)\}{2}|\<{2}([^>]*)\>{2}|\]{2}([^]]*)\[{2}",
+            message, re.S))
+    if len(all_matches) > 1:
+        expanded_allowed = False
+    for match in all_matches:
+        if '<<' in match.group(0):
+            cleaned_search = re.sub(r"\<{2}|\>{2}", "", match.group(0))
+            url_cleaned = re.sub(r'(http(s)?:\/\/.)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{2,256}\.[a-z]{2,6}\b([-a-zA-Z0-9@:%_\+.~#?&//=]*)', '', cleaned_search)
+            if not url_cleaned:
+                return False
+            yield (Medium.MANGA, cleaned_search, expanded_allowed)
+        if '{{' in match.group(0):
+            cleaned_search = re.sub(r"\{{2}|\}{2}", "", match.group(0))
+            yield (Medium.ANIME, cleaned_search, expanded_allowed)
+        if ']]' in match.group(0):
+            cleaned_search = re.sub(r"\]{2}|\[{2}", "", match.group(0))
+            yield (Medium.LN, cleaned_search, expanded_allowed)
+
+        message = re.sub(re.escape(match.group(0)), "", message)
+
+    all_matches = list(re.finditer(r"\{([^{}]*)\}|\<([^<>]*)\>|\]([^[\]]*)\[",
+                             message, re.S))
+    for match in all_matches:
+        if '<' in match.group(0):
+            cleaned_search = re.sub(r"\<|\>", "", match.group(0))
+            url_cleaned = re.sub(r'(http(s)?:\/\/.)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{2,256}\.[a-z]{2,6}\b([-a-zA-Z0-9@:%_\+.~#?&//=]*)', '', cleaned_search)
+            if not url_cleaned:
+                return False
+            yield (Medium.MANGA, cleaned_search, False)
+        if '{' in match.group(0):
+            cleaned_search = re.sub(r"\{|\}", "", match.group(0))
+            yield (Medium.ANIME, cleaned_search, False)
+        if ']' in match.group(0):
+            cleaned_search = re.sub(r"\]|\[", "", match.group(0))
+            yield (Medium.LN, cleaned_search, False)
+    return
+
+
+def legacy(message):
+    return list(legacy_get_all_searches(
+        legacy_execute_commands(message), True))
+
+
+def single_pass(message):
+    return [
+        tuple(request) for request in get_all_requests(message, True)
+        if not isinstance(request, CommandRequest)
+    ]
+
+
+def main():
+    agree = 0
+    for message in CORPUS:
+        old, new = legacy(message), single_pass(message)
+        if Counter(old) == Counter(new):
+            agree += 1
+        else:
+            print(f'differs: {message!r}\n  legacy: {old}\n  new:    {new}')
+    print(f'{agree}/{len(CORPUS)} messages parse to the same searches')
+
+    for name, parse in (('legacy', legacy), ('single pass', single_pass)):
+        best = min(repeat(
+            lambda: [parse(message) for message in CORPUS],
+            number=200, repeat=5))
+        per_message = best / (200 * len(CORPUS)) * 1e6
+        print(f'{name:>12}: {per_message:.2f}us per message')
+
+
+if __name__ == '__main__':
+    main()
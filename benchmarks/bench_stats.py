@@ -0,0 +1,187 @@
+"""
+Measures !stats and !sstats latency on a large synthetic request log, and
+how fast requests are written.
+
+Loads the rows into a scratch `bench_stats` schema of a local Postgres
+and times the stats queries as they were on the plain table and from the
+rollup tables. Then times writing requests in batches, which also updates
+the rollups, into the plain table and into the partitioned table.
+
+Run from the repository root:
+    python -m benchmarks.bench_stats --rows 2000000 \\
+        --dsn postgres://postgres@localhost/postgres
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from logging import getLogger
+from random import randrange
+from statistics import median
+from time import perf_counter
+
+from asyncpg import create_pool
+from minoshiro import Medium
+
+from helpers.database_helpers import PostgresController, make_tables, \
+    partition_requests
+
+SCHEMA = 'bench_stats'
+
+# The requests table and stats queries as they were before the rollups were
+# added.
+
+LEGACY_TABLE = """
+CREATE TABLE requests (
+id SERIAL,
+requester BIGINT,
+server BIGINT,
+medium SMALLINT,
+title VARCHAR NOT NULL,
+logtime timestamp DEFAULT current_timestamp,
+PRIMARY KEY (id, requester, server)
+);
+"""
+
+LEGACY_STATS = """
+SELECT count(*) from requests;
+
+SELECT COUNT(*) FROM requests
+WHERE {column} = ($1);
+
+SELECT title, medium, COUNT(title) FROM requests
+WHERE {column} = ($1)
+GROUP BY title, medium ORDER BY COUNT(title) DESC, title ASC LIMIT 5;
+
+SELECT row FROM
+(SELECT {column}, count(1), ROW_NUMBER() over (ORDER BY COUNT(1) DESC)
+    as row
+FROM requests GROUP BY {column}) as overallrequestrank
+WHERE {column} = ($1);
+
+SELECT COUNT(DISTINCT (title, medium))
+FROM requests
+WHERE {column} = ($1);
+"""
+
+SYNTHETIC_ROWS = """
+INSERT INTO requests (requester, server, medium, title, logtime)
+SELECT (random() ^ 3 * $2)::bigint,
+(random() ^ 3 * $3)::bigint,
+1 + (random() * 2)::smallint,
+'title ' || (random() ^ 2 * $4)::int,
+now() - random() * interval '730 days'
+FROM generate_series(1, $1);
+"""
+
+
+async def legacy_stats(pool, column, id_):
+    for sql in LEGACY_STATS.format(column=column).split(';')[:-1]:
+        if '$1' in sql:
+            await pool.fetch(sql, id_)
+        else:
+            await pool.fetch(sql)
+
+
+async def time_stats(name, stats, ids, repeat):
+    for column, sample in ids.items():
+        timings = []
+        for _ in range(repeat):
+            for id_ in sample:
+                start = perf_counter()
+                await stats(column, id_)
+                timings.append((perf_counter() - start) * 1000)
+        timings.sort()
+        print(f'{name:>14} {column:>9}: '
+              f'median {median(timings):8.2f}ms  '
+              f'p95 {timings[int(len(timings) * 0.95)]:8.2f}ms')
+
+
+async def time_writes(name, pool, requests, batch_size):
+    db = await PostgresController.get_instance(
+        getLogger('bench_stats'), pool=pool, schema=SCHEMA,
+        create_tables=False, batch_size=batch_size)
+    start = perf_counter()
+    for request in requests:
+        await db.add_request(request)
+    await db.close()
+    elapsed = perf_counter() - start
+    print(f'{name:>14}    writes: '
+          f'{len(requests) / elapsed:8.0f} requests/s')
+
+
+async def main(args):
+    pool = await create_pool(
+        args.dsn, server_settings={'search_path': SCHEMA})
+    await pool.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;')
+    await pool.execute(f'CREATE SCHEMA {SCHEMA};')
+    await pool.execute(LEGACY_TABLE)
+
+    start = perf_counter()
+    await pool.execute(
+        SYNTHETIC_ROWS, args.rows, args.users, args.servers, args.titles)
+    await pool.execute('ANALYZE requests;')
+    print(f'loaded {args.rows} requests in {perf_counter() - start:.1f}s')
+
+    ids = {}
+    for column in ('requester', 'server'):
+        ids[column] = [row[0] for row in await pool.fetch(f"""
+        SELECT {column} FROM requests GROUP BY {column}
+        ORDER BY count(*) DESC LIMIT {args.sample};
+        """)]
+
+    def legacy(column, id_):
+        return legacy_stats(pool, column, id_)
+
+    await time_stats('plain table', legacy, ids, args.repeat)
+
+    start = perf_counter()
+    await make_tables(pool, SCHEMA)
+    await pool.execute('ANALYZE;')
+    print(f'rollups built in {perf_counter() - start:.1f}s')
+
+    db = PostgresController(pool, getLogger('bench_stats'), SCHEMA)
+    getters = {
+        'requester': db.get_user_stats,
+        'server': db.get_server_stats
+    }
+    await time_stats(
+        'rollups', lambda column, id_: getters[column](id_),
+        ids, args.repeat)
+
+    requests = [{
+        'requester_id': randrange(args.users),
+        'server_id': randrange(args.servers),
+        'medium': Medium.ANIME,
+        'title': f'title {randrange(args.titles)}'
+    } for _ in range(args.writes)]
+    await time_writes('plain table', pool, requests, args.batch_size)
+
+    if args.partition:
+        start = perf_counter()
+        await partition_requests(pool)
+        await pool.execute('ANALYZE requests;')
+        print(f'partitioned in {perf_counter() - start:.1f}s')
+        await time_writes('partitioned', pool, requests, args.batch_size)
+
+    if not args.keep:
+        await pool.execute(f'DROP SCHEMA {SCHEMA} CASCADE;')
+    await pool.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--dsn', default='postgres://localhost/postgres')
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--servers', type=int, default=2000)
+    parser.add_argument('--titles', type=int, default=20000)
+    parser.add_argument('--sample', type=int, default=10,
+                        help='busiest users and servers timed')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--writes', type=int, default=50000,
+                        help='requests written for the write timings')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--no-partition', dest='partition',
+                        action='store_false')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the bench_stats schema afterwards')
+    get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+"""
+Compares `TitleIndex` with difflib.get_close_matches on a labelled corpus
+of misspelled titles.
+
+The titles are the synonyms from roboragi_old/synonyms.db, plus those in
+an optional file with one title per line, e.g. an export of the
+precached AniList titles. Every query is a title with a few typos and is
+labelled with the title it came from.
+
+Run from the repository root:
+    python -m benchmarks.bench_titles [--titles titles.txt]
+"""
+from argparse import ArgumentParser
+from difflib import get_close_matches
+from random import Random
+from sqlite3 import connect
+from timeit import default_timer
+
+from helpers.title_helpers import TitleIndex
+
+# The cutoffs used by the old roboragi sources
+CUTOFFS = (0.8, 0.85, 0.9, 0.95)
+
+
+def load_titles(path):
+    conn = connect('roboragi_old/synonyms.db')
+    try:
+        titles = {name.lower() for name, in conn.execute(
+            'SELECT name FROM synonyms') if name}
+    finally:
+        conn.close()
+    if path:
+        with open(path, encoding='utf-8') as lines:
+            titles.update(line.strip().lower() for line in lines)
+    titles.discard('')
+    return sorted(titles)
+
+
+def misspell(title, random):
+    """
+    Makes up to two typos in a title: a dropped, doubled, swapped or
+    wrong letter
+    """
+    chars = list(title)
+    for _ in range(random.randint(0, 2)):
+        i = random.randrange(len(chars))
+        typo = random.randrange(4)
+        if typo == 0 and len(chars) > 1:
+            del chars[i]
+        elif typo == 1:
+            chars.insert(i, chars[i])
+        elif typo == 2 and i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        else:
+            chars[i] = random.choice('abcdefghijklmnopqrstuvwxyz')
+    return ''.join(chars)
+
+
+def timed(match, queries):
+    start = default_timer()
+    results = [match(query, cutoff) for query, _, cutoff in queries]
+    return results, (default_timer() - start) / len(queries) * 1e6
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--titles', help='file with more titles')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    titles = load_titles(args.titles)
+    random = Random(args.seed)
+    queries = []
+    for _ in range(args.queries):
+        title = random.choice(titles)
+        queries.append(
+            (misspell(title, random), title, random.choice(CUTOFFS)))
+
+    start = default_timer()
+    index = TitleIndex(titles, normalize=str)
+    print(f'indexed {len(titles)} titles in '
+          f'{(default_timer() - start) * 1000:.1f}ms')
+
+    expected, difflib_time = timed(
+        lambda query, cutoff: get_close_matches(query, titles, 1, cutoff),
+        queries)
+    found, index_time = timed(
+        lambda query, cutoff: index.get_close_matches(query, 1, cutoff),
+        queries)
+
+    agree = sum(a == b for a, b in zip(expected, found))
+    correct = sum(
+        result == [title] for result, (_, title, _) in zip(found, queries))
+    print(f'{agree}/{len(queries)} queries give the same match as difflib')
+    print(f'{correct}/{len(queries)} queries find the title they came from')
+    print(f'     difflib: {difflib_time:8.1f}us per query')
+    print(f'  TitleIndex: {index_time:8.1f}us per query '
+          f'({difflib_time / index_time:.0f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
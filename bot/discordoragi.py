@@ -1,20 +1,56 @@
 """
 Discord bot port of roboragi
 """
-from discord.ext.commands import Bot
+from discord.ext.commands import AutoShardedBot
 import yaml
 from time import time
-from aiohttp_wrapper import SessionManager
 from helpers.discord_helpers import get_name_with_discriminator
-from helpers import PostgresController
+from helpers import HTTPClient, Metrics, PostgresController
+from helpers.metrics_helpers import database_metrics, upstream_metrics
 from logging import Formatter, INFO, StreamHandler, getLogger
 
 
-class Discordoragi(Bot):
+def share_pool(database_config, processes):
+    """
+    Splits the connection pool sizes in a database config between the
+    processes of a sharded bot, so together they open about as many
+    connections as a single process would. Every process keeps at least
+    two, so the request writer never holds the only one.
+    :param database_config: the database_info section of config.yml
+    :param processes: how many processes share it
+    :return: the database config for one process
+    """
+    database_config = dict(database_config)
+    for key, least in (('min_size', 1), ('max_size', 2)):
+        size = database_config.get(key, 10)
+        database_config[key] = max(-(-size // processes), least)
+    return database_config
+
+
+def get_logger(label=''):
+    """
+    returns a logger to be used
+
+    :param label: shown in every line, to tell the processes apart
+
+    :return: logger
+    """
+    logger = getLogger('discordoragi')
+    console_handler = StreamHandler()
+    console_handler.setFormatter(Formatter(
+        f'%(asctime)s %(levelname)s %(name)s{label}: %(message)s')
+    )
+    logger.addHandler(console_handler)
+    logger.setLevel(INFO)
+    return logger
+
+
+class Discordoragi(AutoShardedBot):
     """
     Discordoragi bot
     """
-    def __init__(self):
+    def __init__(self, shard_ids: list = None, shard_count: int = None,
+                 processes: int = 1, search_workers: list = ()):
         """
         Initializes the bot
 
@@ -22,31 +58,73 @@ class Discordoragi(Bot):
 
         :param config: the now-converted config.yml file
 
+        :param shard_ids: the shards run by this process, None for all
+
+        :param shard_count: the number of shards across every process,
+            None for as many as Discord recommends
+
+        :param processes: how many processes share the database
+
+        :param search_workers: the socket paths of the search workers,
+            empty to search in this process
+
         """
         self.start_time = int(time())
         with open("config/config.yml", 'r') as yml_config:
             config = yaml.load(yml_config)
         self.database_config = config['database_info']
+        if processes > 1:
+            self.database_config = share_pool(
+                self.database_config, processes)
         self.credentials = config['bot_credentials']
         self.footer = config['footer']
-        self.logger = self.__get_logger()
-        self.session_manager = SessionManager()
-        super().__init__('?~')
+        self.search_config = config.get('search_info') or {}
+        self.request_log_config = config.get('request_log') or {}
+        self.http_config = config.get('http_info') or {}
+        self.worker_config = config.get('search_workers') or {}
+        self.metrics_config = config.get('metrics') or {}
+        self.search_workers = search_workers
+        self.logger = get_logger(
+            f' [shards {",".join(map(str, shard_ids))}]' if shard_ids else '')
+        self.session_manager = HTTPClient(**self.http_config)
+        self.metrics = Metrics()
+        self.metrics.add_collector(
+            upstream_metrics(self.session_manager.upstreams))
+        super().__init__('?~', shard_ids=shard_ids, shard_count=shard_count)
 
     @classmethod
-    async def get_bot(cls):
-        bot_instance = cls()
+    async def get_bot(cls, shard_ids: list = None, shard_count: int = None,
+                      processes: int = 1, search_workers: list = (),
+                      prepared: bool = False):
+        bot_instance = cls(shard_ids, shard_count, processes, search_workers)
         bot_instance.db_controller = await PostgresController.get_instance(
                 bot_instance.logger,
-                bot_instance.database_config)
+                bot_instance.database_config,
+                create_tables=not prepared,
+                **bot_instance.request_log_config)
+        bot_instance.metrics.add_collector(
+            database_metrics(bot_instance.db_controller))
         return bot_instance
 
+    async def close(self):
+        """
+        Writes any queued requests and closes every upstream connection
+        before logging out
+        """
+        await self.db_controller.close()
+        await self.session_manager.close()
+        await self.metrics.close()
+        await super().close()
+
     async def on_ready(self):
         self.logger.log(
             INFO,
             f'Logged in as {get_name_with_discriminator(self.user)}'
         )
 
+    async def on_shard_ready(self, shard_id):
+        self.logger.log(INFO, f'Shard {shard_id} of {self.shard_count} ready')
+
     def start_bot(self, cogs):
         """
         actually start the bot
@@ -56,18 +134,3 @@ class Discordoragi(Bot):
         for cog in cogs:
             self.add_cog(cog)
         self.run(self.credentials['token'])
-
-    def __get_logger(self):
-        """
-        returns a logger to be used
-
-        :return: logger
-        """
-        logger = getLogger('discordoragi')
-        console_handler = StreamHandler()
-        console_handler.setFormatter(Formatter(
-            '%(asctime)s %(levelname)s %(name)s: %(message)s')
-        )
-        logger.addHandler(console_handler)
-        logger.setLevel(INFO)
-        return logger
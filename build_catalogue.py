@@ -0,0 +1,111 @@
+"""
+Builds the title catalogue used to skip the AniList search for popular
+titles, from the most popular AniList anime and manga
+    python build_catalogue.py [--anime 5000] [--manga 5000]
+                              [--output data/catalogue.tsv]
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop, sleep
+from os import makedirs, path, replace
+
+from aiohttp import ClientSession
+from minoshiro import Medium
+
+from helpers.cache_helpers import normalize_search
+from helpers.catalogue_helpers import catalogue_line
+
+ANILIST_URL = 'https://graphql.anilist.co'
+PER_PAGE = 50
+
+QUERY = """
+query ($page: Int, $perPage: Int, $type: MediaType) {
+  Page(page: $page, perPage: $perPage) {
+    pageInfo { hasNextPage }
+    media(type: $type, sort: POPULARITY_DESC) {
+      id
+      format
+      synonyms
+      title { romaji english native }
+    }
+  }
+}
+"""
+
+
+async def fetch_page(session, media_type, page, retries: int = 5):
+    """
+    Gets a page of entries by popularity, waiting out rate limits
+    :param session: the aiohttp session
+    :param media_type: 'ANIME' or 'MANGA'
+    :param page: the page number, from 1
+    :param retries: how often to retry a rate limited page
+    :return: the Page object from AniList
+    """
+    variables = {'page': page, 'perPage': PER_PAGE, 'type': media_type}
+    for _ in range(retries):
+        async with session.post(
+                ANILIST_URL,
+                json={'query': QUERY, 'variables': variables}) as resp:
+            if resp.status == 429:
+                await sleep(int(resp.headers.get('Retry-After', 60)))
+                continue
+            resp.raise_for_status()
+            return (await resp.json())['data']['Page']
+    raise RuntimeError(f'Still rate limited on {media_type} page {page}')
+
+
+async def build(args):
+    """
+    Walks the most popular entries and writes the catalogue. When several
+    entries share a title, the most popular one keeps it.
+    """
+    lines = {}
+    async with ClientSession() as session:
+        for media_type, count in (('ANIME', args.anime),
+                                  ('MANGA', args.manga)):
+            for page in range(1, -(-count // PER_PAGE) + 1):
+                found = await fetch_page(session, media_type, page)
+                for media in found['media']:
+                    if media_type == 'ANIME':
+                        medium = Medium.ANIME
+                    elif media['format'] == 'NOVEL':
+                        medium = Medium.LN
+                    else:
+                        medium = Medium.MANGA
+                    titles = list(media['title'].values())
+                    titles += media['synonyms'] or []
+                    for title in titles:
+                        if title and normalize_search(title):
+                            lines.setdefault(
+                                (normalize_search(title), medium.value),
+                                catalogue_line(title, medium, media['id']))
+                print(f'{media_type} page {page}: {len(lines)} titles')
+                if not found['pageInfo']['hasNextPage']:
+                    break
+                await sleep(args.delay)
+
+    directory = path.dirname(args.output)
+    if directory:
+        makedirs(directory, exist_ok=True)
+    # Replaced in one go, so a running bot never maps half a file
+    with open(f'{args.output}.tmp', 'wb') as catalogue:
+        catalogue.writelines(sorted(lines.values()))
+    replace(f'{args.output}.tmp', args.output)
+    print(f'Wrote {len(lines)} titles to {args.output}')
+
+
+def run():
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--anime', type=int, default=5000,
+                        help='number of anime to include')
+    parser.add_argument('--manga', type=int, default=5000,
+                        help='number of manga and light novels to include')
+    parser.add_argument('--output', default='data/catalogue.tsv')
+    parser.add_argument('--delay', type=float, default=0.7,
+                        help='seconds between requests, AniList allows '
+                             '90 a minute')
+    get_event_loop().run_until_complete(build(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    run()
@@ -2,13 +2,32 @@
 A cog that handles searching for anime/manga/ln found
 in brackets.
 """
+from asyncio import Semaphore, TimeoutError, wait
+from collections import Counter
 from enum import Enum
-from discord import Embed
+from typing import NamedTuple
+from aiohttp import ClientError
+from aiohttp_wrapper import HTTPStatusError
+from discord import Embed, HTTPException
 from discord.ext import commands
+from helpers import SearchCache, SynonymResolver, TitleCatalogue, \
+    UpstreamUnavailable, WorkerPool
+from helpers.database_helpers import SERVER_SETTINGS
+from helpers.discord_helpers import MAX_EMBED_CHARS, MAX_EMBEDS, \
+    edit_embeds, send_embeds
+from helpers.metrics_helpers import cache_metrics, worker_metrics
+from helpers.synonym_helpers import synonym_urls
 from minoshiro import Medium, Minoshiro, Site
+from minoshiro.web_api import ani_list
+from time import monotonic
 import datetime
 import re
 
+# What fetching from a site raises once its retries are used up or while it
+# is being turned away
+UPSTREAM_ERRORS = (UpstreamUnavailable, HTTPStatusError, ClientError,
+                   TimeoutError)
+
 
 class Replace(Enum):
     MAL = 1
@@ -35,6 +54,15 @@ def cleanup_description(desc) -> str:
     return desc
 
 
+MULTI_CODEBLOCK_PATTERN = re.compile(r"`{3}([\S]+)?\n([\s\S]+)\n`{3}")
+SINGLE_CODEBLOCK_PATTERN = re.compile(r"\`(.*\s?)\`")
+EMOJI_PATTERN = re.compile(r'<a?:.+?:([0-9]{15,21})>')
+MENTION_PATTERN = re.compile(r"<@.?[0-9]*?>")
+# A bracket pair that isn't a custom emoji or channel mention
+PAIR_PATTERN = re.compile(
+    r"\{[^{}]*\}|<(?!a?:\w+:\d+>|#\d+>)[^<>]*>|\][^[\]]*\[")
+
+
 def clean_message(message) -> str:
     """
     Returns a message, but stripped of all code markup and emojis
@@ -42,70 +70,102 @@ def clean_message(message) -> str:
     :param message: a message string
     :returns: message string - code markup and emojis
     """
-    no_multi_codeblocks = re.sub(
-        r"`{3}([\S]+)?\n([\s\S]+)\n`{3}", "", message.clean_content)
-    no_single_codeblocks = re.sub(r"\`(.*\s?)\`", "", no_multi_codeblocks)
-    no_emojis = re.sub(r'<:.+?:([0-9]{15,21})>', "", no_single_codeblocks)
-    no_anim_emojis = re.sub(r'<a:.+?:([0-9]{15,21})>', "", no_emojis)
-    return no_anim_emojis
-
-
-def get_all_searches(message, expanded_allowed):
-    all_matches = list(re.finditer(
-            r"\{{2}([^}]*)\}{2}|\<{2}([^>]*)\>{2}|\]{2}([^]]*)\[{2}",
-            message, re.S))
-    if len(all_matches) > 1:
-        expanded_allowed = False
-    for match in all_matches:
-        if '<<' in match.group(0):
-            cleaned_search = re.sub(r"\<{2}|\>{2}", "", match.group(0))
-            url_cleaned = re.sub(r'(http(s)?:\/\/.)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{2,256}\.[a-z]{2,6}\b([-a-zA-Z0-9@:%_\+.~#?&//=]*)', '', cleaned_search)
-            if not url_cleaned:
-                return False
-            yield {
-                'medium':  Medium.MANGA,
-                'search': cleaned_search,
-                'expanded': expanded_allowed}
-        if '{{' in match.group(0):
-            cleaned_search = re.sub(r"\{{2}|\}{2}", "", match.group(0))
-            yield {
-                'medium': Medium.ANIME,
-                'search': cleaned_search,
-                'expanded': expanded_allowed}
-        if ']]' in match.group(0):
-            cleaned_search = re.sub(r"\]{2}|\[{2}", "", match.group(0))
-            yield {
-                'medium': Medium.LN,
-                'search': cleaned_search,
-                'expanded': expanded_allowed}
-
-        message = re.sub(re.escape(match.group(0)), "", message)
-
-    all_matches = list(re.finditer(r"\{([^{}]*)\}|\<([^<>]*)\>|\]([^[\]]*)\[",
-                             message, re.S))
-    for match in all_matches:
-        if '<' in match.group(0):
-            cleaned_search = re.sub(r"\<|\>", "", match.group(0))
-            url_cleaned = re.sub(r'(http(s)?:\/\/.)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{2,256}\.[a-z]{2,6}\b([-a-zA-Z0-9@:%_\+.~#?&//=]*)', '', cleaned_search)
-            if not url_cleaned:
-                return False
-            yield {
-                'medium': Medium.MANGA,
-                'search': cleaned_search,
-                'expanded': False}
-        if '{' in match.group(0):
-            cleaned_search = re.sub(r"\{|\}", "", match.group(0))
-            yield {
-                'medium': Medium.ANIME,
-                'search': cleaned_search,
-                'expanded': False}
-        if ']' in match.group(0):
-            cleaned_search = re.sub(r"\]|\[", "", match.group(0))
-            yield {
-                'medium': Medium.LN,
-                'search': cleaned_search,
-                'expanded': False}
-    return
+    no_multi_codeblocks = MULTI_CODEBLOCK_PATTERN.sub(
+        "", message.clean_content)
+    no_single_codeblocks = SINGLE_CODEBLOCK_PATTERN.sub(
+        "", no_multi_codeblocks)
+    return EMOJI_PATTERN.sub("", no_single_codeblocks)
+
+
+def prefilter_message(message):
+    """
+    Cheaply decides whether a message could contain a request, without
+    building `message.clean_content`. Each check is cheaper than the next.
+    :param message: a discord message
+    :returns: None if the message may contain a request, else the name of
+        the check that rejected it
+    """
+    if message.author.bot:
+        return 'bot'
+    content = message.content
+    if '{' not in content and '<' not in content and ']' not in content:
+        return 'no_brackets'
+    if MENTION_PATTERN.search(content):
+        return 'mention'
+    if not PAIR_PATTERN.search(content):
+        return 'no_pairs'
+    return None
+
+
+class SearchRequest(NamedTuple):
+    medium: Medium
+    search: str
+    expanded: bool
+
+
+class CommandRequest(NamedTuple):
+    command: str
+
+
+# One alternative per bracket type, doubles first so {{x}} isn't read as {x}
+REQUEST_PATTERN = re.compile(
+    r"\{\{([^}]*)\}\}|<<([^>]*)>>|\]\]([^\]]*)\[\["
+    r"|\{([^{}]*)\}|<([^<>]*)>|\]([^[\]]*)\[")
+# (medium, is double, opening bracket) for each group of REQUEST_PATTERN
+REQUEST_GROUPS = (
+    None,
+    (Medium.ANIME, True, '{{'),
+    (Medium.MANGA, True, '<<'),
+    (Medium.LN, True, ']]'),
+    (Medium.ANIME, False, '{'),
+    (Medium.MANGA, False, '<'),
+    (Medium.LN, False, ']'),
+)
+BRACKET_PATTERN = re.compile(r'[<>{}[\]]')
+URL_PATTERN = re.compile(
+    r'(http(s)?:\/\/.)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{2,256}\.[a-z]{2,6}\b'
+    r'([-a-zA-Z0-9@:%_\+.~#?&//=]*)')
+
+
+def get_all_requests(message, expanded_allowed) -> list:
+    """
+    Finds every request in a message in a single scan
+    {anime}, <manga> and ]light novel[ are searches, doubling the brackets
+    asks for expanded info, which is only given if the message has a single
+    double bracketed search. A bracketed text starting with ! is a command.
+    A manga search that is only a url, e.g. <https://...>, ends the searches.
+    :param message: the cleaned message string
+    :param expanded_allowed: whether expanded info may be given
+    :returns: a list of `SearchRequest` and `CommandRequest` in the order
+        they appear in the message
+    """
+    requests = []
+    doubles = 0
+    searching = True
+    for match in REQUEST_PATTERN.finditer(message):
+        group = match.lastindex
+        medium, double, bracket = REQUEST_GROUPS[group]
+        search = match.group(group)
+        command = BRACKET_PATTERN.sub('', search)
+        if command.startswith('!'):
+            requests.append(CommandRequest(command))
+            continue
+        if not searching:
+            continue
+        if double:
+            search = search.replace(bracket, '')
+            doubles += 1
+        if medium == Medium.MANGA and not URL_PATTERN.sub('', search):
+            searching = False
+            continue
+        requests.append(SearchRequest(medium, search, double))
+    if doubles > 1 or not expanded_allowed:
+        requests = [
+            request._replace(expanded=False)
+            if isinstance(request, SearchRequest) else request
+            for request in requests
+        ]
+    return requests
 
 
 def get_response_dict(entry_info, medium):
@@ -138,9 +198,9 @@ def get_response_dict(entry_info, medium):
     resp_dict['image'] = entry_info[Site.ANILIST]['coverImage']['medium']
     if medium == Medium.ANIME:
         resp_dict['info']['episodes'] = entry_info[Site.ANILIST]['episodes']
-        temp_date = datetime.datetime.now() + datetime.timedelta(
-            seconds=
-            entry_info[Site.ANILIST]['nextAiringEpisode']['timeUntilAiring']) \
+        # airingAt rather than timeUntilAiring so cached entries stay right
+        temp_date = datetime.datetime.fromtimestamp(
+            entry_info[Site.ANILIST]['nextAiringEpisode']['airingAt']) \
             if entry_info[Site.ANILIST] and \
             not entry_info[Site.ANILIST]['status'] == 'FINISHED' else None
         if temp_date:
@@ -153,133 +213,755 @@ def get_response_dict(entry_info, medium):
     return resp_dict
 
 
+def encode_entry_info(entry_info) -> dict:
+    """
+    :param entry_info: a dict of {Site: data}
+    :returns: the dict with JSON keys, to send to or from a search worker
+    """
+    return {str(site.value): data for site, data in entry_info.items()}
+
+
+def decode_entry_info(entry_info) -> dict:
+    """
+    :param entry_info: a dict made by `encode_entry_info`
+    :returns: the dict of {Site: data}
+    """
+    return {Site(int(site)): data for site, data in entry_info.items()}
+
+
+# Underlines the footer of every embed
+FOOTER_TITLE = '\\_' * 59
+
+
+class Lookups():
+    """
+    Looks up searches on AniList and the secondary sites through the
+    search cache. The cog runs one itself, or one runs in every search
+    worker and the cog reaches them through `RemoteLookups`.
+    """
+    __slots__ = ('mino', 'cache', 'synonyms', 'catalogue', 'session_manager',
+                 'logger', 'footer', 'embed_time')
+
+    def __init__(self, mino, cache, synonyms, catalogue, session_manager,
+                 logger, footer, metrics):
+        """
+        :param mino: the Minoshiro instance
+        :param cache: the SearchCache
+        :param synonyms: the SynonymResolver
+        :param catalogue: the TitleCatalogue
+        :param session_manager: the HTTPClient shared with Minoshiro
+        :param logger: logger object used for logging
+        :param footer: the footer of every embed
+        :param metrics: the Metrics of the process
+        """
+        self.mino = mino
+        self.cache = cache
+        self.synonyms = synonyms
+        self.catalogue = catalogue
+        self.session_manager = session_manager
+        self.logger = logger
+        self.footer = footer
+        self.embed_time = metrics.histogram('stage_seconds', stage='embed')
+        metrics.add_collector(cache_metrics(cache))
+
+    @classmethod
+    async def create(cls, search_config, database_config, db_controller,
+                     session_manager, logger, footer, metrics):
+        """
+        :param search_config: the search_info section of config.yml
+        :param database_config: the database_info section of config.yml
+        :param db_controller: the PostgresController
+        :param session_manager: the HTTPClient shared with Minoshiro
+        :param logger: logger object used for logging
+        :param footer: the footer of every embed
+        :param metrics: the Metrics of the process
+        :return: the lookups
+        """
+        mino = await Minoshiro.from_postgres(database_config)
+        # Minoshiro builds its own SessionManager, which only closes its
+        # session when garbage collected, so close it before replacing it
+        for replaced in {mino.session_manager, mino.kitsu.session_manager}:
+            if replaced.session:
+                await replaced.session.close()
+                replaced.session = None
+        mino.session_manager = session_manager
+        mino.kitsu.session_manager = session_manager
+        cache = SearchCache(
+            db_controller,
+            logger,
+            maxsize=search_config.get('cache_size', 1024),
+            ttls=search_config.get('cache_ttls'),
+            airing_ttl=search_config.get('airing_ttl', 3600),
+            stale_ttl=search_config.get('stale_ttl', 604800),
+            miss_size=search_config.get('miss_cache_size', 4096),
+            miss_ttl=search_config.get('miss_ttl', 600))
+        synonyms = SynonymResolver(
+            search_config.get('synonyms_path', 'roboragi_old/synonyms.db'),
+            logger)
+        catalogue = TitleCatalogue(
+            search_config.get('catalogue_path', 'data/catalogue.tsv'),
+            logger, cutoff=search_config.get('catalogue_cutoff', 0.95))
+        return cls(mino, cache, synonyms, catalogue, session_manager, logger,
+                   footer, metrics)
+
+    async def primary(self, thing):
+        """
+        Searches AniList for a single request
+        :param thing: a `SearchRequest` from `get_all_requests`
+        :returns: a tuple of (entry_info, embed), the embed is None if
+            nothing was found
+        """
+        entry_info = {}
+        if self.cache.is_known_miss(thing.search, thing.medium):
+            return entry_info, None
+        self.logger.info(f'Searching for {thing.search}')
+        try:
+            links = self.synonyms.resolve(thing.search, thing.medium)
+            if links and links.get('ani'):
+                entry_info = await self.__get_data_by_id(
+                    links['ani'], thing.medium)
+                entry_info.update(synonym_urls(links))
+            else:
+                anilist_id = self.catalogue.resolve(
+                    thing.search, thing.medium) or \
+                    self.catalogue.resolve_close(thing.search, thing.medium)
+                if anilist_id:
+                    entry_info = await self.__get_data_by_id(
+                        anilist_id, thing.medium)
+                else:
+                    entry_info = await self.__get_data(
+                        thing.search, thing.medium, [Site.ANILIST])
+        except Exception as e:
+            self.logger.warning(
+                f'Error searching for {thing.search}: {e}')
+            return entry_info, None
+        with self.embed_time.time():
+            try:
+                resp = get_response_dict(entry_info, thing.medium)
+            except AssertionError:
+                self.cache.add_miss(thing.search, thing.medium)
+                return entry_info, None
+            return entry_info, self.__build_entry_embed(resp, thing.expanded)
+
+    async def secondary(self, title, medium, site):
+        """
+        Searches a secondary site for a title found on AniList
+        :param title: the AniList title
+        :param medium: the Medium searched for
+        :param site: the Site to search
+        :returns: a dict of {Site: data}
+        """
+        return await self.__get_data(title, medium, [site])
+
+    async def handle(self, job) -> dict:
+        """
+        Runs a lookup sent by `RemoteLookups` to a search worker
+        :param job: the lookup
+        :returns: its result
+        """
+        medium = Medium(job['medium'])
+        if job['op'] == 'primary':
+            entry_info, embed = await self.primary(
+                SearchRequest(medium, job['search'], job['expanded']))
+            return {
+                'entry_info': encode_entry_info(entry_info),
+                'embed': embed.to_dict() if embed else None
+            }
+        entry_info = await self.secondary(
+            job['title'], medium, Site(job['site']))
+        return {'entry_info': encode_entry_info(entry_info)}
+
+    async def __get_data(self, search, medium, sites):
+        """
+        Gets the data for a search from the cache, falling back to
+        Minoshiro and caching whatever it finds
+        :param search: the search text
+        :param medium: the Medium searched for
+        :param sites: the sites to search
+        :returns: a dict of {Site: data}
+        """
+        return await self.cache.get_or_fetch(
+            search, medium, sites,
+            lambda: self.__fetch_data(search, medium, sites),
+            lambda stale: self.__refresh_data(search, medium, sites, stale))
+
+    async def __get_data_by_id(self, anilist_id, medium):
+        """
+        Gets the AniList data for a known id, skipping the fuzzy search.
+        Falls back to Minoshiro's copy if AniList is unavailable or
+        failing.
+        :param anilist_id: the AniList id
+        :param medium: the Medium searched for
+        :returns: a dict of {Site: data}
+        """
+        async def fetch():
+            try:
+                resp = await ani_list.get_entry_by_id(
+                    self.mino.session_manager, medium, anilist_id)
+            except UPSTREAM_ERRORS:
+                resp = await self.mino.db_controller.medium_data_by_id(
+                    str(anilist_id), medium, Site.ANILIST)
+                if not resp:
+                    raise
+            return {Site.ANILIST: resp} if resp else {}
+
+        return await self.cache.get_or_fetch(
+            f'anilist:{anilist_id}', medium, [Site.ANILIST], fetch,
+            lambda stale: self.__refresh_data(
+                f'anilist:{anilist_id}', medium, [Site.ANILIST], stale))
+
+    async def __fetch_data(self, search, medium, sites):
+        """
+        Searches Minoshiro for a search. Minoshiro answers from its own
+        cache when it can and swallows the errors of every site, so a
+        search that found nothing because its sites were failing raises
+        instead of being cached or remembered as a miss.
+        :param search: the search text
+        :param medium: the Medium searched for
+        :param sites: the sites to search
+        :returns: a dict of {Site: data}
+        :raises UpstreamUnavailable: if nothing was found and a site
+            failed or turned the search away
+        """
+        started = monotonic()
+        entry_info = {}
+        async for site, data in self.mino.yield_data(
+                search, medium, sites=sites):
+            entry_info[site] = data
+        if not entry_info:
+            failing = [
+                site.name for site in sites
+                if self.__failing_since(site, started)
+            ]
+            if failing:
+                raise UpstreamUnavailable(
+                    f'{", ".join(failing)} failed searching for {search}')
+        return entry_info
+
+    def __failing_since(self, site, since):
+        """
+        :param site: a Site
+        :param since: a monotonic time
+        :returns: whether a request to the site failed or was turned away
+            since then
+        """
+        upstreams = self.session_manager.upstreams
+        name = site.name.lower()
+        return name in upstreams and upstreams[name].failing_since(since)
+
+    async def __refresh_data(self, search, medium, sites, stale):
+        """
+        Refreshes a stale cache entry. AniList entries are fetched again
+        by id, since Minoshiro would hand back its own day old copy.
+        :param search: the search text
+        :param medium: the Medium searched for
+        :param sites: the sites to search
+        :param stale: the stale dict of {Site: data}
+        :returns: a dict of {Site: data}
+        """
+        entry_info = dict(stale)
+        anilist = stale.get(Site.ANILIST)
+        if anilist and anilist.get('id'):
+            resp = await ani_list.get_entry_by_id(
+                self.mino.session_manager, medium, anilist['id'])
+            if resp:
+                entry_info[Site.ANILIST] = resp
+                await self.mino.db_controller.set_medium_data(
+                    str(resp['id']), medium, Site.ANILIST, resp)
+        others = [site for site in sites if site != Site.ANILIST]
+        if others:
+            entry_info.update(
+                await self.__fetch_data(search, medium, others))
+        return entry_info
+
+    def __build_entry_embed(self, entry_info, is_expanded):
+        info_text = f'{entry_info["kana"]}\n\n('
+        for key, data in entry_info['info'].items():
+            if not data:
+                continue
+            info_text += f'**{key.title()}**: {data} | '
+        info_text = info_text.rstrip(' | ') + ')'
+
+        try:
+            embed = Embed(
+                title=entry_info['title'],
+                description=entry_info['links'],
+                type='rich'
+            )
+            embed.set_thumbnail(url=entry_info['image'])
+            embed.add_field(
+                name='__Info__',
+                value=info_text,
+                inline=False
+            )
+            if is_expanded:
+                if len(entry_info['synopsis'].rstrip()) > 1023:
+                    desc_text = entry_info['synopsis'].rstrip()[:1020] + '...'
+                else:
+                    desc_text = entry_info['synopsis'].rstrip()
+                embed.add_field(
+                    name='__Description__',
+                    value=desc_text,
+                    inline=False
+                )
+            embed.add_field(
+                name=FOOTER_TITLE,
+                value=self.footer,
+                inline=False
+            )
+            return embed
+        except Exception as e:
+            self.logger.warning(f'Error creating embed: {e}')
+
+
+class RemoteLookups():
+    """
+    Sends the lookups of the cog to the search workers, so the searching
+    and the embeds are done outside the processes talking to Discord.
+    """
+    __slots__ = ('pool', 'logger')
+
+    def __init__(self, pool, logger):
+        """
+        :param pool: the WorkerPool of the search workers
+        :param logger: logger object used for logging
+        """
+        self.pool = pool
+        self.logger = logger
+
+    async def primary(self, thing):
+        """
+        Same as `Lookups.primary`, nothing is found if no worker answers
+        """
+        try:
+            result = await self.pool.request({
+                'op': 'primary',
+                'medium': thing.medium.value,
+                'search': thing.search,
+                'expanded': thing.expanded
+            }, SearchCache.make_key(
+                thing.search, thing.medium, [Site.ANILIST]))
+        except (ConnectionError, RuntimeError, TimeoutError) as e:
+            self.logger.warning(
+                f'Error searching for {thing.search}: {e}')
+            return {}, None
+        embed = result['embed']
+        return decode_entry_info(result['entry_info']), \
+            Embed.from_dict(embed) if embed else None
+
+    async def secondary(self, title, medium, site):
+        """
+        Same as `Lookups.secondary`
+        """
+        result = await self.pool.request({
+            'op': 'secondary',
+            'medium': medium.value,
+            'title': title,
+            'site': site.value
+        }, SearchCache.make_key(title, medium, [site]))
+        return decode_entry_info(result['entry_info'])
+
+
 class Search(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
         self.logger = bot.logger
-        self.footer_title = ''
-        for x in range(0, 59):
-            self.footer_title += '\_'
+        self.footer_title = FOOTER_TITLE
         self.footer = bot.footer
+        self.filter_stats = Counter()
+        self.concurrent_searches = \
+            bot.search_config.get('concurrent_searches', True)
+        self.max_concurrent_searches = \
+            bot.search_config.get('max_concurrent_searches', 5)
+        self.edit_delay = bot.search_config.get('edit_delay', 1)
+        self.secondary_deadline = \
+            bot.search_config.get('secondary_deadline', 10)
+        self.embeds_per_message = min(
+            bot.search_config.get('embeds_per_message', MAX_EMBEDS),
+            MAX_EMBEDS)
+        self.followups = set()
+        self.stage_times = {
+            stage: bot.metrics.histogram('stage_seconds', stage=stage)
+            for stage in ('parse', 'primary', 'secondary', 'send', 'edit',
+                          'log')
+        }
+        bot.metrics.add_collector(self.__collect_metrics)
 
     @classmethod
     async def create_search(cls, bot):
         search = cls(bot)
-        print(search.bot.database_config)
-        search.mino = await Minoshiro.from_postgres(
-            search.bot.database_config
-        )
+        if bot.search_workers:
+            pool = WorkerPool(
+                bot.search_workers, bot.worker_config.get('timeout', 30))
+            bot.metrics.add_collector(worker_metrics(pool))
+            search.lookups = RemoteLookups(pool, search.logger)
+        else:
+            search.lookups = await Lookups.create(
+                bot.search_config, bot.database_config, bot.db_controller,
+                bot.session_manager, search.logger, search.footer,
+                bot.metrics)
         return search
 
+    def __collect_metrics(self):
+        """
+        :returns: the metrics of the cog, read when they are scraped
+        """
+        metrics = [
+            ('messages_total', 'counter', {'result': result}, count)
+            for result, count in self.filter_stats.items()
+        ]
+        metrics.append(('followups_running', 'gauge', {}, len(self.followups)))
+        return metrics
+
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.author.bot:
+        rejected_by = prefilter_message(message)
+        if rejected_by:
+            self.filter_stats[rejected_by] += 1
             return
-        discord_user_id_regex = "<@.?[0-9]*?>"
-        if re.search(discord_user_id_regex, message.content):
+        server_id = message.guild.id if message.guild else None
+        with self.stage_times['parse'].time():
+            requests = get_all_requests(
+                clean_message(message),
+                self.bot.db_controller.get_server_setting(
+                    server_id, 'expanded'))
+        if not requests:
+            self.filter_stats['no_requests'] += 1
             return
-        string = r"{]<"
-        if not any(elem in message.clean_content for elem in string):
+        self.filter_stats['passed'] += 1
+        searches = []
+        for request in requests:
+            if isinstance(request, CommandRequest):
+                await self.__execute_command(message, request.command)
+            else:
+                searches.append(request)
+        if not searches:
             return
-        cleaned_message = await self.__execute_commands(
-                message)
-        entry_info = {}
-        for thing in get_all_searches(cleaned_message, True):
-            async with message.channel.typing():
-                self.logger.info(f'Searching for {thing["search"]}')
-                try:
-                    async for data in self.mino.yield_data(
-                            thing['search'],
-                            thing['medium'],
-                            sites=[Site.ANILIST]):
-                        entry_info[data[0]] = data[1]
-                except Exception as e:
-                    self.logger.warning(
-                        f'Error searching for {thing["search"]}: {e}')
-                try:
-                    resp = get_response_dict(entry_info, thing['medium'])
-                except AssertionError:
-                    await message.add_reaction('\N{Cross Mark}')
-                    continue
-                embed = self.__build_entry_embed(resp, thing['expanded'])
-                info_message = None
-                if embed is not None:
-                    self.logger.info('Found entry, creating message')
-                    info_message = await message.channel.send(embed=embed)
-                else:
-                    await message.add_reaction('\N{Cross Mark}')
-                if not info_message:
-                    await message.add_reaction('\N{Cross Mark}')
-                    return
-                try:
-                    if thing['medium'] == Medium.ANIME:
-                        local_sites = [Site.KITSU, Site.ANIDB]
-                    elif thing['medium'] == Medium.VN:
-                        return
-                    elif thing['medium'] == Medium.LN:
-                        local_sites = \
-                            [Site.NOVELUPDATES, Site.LNDB, Site.KITSU]
-                    else:
-                        local_sites = [Site.MANGAUPDATES, Site.KITSU]
-                    async for data in self.mino.yield_data(
-                            resp['title'], thing['medium'], sites=local_sites):
-                        entry_info[data[0]] = data[1]
-                    temp_embed = info_message.embeds[0]
-                    temp_desc = temp_embed.description
-                    url_string = ''
-                    for key in entry_info.keys():
-                        if entry_info[key]['url']:
-                            url_string += f'[{Replace(key.value).name}]'\
-                                        f'({entry_info[key]["url"]}), '
-                    temp_desc = url_string.strip(', ')
-                    temp_embed.description = temp_desc
-                    await info_message.edit(embed=temp_embed)
-                except Exception as e:
-                    self.logger.warning(
-                        f'Error searching for {thing["search"]}: '
-                        f'{e}')
-                    await message.add_reaction('\N{Cross Mark}')
+        async with message.channel.typing():
+            if self.concurrent_searches:
+                await self.__search_concurrently(message, searches)
+            else:
+                await self.__search_sequentially(message, searches)
+
+    async def __search_sequentially(self, message, searches):
+        """
+        Look up every search in a message one after another, the next one
+        starting as soon as the one before is found
+        :param message: the discord message the searches came from
+        :param searches: the searches found in the message
+        """
+        await self.__search_concurrently(message, searches, 1)
+
+    async def __search_concurrently(self, message, searches, limit=None):
+        """
+        Start every search in a message at once, bounded by
+        `max_concurrent_searches`, while still posting results in the
+        order they appear in the message
+        :param message: the discord message the searches came from
+        :param searches: the searches found in the message
+        :param limit: how many searches may run at once, None for
+            `max_concurrent_searches`
+        """
+        semaphore = Semaphore(limit or self.max_concurrent_searches)
+
+        async def limited(coro):
+            async with semaphore:
+                return await coro
+
+        lookups = [
+            self.bot.loop.create_task(limited(self.__lookup_primary(thing)))
+            for thing in searches
+        ]
+        try:
+            await self.__post_results(message, searches, lookups)
+        finally:
+            for lookup in lookups:
+                lookup.cancel()
+
+    async def __lookup_primary(self, thing):
+        """
+        Timed `Lookups.primary`
+        """
+        with self.stage_times['primary'].time():
+            return await self.lookups.primary(thing)
+
+    async def __lookup_secondary(self, title, medium, site):
+        """
+        Timed `Lookups.secondary`
+        """
+        with self.stage_times['secondary'].time():
+            return await self.lookups.secondary(title, medium, site)
+
+    async def __post_results(self, message, searches, lookups):
+        """
+        Posts the results of the primary lookups in the order of the
+        searches. Up to `embeds_per_message` results share a message. Its
+        first result is sent as soon as it is found, together with any
+        found by then. The later ones are edited in together once every
+        lookup of the message finished, or after `edit_delay` seconds for
+        the ones found by then, so a message takes one edit unless some
+        lookups are slow. The followup of a message starts once it is full
+        or every lookup finished.
+        :param message: the discord message the searches came from
+        :param searches: the searches found in the message
+        :param lookups: a list with a task for the result of each search
+        """
+        found = []
+        sent = 0
+        info_message = None
+        deadline = 0
+        for index, (thing, lookup) in enumerate(zip(searches, lookups)):
+            if len(found) > sent and not lookup.done():
+                await wait([lookup], timeout=max(deadline - monotonic(), 0))
+                if not lookup.done():
+                    info_message, found = await self.__publish(
+                        message, found, sent, info_message)
+                    sent = len(found)
+                    deadline = monotonic() + self.edit_delay
+            entry_info, embed = await lookup
+            if embed is None:
+                await message.add_reaction('\N{Cross Mark}')
+                continue
+            if found and (
+                    len(found) >= self.embeds_per_message or
+                    sum(len(item[2]) for item in found) + len(embed)
+                    > MAX_EMBED_CHARS):
+                if len(found) > sent:
+                    info_message, found = await self.__publish(
+                        message, found, sent, info_message)
+                if found:
+                    self.__start_followup(message, found, info_message)
+                found, sent, info_message = [], 0, None
+            found.append((thing, entry_info, embed))
+            following = lookups[index + 1] if index + 1 < len(lookups) \
+                else None
+            if info_message is None and not (
+                    following is not None and following.done()):
+                info_message, found = await self.__publish(
+                    message, found, sent, info_message)
+                sent = len(found)
+                deadline = monotonic() + self.edit_delay
+        if len(found) > sent:
+            info_message, found = await self.__publish(
+                message, found, sent, info_message)
+        if found:
+            self.__start_followup(message, found, info_message)
+
+    async def __publish(self, message, found, sent, info_message):
+        """
+        Sends the results of a message that were not sent yet, in a new
+        message or edited into the one holding the earlier ones. If Discord
+        refuses them they are sent one per message instead.
+        :param message: the discord message the searches came from
+        :param found: a list of (SearchRequest, entry_info, embed)
+        :param sent: how many of them are already in `info_message`
+        :param info_message: the message holding them, None if not sent yet
+        :returns: a tuple of the message and the results it holds
+        """
+        embeds = [embed for _, _, embed in found]
+        try:
+            if info_message is None:
+                self.logger.info(
+                    f'Found {len(found)} entries, creating message')
+                with self.stage_times['send'].time():
+                    info_message = await send_embeds(message.channel, embeds)
+            else:
+                with self.stage_times['edit'].time():
+                    await edit_embeds(info_message, embeds)
+            return info_message, found
+        except HTTPException as e:
+            if len(found) == 1:
+                raise
+            self.logger.warning(
+                f'Error sending {len(found) - sent} embeds: {e}')
+        for item in found[sent:]:
+            await self.__send_results(message, [item])
+        return info_message, found[:sent]
+
+    async def __send_results(self, message, found):
+        """
+        Sends a list of results as one message, falling back to a message
+        per result if Discord refuses it, and starts their followups
+        :param message: the discord message the searches came from
+        :param found: a list of (SearchRequest, entry_info, embed)
+        """
+        self.logger.info(f'Found {len(found)} entries, creating message')
+        try:
+            with self.stage_times['send'].time():
+                info_message = await send_embeds(
+                    message.channel, [embed for _, _, embed in found])
+        except HTTPException as e:
+            if len(found) == 1:
+                raise
+            self.logger.warning(f'Error sending {len(found)} embeds: {e}')
+            for item in found:
+                await self.__send_results(message, [item])
+            return
+        self.__start_followup(message, found, info_message)
+
+    def __start_followup(self, message, found, info_message):
+        """
+        Finishes posted results in the background, so the secondary
+        sites don't hold up the next title
+        :param message: the discord message the searches came from
+        :param found: the list of results sent by `__send_results`
+        :param info_message: the message they were sent in
+        """
+        followup = self.bot.loop.create_task(
+            self.__finish_results(message, found, info_message))
+        self.followups.add(followup)
+        followup.add_done_callback(self.followups.discard)
+
+    async def __finish_results(self, message, found, info_message):
+        """
+        Searches every secondary site of every result at once, logs the
+        requests while they run and adds their links to the posted embeds.
+        Links found within `edit_delay` seconds go into one edit, any found
+        later into a second one. Searches still running after
+        `secondary_deadline` seconds are left out of the message. Only
+        this message stops waiting on them, the shared search in the cache
+        keeps going and its result is cached for the next request.
+        :param message: the discord message the searches came from
+        :param found: the list of results sent by `__send_results`
+        :param info_message: the message they were sent in
+        """
+        deadline = self.bot.loop.time() + self.secondary_deadline
+        lookups = {}
+        for index, (thing, entry_info, embed) in enumerate(found):
+            if thing.medium == Medium.VN:
+                continue
+            if thing.medium == Medium.ANIME:
+                local_sites = [Site.KITSU, Site.ANIDB]
+            elif thing.medium == Medium.LN:
+                local_sites = [Site.NOVELUPDATES, Site.LNDB, Site.KITSU]
+            else:
+                local_sites = [Site.MANGAUPDATES, Site.KITSU]
+            for site in local_sites:
+                if site not in entry_info:
+                    lookup = self.bot.loop.create_task(
+                        self.__lookup_secondary(
+                            embed.title, thing.medium, site))
+                    lookups[lookup] = index
+        for thing, _, embed in found:
+            with self.stage_times['log'].time():
                 await self.bot.db_controller.add_request({
                     'requester_id': message.author.id,
                     'message_id': info_message.id,
                     'server_id': message.channel.guild.id,
-                    'medium': thing['medium'],
-                    'title': resp['title']
+                    'medium': thing.medium,
+                    'title': embed.title
                 })
+        embeds = [embed for _, _, embed in found]
+        pending = set(lookups)
+        delay = self.edit_delay
+        while pending:
+            remaining = deadline - self.bot.loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await wait(
+                pending, timeout=min(delay, remaining))
+            delay = remaining
+            changed = set()
+            for lookup in done:
+                thing, entry_info, _ = found[lookups[lookup]]
+                try:
+                    site_info = lookup.result()
+                except Exception as e:
+                    self.logger.warning(
+                        f'Error searching for {thing.search}: {e}')
+                    continue
+                if site_info:
+                    entry_info.update(site_info)
+                    changed.add(lookups[lookup])
+            edited = False
+            for index in changed:
+                previous = embeds[index].description
+                embeds[index].description = \
+                    self.__link_description(found[index][1])
+                if sum(len(embed) for embed in embeds) > MAX_EMBED_CHARS:
+                    embeds[index].description = previous
+                    self.logger.info(
+                        f'Left out links that would make the message for '
+                        f'{embeds[index].title} too long')
+                else:
+                    edited = edited or embeds[index].description != previous
+            if not edited:
+                continue
+            try:
+                with self.stage_times['edit'].time():
+                    await edit_embeds(info_message, embeds)
+            except Exception as e:
+                self.logger.warning(f'Error adding links: {e}')
+        for lookup in pending:
+            lookup.cancel()
+        if pending:
+            self.logger.info(
+                f'Left out {len(pending)} links still missing after '
+                f'{self.secondary_deadline}s')
+
+    @staticmethod
+    def __link_description(entry_info):
+        """
+        :param entry_info: the dict of {Site: data} found for a title
+        :returns: the links to every site, for the embed description
+        """
+        url_string = ''
+        for key in entry_info.keys():
+            if entry_info[key]['url']:
+                url_string += f'[{Replace(key.value).name}]'\
+                              f'({entry_info[key]["url"]}), '
+        return url_string.strip(', ')
+
+    async def __execute_command(self, message, command):
+        """
+        Runs a command found in a message
+        :param message: the discord message the command came from
+        :param command: the command text, starting with !
+        """
+        if command.lower().startswith('!toggle '):
+            await self.__toggle_setting(message, command.lower()[8:].strip())
+        if command.lower() == '!help':
+            await message.channel.send(embed=self.__print_help_embed())
+        if message.guild and not self.bot.db_controller.get_server_setting(
+                message.guild.id, 'stats'):
+            return
+        if command.lower() == '!sstats':
+            await message.channel.send(
+                embed=await self.__print_server_stats(
+                    message.channel.guild))
+        if command.lower().startswith('!stats'):
+            if message.mentions:
+                await message.channel.send(
+                    embed=await self.__print_user_stats(
+                        message.mentions[0]))
+            else:
+                await message.channel.send(
+                    embed=Embed(
+                        title=f'Command Error :x:',
+                        description=f'General stats are disabled for '
+                                    f'now, mention someone to see '
+                                    f'individual stats'
+                    ),
+                    delete_after=3
+                )
 
-    async def __execute_commands(self, message):
-        cleaned_message = clean_message(message)
-        for match in re.finditer(r"\{([^{}]*)\}|\<([^<>]*)\>|\]([^[\]]*)\[",
-                                 cleaned_message, re.S):
-            command = re.sub(r'[<>{}[\]]', '', match.group(0))
-            if command.startswith('!'):
-                if command.lower() == '!toggle expanded':
-                    pass
-                if command.lower() == '!help':
-                    await message.channel.send(embed=self.__print_help_embed())
-                if command.lower() == '!sstats':
-                    await message.channel.send(
-                        embed=await self.__print_server_stats(
-                            message.channel.guild))
-                if command.lower().startswith('!stats'):
-                    if message.mentions:
-                        await message.channel.send(
-                            embed=await self.__print_user_stats(
-                                message.mentions[0]))
-                    else:
-                        await message.channel.send(
-                            embed=Embed(
-                                title=f'Command Error :x:',
-                                description=f'General stats are disabled for '
-                                            f'now, mention someone to see '
-                                            f'individual stats'
-                            ),
-                            delete_after=3
-                        )
-                cleaned_message = re.sub(
-                    re.escape(match.group(0)), "", cleaned_message)
-        return cleaned_message
+    async def __toggle_setting(self, message, setting):
+        """
+        Toggles a server setting, if the author may manage the server
+        :param message: the discord message the command came from
+        :param setting: the name of the setting
+        """
+        if setting not in SERVER_SETTINGS or not message.guild or \
+                not message.author.guild_permissions.manage_guild:
+            return
+        allowed = await self.bot.db_controller.toggle_server_setting(
+            message.guild.id, setting)
+        if allowed is None:
+            return
+        await message.channel.send(
+            f'{setting.title()} requests are now '
+            f'{"allowed" if allowed else "disallowed"}.')
 
     async def __print_user_stats(self, user):
         try:
@@ -371,42 +1053,3 @@ class Search(commands.Cog):
             return embed
         except Exception as e:
             self.logger.warning(f'Exception occured when printing help: {e}')
-
-    def __build_entry_embed(self, entry_info, is_expanded):
-        info_text = f'{entry_info["kana"]}\n\n('
-        for key, data in entry_info['info'].items():
-            if not data:
-                continue
-            info_text += f'**{key.title()}**: {data} | '
-        info_text = info_text.rstrip(' | ') + ')'
-
-        try:
-            embed = Embed(
-                title=entry_info['title'],
-                description=entry_info['links'],
-                type='rich'
-            )
-            embed.set_thumbnail(url=entry_info['image'])
-            embed.add_field(
-                name='__Info__',
-                value=info_text,
-                inline=False
-            )
-            if is_expanded:
-                if len(entry_info['synopsis'].rstrip()) > 1023:
-                    desc_text = entry_info['synopsis'].rstrip()[:1020] + '...'
-                else:
-                    desc_text = entry_info['synopsis'].rstrip()
-                embed.add_field(
-                    name='__Description__',
-                    value=desc_text,
-                    inline=False
-                )
-            embed.add_field(
-                name=self.footer_title,
-                value=self.footer,
-                inline=False
-            )
-            return embed
-        except Exception as e:
-            self.logger.warning(f'Error creating embed: {e}')
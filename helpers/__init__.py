@@ -1,3 +1,12 @@
+from .cache_helpers import LRUCache, SearchCache, SingleFlight
+from .catalogue_helpers import TitleCatalogue
 from .database_helpers import PostgresController
+from .http_helpers import HTTPClient, UpstreamUnavailable
+from .metrics_helpers import Metrics
+from .synonym_helpers import SynonymResolver
+from .title_helpers import TitleIndex
+from .worker_helpers import WorkerPool
 
-__all__ = ['PostgresController']
+__all__ = ['HTTPClient', 'LRUCache', 'Metrics', 'PostgresController',
+           'SearchCache', 'SingleFlight', 'SynonymResolver', 'TitleCatalogue',
+           'TitleIndex', 'UpstreamUnavailable', 'WorkerPool']
@@ -0,0 +1,307 @@
+"""
+Caches that sit in front of Minoshiro searches
+"""
+from asyncio import ensure_future, shield
+from collections import Counter, OrderedDict
+from json import dumps, loads
+from time import monotonic
+
+from minoshiro import Site
+
+
+def normalize_search(search) -> str:
+    """
+    Normalizes a search so trivially different requests share a cache entry
+    :param search: the search text
+    :return: the casefolded search with collapsed whitespace
+    """
+    return ' '.join(search.casefold().split())
+
+
+class LRUCache():
+    """
+    A bounded in-process cache that evicts the least recently used entry
+    once it is full. Every entry carries its own expiry time.
+    """
+    __slots__ = ('maxsize', 'entries')
+
+    def __init__(self, maxsize: int = 1024):
+        """
+        :param maxsize: the maximum number of entries kept
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Gets an entry, dropping it if it has expired
+        :param key: the cache key
+        :return: the cached value or None
+        """
+        try:
+            value, expires = self.entries[key]
+        except KeyError:
+            return None
+        if expires <= monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl):
+        """
+        Adds an entry, evicting the oldest ones if the cache is full
+        :param key: the cache key
+        :param value: the value to cache
+        :param ttl: seconds until the entry expires
+        """
+        self.entries[key] = (value, monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class SingleFlight():
+    """
+    Deduplicates concurrent calls for the same key. The first caller for a
+    key starts the call, everyone arriving while it runs awaits the same
+    future instead of starting their own.
+    """
+    __slots__ = ('flights', 'stats')
+
+    def __init__(self):
+        self.flights = {}
+        self.stats = Counter()
+
+    def __contains__(self, key):
+        return key in self.flights
+
+    def start(self, key, call):
+        """
+        Starts a call for a key unless one is already running
+        :param key: the key identifying the call
+        :param call: a coroutine function taking no arguments
+        :return: the future for the running call
+        """
+        try:
+            future = self.flights[key]
+        except KeyError:
+            self.stats['leaders'] += 1
+            future = ensure_future(call())
+            self.flights[key] = future
+            future.add_done_callback(lambda _: self.flights.pop(key, None))
+        else:
+            self.stats['coalesced'] += 1
+        return future
+
+    async def do(self, key, call):
+        """
+        Runs a call for a key, or waits on the one already running.
+        Cancelling one waiter does not cancel the shared call.
+        :param key: the key identifying the call
+        :param call: a coroutine function taking no arguments
+        :return: the result of the call
+        """
+        return await shield(self.start(key, call))
+
+
+class SearchCache():
+    """
+    Two tier cache for search results. The first tier is an `LRUCache`
+    local to the process, the second is the `search_cache` table shared by
+    every process using the same database.
+
+    Entries are keyed on (normalized search, medium, sites) and are fresh
+    for the shortest TTL of the sites they were fetched from, or for
+    `airing_ttl` if they belong to a show that is still airing. After that
+    they are stale but still served for another `stale_ttl` seconds while
+    a single background task per entry refreshes them.
+
+    Concurrent misses for the same key share one lookup, see `flights`.
+
+    Searches that found nothing can be remembered for `miss_ttl` seconds
+    in a separate, smaller `LRUCache`, so repeated typos and spam are
+    turned away without searching again.
+    """
+    __slots__ = ('db_controller', 'logger', 'memory', 'ttls', 'default_ttl',
+                 'airing_ttl', 'stale_ttl', 'flights', 'refreshes', 'misses',
+                 'miss_ttl', 'stats')
+
+    def __init__(self, db_controller, logger, maxsize: int = 1024,
+                 ttls: dict = None, default_ttl: int = 86400,
+                 airing_ttl: int = 3600, stale_ttl: int = 604800,
+                 miss_size: int = 4096, miss_ttl: int = 600):
+        """
+        :param db_controller: the `PostgresController` used for the
+            shared tier
+        :param logger: logger object used for logging
+        :param maxsize: the maximum number of entries kept in memory
+        :param ttls: a dict of site name to TTL in seconds,
+            e.g. {'anilist': 86400}
+        :param default_ttl: the TTL used for sites not in `ttls`
+        :param airing_ttl: the longest TTL for shows that are still airing
+        :param stale_ttl: how long a stale entry may still be served
+        :param miss_size: the maximum number of searches that found nothing
+            kept in memory
+        :param miss_ttl: how long a search that found nothing is remembered
+        """
+        self.db_controller = db_controller
+        self.logger = logger
+        self.memory = LRUCache(maxsize)
+        self.default_ttl = default_ttl
+        self.airing_ttl = airing_ttl
+        self.stale_ttl = stale_ttl
+        self.ttls = {
+            Site[name.upper()]: ttl for name, ttl in (ttls or {}).items()
+        }
+        self.flights = SingleFlight()
+        self.refreshes = SingleFlight()
+        self.misses = LRUCache(miss_size)
+        self.miss_ttl = miss_ttl
+        self.stats = Counter()
+
+    @staticmethod
+    def make_key(search, medium, sites) -> tuple:
+        """
+        Builds the cache key for a search
+        :param search: the search text
+        :param medium: the Medium searched for
+        :param sites: the sites searched
+        :return: a hashable key
+        """
+        return (
+            normalize_search(search),
+            medium.value,
+            ','.join(str(site.value) for site in sorted(
+                sites, key=lambda site: site.value))
+        )
+
+    def is_known_miss(self, search, medium) -> bool:
+        """
+        :param search: the search text
+        :param medium: the Medium searched for
+        :return: whether the search recently found nothing
+        """
+        if self.misses.get((normalize_search(search), medium.value)):
+            self.stats['known_misses'] += 1
+            return True
+        return False
+
+    def add_miss(self, search, medium):
+        """
+        Remembers that a search found nothing
+        :param search: the search text
+        :param medium: the Medium searched for
+        """
+        self.misses.set(
+            (normalize_search(search), medium.value), True, self.miss_ttl)
+
+    def ttl_for(self, sites, entry_info) -> int:
+        """
+        :param sites: the sites an entry was fetched from
+        :param entry_info: the dict of {Site: data} that was found
+        :return: how many seconds the entry stays fresh
+        """
+        ttl = min(self.ttls.get(site, self.default_ttl) for site in sites)
+        anilist = entry_info.get(Site.ANILIST)
+        if anilist and anilist.get('status') == 'RELEASING':
+            ttl = min(ttl, self.airing_ttl)
+            next_episode = anilist.get('nextAiringEpisode')
+            if next_episode:
+                ttl = min(ttl, max(next_episode['timeUntilAiring'], 60))
+        return ttl
+
+    async def get_or_fetch(self, search, medium, sites, fetch, refresh=None):
+        """
+        Gets a search result from the cache, calling `fetch` on a miss.
+        Stale entries are returned immediately and refreshed in the
+        background.
+        :param search: the search text
+        :param medium: the Medium searched for
+        :param sites: the sites searched
+        :param fetch: a coroutine function taking no arguments that
+            returns a dict of {Site: data}
+        :param refresh: a coroutine function taking the stale dict of
+            {Site: data} that returns a fresh one, defaults to `fetch`
+        :return: a dict of {Site: data}
+        """
+        key = self.make_key(search, medium, sites)
+        cached = self.memory.get(key)
+        if cached is not None:
+            self.stats['memory_hits'] += 1
+        else:
+            cached = await self.flights.do(
+                key, lambda: self.__load(key, sites, fetch))
+        entry_info, fresh_until = cached
+        if fresh_until <= monotonic():
+            self.stats['stale_hits'] += 1
+            self.__refresh(key, sites, refresh or (lambda _: fetch()),
+                           entry_info)
+        return dict(entry_info)
+
+    async def __load(self, key, sites, fetch):
+        """
+        Looks a key up in the database, calling `fetch` if it isn't there
+        :param key: the cache key
+        :param sites: the sites searched
+        :param fetch: the coroutine function doing the search
+        :return: a tuple of ({Site: data}, monotonic time it is fresh until)
+        """
+        row = await self.db_controller.get_cached_search(*key)
+        if row is None:
+            self.stats['misses'] += 1
+            entry_info = await fetch()
+            if not entry_info:
+                return entry_info, float('inf')
+            return await self.__set(key, sites, entry_info)
+        self.stats['database_hits'] += 1
+        entry_info = {
+            Site(int(site)): data for site, data in loads(row['data']).items()
+        }
+        cached = (entry_info, monotonic() + row['fresh'])
+        self.memory.set(key, cached, row['ttl'])
+        return cached
+
+    async def __set(self, key, sites, entry_info):
+        """
+        Stores a search result in both tiers
+        :param key: the cache key
+        :param sites: the sites searched
+        :param entry_info: the dict of {Site: data} that was found
+        :return: the tuple stored in memory
+        """
+        fresh = self.ttl_for(sites, entry_info)
+        ttl = fresh + self.stale_ttl
+        cached = (dict(entry_info), monotonic() + fresh)
+        self.memory.set(key, cached, ttl)
+        data = dumps(
+            {str(site.value): info for site, info in entry_info.items()})
+        await self.db_controller.set_cached_search(*key, data, fresh, ttl)
+        return cached
+
+    def __refresh(self, key, sites, refresh, entry_info):
+        """
+        Starts a background refresh of an entry unless one is running
+        :param key: the cache key
+        :param sites: the sites searched
+        :param refresh: the coroutine function doing the refresh
+        :param entry_info: the stale dict of {Site: data}
+        """
+        if key in self.refreshes:
+            return
+        self.refreshes.start(key, lambda: self.__run_refresh(
+            key, sites, refresh, dict(entry_info)))
+
+    async def __run_refresh(self, key, sites, refresh, entry_info):
+        """
+        Refreshes an entry and stores the result, logging any failure
+        """
+        try:
+            entry_info = await refresh(entry_info)
+            if entry_info:
+                await self.__set(key, sites, entry_info)
+        except Exception as e:
+            self.logger.warning(f'Error refreshing {key[0]}: {e}')
@@ -0,0 +1,156 @@
+"""
+Memory-mapped catalogue of the most popular AniList titles
+"""
+from mmap import ACCESS_READ, mmap
+from os import stat
+from time import monotonic
+
+from minoshiro import Medium
+
+from .cache_helpers import normalize_search
+from .title_helpers import TitleIndex
+
+
+def catalogue_line(title, medium, anilist_id) -> bytes:
+    """
+    :param title: a title or synonym of an entry
+    :param medium: the Medium of the entry
+    :param anilist_id: the AniList id of the entry
+    :return: the line for the title in a catalogue file
+    """
+    line = f'{normalize_search(title)}\t{medium.value}\t{anilist_id}\n'
+    return line.encode()
+
+
+class TitleCatalogue():
+    """
+    Looks titles up in a catalogue file without reading it into memory.
+
+    The file has a line of "title<TAB>medium<TAB>AniList id" for every
+    title and synonym of the entries in it, with titles normalized by
+    `normalize_search` and lines sorted bytewise, see `catalogue_line` and
+    build_catalogue.py. It is memory-mapped and binary searched, so only
+    the pages a lookup touches are read. A new file replacing it is picked
+    up within `check_interval` seconds.
+
+    For searches that aren't in it as they are, the titles of each medium
+    are also kept in a `TitleIndex`, built again whenever the file is, see
+    `resolve_close`.
+    """
+    __slots__ = ('path', 'logger', 'check_interval', 'cutoff', 'map',
+                 'indexes', 'mtime', 'next_check')
+
+    def __init__(self, path, logger, check_interval: int = 60,
+                 cutoff: float = 0.95):
+        """
+        :param path: path to the catalogue file
+        :param logger: logger object used for logging
+        :param check_interval: seconds between checks for a new file
+        :param cutoff: the lowest score of a close match, from 0 to 1, or
+            None to not index the titles
+        """
+        self.path = path
+        self.logger = logger
+        self.check_interval = check_interval
+        self.cutoff = cutoff
+        self.map = None
+        self.indexes = {}
+        self.mtime = None
+        self.next_check = 0
+        self.reload_if_changed()
+
+    def load(self):
+        """
+        Maps the catalogue file into memory and indexes its titles
+        """
+        with open(self.path, 'rb') as catalogue:
+            new_map = mmap(catalogue.fileno(), 0, access=ACCESS_READ)
+        if self.cutoff is not None:
+            self.indexes = self.index_titles(new_map)
+        old_map, self.map = self.map, new_map
+        if old_map is not None:
+            old_map.close()
+        self.logger.info(
+            f'Mapped {len(new_map)} bytes of title catalogue.')
+
+    @staticmethod
+    def index_titles(catalogue) -> dict:
+        """
+        :param catalogue: the contents of a catalogue file
+        :return: a dict of Medium value to a `TitleIndex` of the titles of
+            the medium, keeping the AniList id of each
+        """
+        indexes = {}
+        for line in catalogue[:].decode().splitlines():
+            title, medium, anilist_id = line.split('\t')
+            if medium not in indexes:
+                indexes[medium] = TitleIndex(normalize=str)
+            indexes[medium].add(title, int(anilist_id))
+        return {int(medium): index for medium, index in indexes.items()}
+
+    def reload_if_changed(self):
+        """
+        Maps the file again if it changed since it was last mapped
+        """
+        self.next_check = monotonic() + self.check_interval
+        try:
+            mtime = stat(self.path).st_mtime
+            if mtime != self.mtime:
+                self.load()
+                self.mtime = mtime
+        except (OSError, ValueError) as e:
+            self.logger.warning(f'Error loading title catalogue: {e}')
+
+    def resolve(self, search, medium):
+        """
+        Looks a search up in the catalogue
+        :param search: the search text
+        :param medium: the Medium searched for
+        :return: the AniList id of the most popular entry with that title,
+            or None
+        """
+        if monotonic() >= self.next_check:
+            self.reload_if_changed()
+        if not self.map or medium not in (Medium.ANIME, Medium.MANGA,
+                                          Medium.LN):
+            return None
+        key = f'{normalize_search(search)}\t{medium.value}\t'.encode()
+        catalogue = self.map
+        # Find the first line not sorting before the key. lo and hi are
+        # always the start of a line.
+        lo, hi = 0, len(catalogue)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = catalogue.rfind(b'\n', lo, mid) + 1 or lo
+            end = catalogue.find(b'\n', start)
+            if end < 0:
+                end = len(catalogue)
+            if catalogue[start:end] < key:
+                lo = end + 1
+            else:
+                hi = start
+        end = catalogue.find(b'\n', lo)
+        line = catalogue[lo:end if end >= 0 else len(catalogue)]
+        if not line.startswith(key):
+            return None
+        try:
+            return int(line[len(key):])
+        except ValueError:
+            return None
+
+    def resolve_close(self, search, medium):
+        """
+        Looks for the title closest to a search in the catalogue
+        :param search: the search text
+        :param medium: the Medium searched for
+        :return: the AniList id of the most popular entry with the closest
+            title scoring at least `cutoff`, or None
+        """
+        if monotonic() >= self.next_check:
+            self.reload_if_changed()
+        index = self.indexes.get(medium.value)
+        if index is None:
+            return None
+        matches = index.get_close_matches(
+            normalize_search(search), 1, self.cutoff)
+        return index.get(matches[0])[0] if matches else None
@@ -1,6 +1,42 @@
-from asyncpg import InterfaceError, create_pool
+from asyncio import Event, Queue, QueueEmpty, TimeoutError, ensure_future, \
+    sleep, wait_for
+from datetime import datetime
+
+from asyncpg import InterfaceError, connect, create_pool
 from asyncpg.pool import Pool
 
+# Request counts kept up to date as requests are written, as
+# {requests column: (per requester/server totals, per title counts)}
+ROLLUPS = {
+    'requester': ('user_requests', 'user_titles'),
+    'server': ('server_requests', 'server_titles')
+}
+
+# Server settings that can be toggled, with their value for servers that
+# never changed them
+SERVER_SETTINGS = {
+    'expanded': True,
+    'stats': True
+}
+
+# Channel notified with the server ID whenever its settings change
+SERVERS_CHANNEL = 'discordoragi_servers'
+
+# Seconds between two checks that the settings listener is still connected
+LISTEN_CHECK = 30
+
+# Arguments of create_pool that connect doesn't take
+POOL_OPTIONS = ('min_size', 'max_size', 'max_queries',
+                'max_inactive_connection_lifetime', 'setup', 'init')
+
+# Entry caches read by roboragi_old, as {table: whether it has a medium}
+CACHE_TABLES = {
+    'malanime': False,
+    'malmanga': True,
+    'anilistanime': False,
+    'anilistmanga': True
+}
+
 
 async def make_tables(pool: Pool, schema: str):
         """
@@ -29,8 +65,233 @@ async def make_tables(pool: Pool, schema: str):
         );
         """
 
+        search_cache = """
+        CREATE TABLE IF NOT EXISTS search_cache (
+        search VARCHAR,
+        medium SMALLINT,
+        sites VARCHAR,
+        data JSONB,
+        refresh timestamp,
+        expires timestamp,
+        PRIMARY KEY (search, medium, sites)
+        );
+        CREATE INDEX IF NOT EXISTS search_cache_expires_idx
+        ON search_cache (expires);
+        """
+
+        request_totals = """
+        CREATE TABLE IF NOT EXISTS request_totals (
+        id BOOLEAN DEFAULT TRUE CHECK (id),
+        requests BIGINT NOT NULL,
+        PRIMARY KEY (id)
+        );
+        """
+
+        # The stats are read from the rollup tables, so these only slowed
+        # down writing requests
+        requests_indexes = """
+        DROP INDEX IF EXISTS requests_requester_idx, requests_server_idx;
+        """
+
         await pool.execute(servers)
         await pool.execute(requests)
+        await pool.execute(requests_indexes)
+        await create_request_partitions(pool, datetime.now())
+        await pool.execute(search_cache)
+        await pool.execute(request_totals)
+        for column, (totals, titles) in ROLLUPS.items():
+            await pool.execute(f"""
+            CREATE TABLE IF NOT EXISTS {totals} (
+            {column} BIGINT,
+            requests BIGINT NOT NULL,
+            titles BIGINT NOT NULL,
+            PRIMARY KEY ({column})
+            );
+            CREATE INDEX IF NOT EXISTS {totals}_requests_idx
+            ON {totals} (requests);
+            CREATE TABLE IF NOT EXISTS {titles} (
+            {column} BIGINT,
+            title VARCHAR,
+            medium SMALLINT,
+            requests BIGINT NOT NULL,
+            PRIMARY KEY ({column}, title, medium)
+            );
+            CREATE INDEX IF NOT EXISTS {titles}_top_idx
+            ON {titles} ({column}, requests DESC, title);
+            """)
+        await backfill_rollups(pool)
+        for table, has_medium in CACHE_TABLES.items():
+            medium = 'medium VARCHAR(16),' if has_medium else ''
+            await pool.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+            id VARCHAR(16),
+            name VARCHAR(320),
+            {medium}
+            synonyms VARCHAR(320)[],
+            accesstimestamp timestamp DEFAULT current_timestamp,
+            dict JSONB,
+            PRIMARY KEY (id)
+            );
+            CREATE INDEX IF NOT EXISTS {table}_synonyms_idx
+            ON {table} USING GIN (synonyms);
+            CREATE INDEX IF NOT EXISTS {table}_name_idx
+            ON {table} (name);
+            """)
+
+
+async def backfill_rollups(pool: Pool):
+    """
+    Fills the rollup tables from the requests table, unless that has
+    already been done. Requests are locked against writes meanwhile.
+    :param pool: the connection pool.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute('LOCK TABLE request_totals IN EXCLUSIVE MODE;')
+            if await conn.fetchval('SELECT 1 FROM request_totals;'):
+                return
+            await conn.execute('LOCK TABLE requests IN SHARE MODE;')
+            await conn.execute("""
+            INSERT INTO request_totals (requests)
+            SELECT count(*) FROM requests;
+            """)
+            for column, (totals, titles) in ROLLUPS.items():
+                await conn.execute(f"""
+                DELETE FROM {titles};
+                DELETE FROM {totals};
+                INSERT INTO {titles} ({column}, title, medium, requests)
+                SELECT {column}, title, medium, count(*) FROM requests
+                GROUP BY {column}, title, medium;
+                INSERT INTO {totals} ({column}, requests, titles)
+                SELECT {column}, sum(requests), count(*) FROM {titles}
+                GROUP BY {column};
+                """)
+
+
+async def create_request_partitions(conn, since, months_ahead: int = 3):
+    """
+    Creates the monthly partitions of the requests table from the month of
+    `since` until `months_ahead` months from now, if the table is
+    partitioned. Requests outside of those go into `requests_default`.
+    The running bot calls this periodically, so the months ahead keep
+    being created.
+    :param conn: a connection or the connection pool.
+    :param since: the datetime of the first month that needs a partition.
+    :param months_ahead: how many months from now to create partitions for.
+    """
+    if isinstance(conn, Pool):
+        async with conn.acquire() as acquired:
+            return await create_request_partitions(
+                acquired, since, months_ahead)
+    partitioned = await conn.fetchval("""
+    SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('requests');
+    """)
+    if not partitioned:
+        return
+    now = datetime.now()
+    first = since.year * 12 + since.month - 1
+    last = now.year * 12 + now.month - 1 + months_ahead
+    for month in range(first, last + 1):
+        start = datetime(month // 12, month % 12 + 1, 1)
+        end = datetime((month + 1) // 12, (month + 1) % 12 + 1, 1)
+        if not await conn.fetchval(
+                'SELECT to_regclass($1) IS NULL;', f'requests_{start:%Y_%m}'):
+            continue
+        async with conn.transaction():
+            await create_request_partition(conn, start, end)
+
+
+async def create_request_partition(conn, start, end):
+    """
+    Creates the partition of the requests table for one month, unless
+    another process already did. Requests of that month already in
+    `requests_default` would make the partition fail, so the default
+    partition is detached, the requests moved into the new partition and
+    the default attached again.
+    :param conn: a connection in a transaction.
+    :param start: the datetime the month starts at.
+    :param end: the datetime the next month starts at.
+    """
+    name = f'requests_{start:%Y_%m}'
+    await conn.execute(
+        'SELECT pg_advisory_xact_lock(hashtext($1));', 'requests_partitions')
+    # to_regclass could miss a partition committed while waiting for the
+    # lock, pg_class is read with a fresh snapshot
+    if await conn.fetchval("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_class
+        WHERE relname = ($1)
+        AND relnamespace = current_schema()::regnamespace
+    );
+    """, name):
+        return
+    bounds = f"FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    stranded = await conn.fetchval("""
+    SELECT to_regclass('requests_default') IS NOT NULL AND EXISTS (
+        SELECT 1 FROM requests_default
+        WHERE logtime >= ($1) AND logtime < ($2)
+    );
+    """, start, end)
+    if not stranded:
+        await conn.execute(f"""
+        CREATE TABLE {name} PARTITION OF requests FOR VALUES {bounds};
+        """)
+        return
+    await conn.execute(f"""
+    ALTER TABLE requests DETACH PARTITION requests_default;
+    CREATE TABLE {name} PARTITION OF requests FOR VALUES {bounds};
+    WITH moved AS (
+        DELETE FROM requests_default
+        WHERE logtime >= '{start:%Y-%m-%d}' AND logtime < '{end:%Y-%m-%d}'
+        RETURNING *
+    )
+    INSERT INTO {name} SELECT * FROM moved;
+    ALTER TABLE requests ATTACH PARTITION requests_default DEFAULT;
+    """)
+
+
+async def partition_requests(pool: Pool, months_ahead: int = 3):
+    """
+    Turns the requests table into one range partitioned by month of
+    `logtime`, copying every request over. The table is locked while this
+    runs, so it is best done with the bot stopped.
+    :param pool: the connection pool.
+    :param months_ahead: how many months from now to create partitions for.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute('LOCK TABLE requests IN ACCESS EXCLUSIVE MODE;')
+            await conn.execute("""
+            ALTER TABLE requests RENAME TO requests_unpartitioned;
+            ALTER TABLE requests_unpartitioned
+            RENAME CONSTRAINT requests_pkey TO requests_unpartitioned_pkey;
+            DROP INDEX IF EXISTS requests_requester_idx, requests_server_idx;
+            ALTER SEQUENCE requests_id_seq OWNED BY NONE;
+            CREATE TABLE requests (
+            id INTEGER NOT NULL DEFAULT nextval('requests_id_seq'),
+            requester BIGINT,
+            server BIGINT,
+            medium SMALLINT,
+            title VARCHAR NOT NULL,
+            logtime timestamp NOT NULL DEFAULT current_timestamp,
+            PRIMARY KEY (id, requester, server, logtime)
+            ) PARTITION BY RANGE (logtime);
+            ALTER SEQUENCE requests_id_seq OWNED BY requests.id;
+            CREATE TABLE requests_default PARTITION OF requests DEFAULT;
+            """)
+            since = await conn.fetchval("""
+            SELECT min(logtime) FROM requests_unpartitioned;
+            """)
+            await create_request_partitions(
+                conn, since or datetime.now(), months_ahead)
+            await conn.execute("""
+            INSERT INTO requests (id, requester, server, medium, title,
+                                  logtime)
+            SELECT id, requester, server, medium, title,
+            COALESCE(logtime, current_timestamp)
+            FROM requests_unpartitioned;
+            DROP TABLE requests_unpartitioned;
+            """)
 
 
 class PostgresController():
@@ -39,26 +300,63 @@ class PostgresController():
     discordoragi will be put under the `discordoragi` schema unless a
     different schema name is passed to the __init__ method.
     """
-    __slots__ = ('pool', 'schema', 'logger')
+    __slots__ = ('pool', 'schema', 'logger', 'batch_size', 'flush_interval',
+                 'put_timeout', 'maintenance_interval', 'purge_grace',
+                 'request_queue', 'batch_full', 'request_writer',
+                 'maintainer', 'server_settings', 'listen_kwargs',
+                 'settings_listener', 'listen_keeper')
 
-    def __init__(self, pool: Pool, logger, schema: str = 'discordoragi'):
+    def __init__(self, pool: Pool, logger, schema: str = 'discordoragi', *,
+                 batch_size: int = 100, flush_interval: float = 0.5,
+                 queue_size: int = 10000, put_timeout: float = 1,
+                 maintenance_interval: float = 3600,
+                 purge_grace: float = 3600, listen_kwargs: dict = None):
         """
         Init method. Create the instance with the `get_instance` method to make
         sure you have all the tables needed.
         :param pool: the `asyncpg` connection pool.
         :param logger: logger object used for logging.
         :param schema: the schema name, default is `discordoragi`
+        :param batch_size: the number of requests written at once
+        :param flush_interval: the longest time in seconds a request waits
+            before being written
+        :param queue_size: the number of requests that can wait to be written
+        :param put_timeout: how long in seconds `add_request` waits for room
+            in a full queue before dropping the request
+        :param maintenance_interval: seconds between two runs of the
+            periodic maintenance, see `__maintain`
+        :param purge_grace: seconds an expired cached search is kept before
+            it is deleted
+        :param listen_kwargs: keyword arguments for the
+            :func:`asyncpg.connection.connect` function, used to listen for
+            server changes outside of the pool. Changes made by other
+            processes are not seen without them.
         """
         self.pool = pool
         self.schema = schema
         self.logger = logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.maintenance_interval = maintenance_interval
+        self.purge_grace = purge_grace
+        self.request_queue = Queue(queue_size)
+        self.batch_full = Event()
+        self.request_writer = None
+        self.maintainer = None
+        self.server_settings = {}
+        self.listen_kwargs = listen_kwargs
+        self.settings_listener = None
+        self.listen_keeper = None
 
     @classmethod
     async def get_instance(cls, logger, connect_kwargs: dict = None,
-                           pool: Pool = None, schema: str = 'discordoragi'):
+                           pool: Pool = None, schema: str = 'discordoragi',
+                           create_tables: bool = True, **request_log):
         """
         Get a new instance of `PostgresController`
-        This method will create the appropriate tables needed.
+        This method will create the appropriate tables needed, unless
+        `create_tables` is False.
         :param logger: the logger object.
         :param connect_kwargs:
             Keyword arguments for the
@@ -66,6 +364,10 @@ class PostgresController():
         :param pool: an existing connection pool.
         One of `pool` or `connect_kwargs` must not be None.
         :param schema: the schema name used. Defaults to `discordoragi`
+        :param create_tables: False if the tables were already made, like
+            launcher.py does before starting the processes
+        :param request_log: keyword arguments for batching request logging,
+            see `__init__`
         :return: a new instance of `PostgresController`
         """
         assert connect_kwargs or pool, (
@@ -80,193 +382,434 @@ class PostgresController():
             except InterfaceError as e:
                 logger.error(str(e))
                 raise e
-        logger.info('Creating tables...')
-        await make_tables(pool, schema)
-        logger.info('Tables created.')
-        return cls(pool, logger, schema)
+        if create_tables:
+            logger.info('Creating tables...')
+            await make_tables(pool, schema)
+            logger.info('Tables created.')
+        listen_kwargs = {
+            key: value for key, value in (connect_kwargs or {}).items()
+            if key not in POOL_OPTIONS
+        } or None
+        instance = cls(pool, logger, schema, listen_kwargs=listen_kwargs,
+                       **request_log)
+        instance.request_writer = ensure_future(instance.__write_requests())
+        instance.maintainer = ensure_future(instance.__maintain())
+        await instance.__listen_server_settings()
+        if listen_kwargs:
+            instance.listen_keeper = ensure_future(instance.__keep_listening())
+        return instance
+
+    async def close(self):
+        """
+        Writes every queued request and stops the request writer, the
+        periodic maintenance and the server settings listener. The
+        connection pool is left open.
+        """
+        if self.maintainer is not None:
+            self.maintainer.cancel()
+            self.maintainer = None
+        if self.listen_keeper is not None:
+            self.listen_keeper.cancel()
+            self.listen_keeper = None
+        if self.settings_listener is not None:
+            await self.settings_listener.close()
+            self.settings_listener = None
+        if self.request_writer is None:
+            return
+        await self.request_queue.put(None)
+        self.batch_full.set()
+        await self.request_writer
+        self.request_writer = None
 
     async def add_request(self, request):
         """
-        Adds a request to the database
+        Queues a request to be written to the database in the next batch.
+        Only waits if the queue is full, and drops the request if no room
+        frees up within `put_timeout` seconds.
         :param request: a dict containing the info to put
             into the database
         """
-        sql = """
-        INSERT INTO requests (requester, server, medium, title)
-        VALUES ($1, $2, $3, $4);
-        """
+        row = (request['requester_id'],
+               request['server_id'],
+               request['medium'].value,
+               request['title'],
+               datetime.now())
         try:
-            await self.pool.execute(sql,
-                                    request['requester_id'],
-                                    request['server_id'],
-                                    request['medium'].value,
-                                    request['title'])
-        except Exception as e:
+            await wait_for(self.request_queue.put(row), self.put_timeout)
+        except TimeoutError:
             self.logger.warning(
-                f'Exception occured white adding request: {e}')
+                f'Request queue is full, dropped request for '
+                f'{request["title"]}')
+            return
+        if self.request_queue.qsize() >= self.batch_size:
+            self.batch_full.set()
 
-    async def add_server(self, server_id):
+    async def __write_requests(self):
         """
-        Adds a request to the database
-        :param server_id: ID of the server to put into the database
+        Writes queued requests in batches of up to `batch_size`, at most
+        `flush_interval` seconds after the first one of a batch was queued.
+        Stops once `close` queues None.
         """
-        sql = """
-        INSERT INTO servers (server)
-        VALUES ($1) ON CONFLICT DO NOTHING;
+        closing = False
+        while not closing:
+            rows = [await self.request_queue.get()]
+            full = self.request_queue.qsize() >= self.batch_size - 1
+            if rows[0] is not None and not full:
+                try:
+                    await wait_for(
+                        self.batch_full.wait(), self.flush_interval)
+                except TimeoutError:
+                    pass
+            self.batch_full.clear()
+            while len(rows) < self.batch_size:
+                try:
+                    rows.append(self.request_queue.get_nowait())
+                except QueueEmpty:
+                    break
+            if None in rows:
+                closing = True
+                rows = [row for row in rows if row is not None]
+            if rows:
+                await self.__insert_requests(rows)
+
+    async def __maintain(self):
         """
-        try:
-            await self.pool.execute(sql, server_id)
-        except Exception as e:
-            self.logger.warning(f'Exception occured while adding server: {e}')
+        Runs the periodic maintenance right away and then every
+        `maintenance_interval` seconds, until `close` cancels it
+        """
+        while True:
+            try:
+                await create_request_partitions(self.pool, datetime.now())
+            except Exception as e:
+                self.logger.warning(
+                    f'Exception occured while creating partitions: {e}')
+            await self.__purge_search_cache()
+            await sleep(self.maintenance_interval)
 
-    async def toggle_server_setting(self, server_id, setting):
+    async def __purge_search_cache(self):
         """
-        Toggles one of the server settings
-        :param setting: either 'stats' or 'expanded'
+        Deletes the cached searches that expired more than `purge_grace`
+        seconds ago, they are never served again
         """
         sql = """
-        UPDATE servers
-        SET ($1) = NOT ($1)
-        WHERE server = ($2);
+        DELETE FROM search_cache
+        WHERE expires < current_timestamp - ($1 * interval '1 second');
         """
         try:
-            await self.pool.execute(sql, setting, server_id)
+            status = await self.pool.execute(sql, self.purge_grace)
         except Exception as e:
-            self.logger.warning(f'Exception occured while adding server: {e}')
+            self.logger.warning(
+                f'Exception occured while purging cached searches: {e}')
+            return
+        purged = int(status.split()[-1])
+        if purged:
+            self.logger.info(f'Purged {purged} expired cached searches.')
 
-    async def __global_requests(self):
-        sql = """
-        SELECT count(*) from requests;
+    async def __insert_requests(self, rows):
         """
+        Writes a batch of requests to the database and adds them to the
+        rollup tables in the same transaction
+        :param rows: a list of
+            (requester, server, medium, title, logtime) tuples
+        """
+        requesters, servers, mediums, titles, _ = zip(*rows)
         try:
-            count = await self.pool.fetchval(sql)
-            return int(count)
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.copy_records_to_table(
+                        'requests', records=rows,
+                        columns=('requester', 'server', 'medium', 'title',
+                                 'logtime'))
+                    await conn.execute("""
+                    UPDATE request_totals SET requests = requests + ($1);
+                    """, len(rows))
+                    for column, ids in (('requester', requesters),
+                                        ('server', servers)):
+                        await conn.execute(
+                            self.__rollup_sql(column),
+                            ids, titles, mediums)
         except Exception as e:
             self.logger.warning(
-                f'Exception occured while getting total requests: {e}')
-
-    async def get_server_setting(self, server_id, setting) -> bool:
-        sql = """
-        SELECT {} FROM servers
-        WHERE server = ($1);""".format(setting, self.schema)
-        return await self.pool.fetchval(sql, server_id)
+                f'Exception occured while adding {len(rows)} requests: {e}')
 
-    async def get_user_stats(self, user_id) -> dict:
-        user_stats = {}
-        user_stats['global_requests'] = await self.__global_requests()
+    @staticmethod
+    def __rollup_sql(column):
+        """
+        Builds the statement adding a batch of requests to the rollups for
+        one of the requests columns. It takes the arrays of ids, titles and
+        mediums as parameters. A title is new for an id when its count
+        after the upsert is the count in the batch.
+        :param column: either 'requester' or 'server'
+        """
+        totals, titles = ROLLUPS[column]
+        return f"""
+        WITH batch AS (
+            SELECT {column}, title, medium, count(*) AS requests
+            FROM unnest($1::bigint[], $2::varchar[], $3::smallint[])
+                AS b ({column}, title, medium)
+            GROUP BY {column}, title, medium
+        ), counted AS (
+            INSERT INTO {titles} AS t ({column}, title, medium, requests)
+            SELECT * FROM batch ORDER BY {column}, title, medium
+            ON CONFLICT ({column}, title, medium)
+            DO UPDATE SET requests = t.requests + EXCLUDED.requests
+            RETURNING {column}, title, medium, requests
+        )
+        INSERT INTO {totals} AS t ({column}, requests, titles)
+        SELECT {column}, sum(batch.requests),
+            count(*) FILTER (WHERE counted.requests = batch.requests)
+        FROM batch JOIN counted USING ({column}, title, medium)
+        GROUP BY {column} ORDER BY {column}
+        ON CONFLICT ({column})
+        DO UPDATE SET requests = t.requests + EXCLUDED.requests,
+                      titles = t.titles + EXCLUDED.titles;
+        """
 
-        user_request_sql = """
-        SELECT COUNT(*) FROM requests
-        WHERE requester = ($1);
+    async def __listen_server_settings(self):
+        """
+        Connects a connection of its own listening for changes made by
+        other processes, then loads every server's settings. The listener
+        stays out of the pool so it never takes a pooled connection away.
+        """
+        if self.listen_kwargs:
+            try:
+                self.settings_listener = await connect(**self.listen_kwargs)
+                await self.settings_listener.add_listener(
+                    SERVERS_CHANNEL, self.__on_server_changed)
+            except Exception as e:
+                if self.settings_listener is not None:
+                    self.settings_listener.terminate()
+                    self.settings_listener = None
+                self.logger.warning(
+                    f'Exception occured while listening for server '
+                    f'changes: {e}')
+        sql = f"""
+        SELECT server, {', '.join(SERVER_SETTINGS)} FROM servers;
         """
         try:
-            count = await self.pool.fetchval(user_request_sql, user_id)
-            user_stats['user_requests'] = count
+            self.server_settings = {
+                row['server']: self.__settings_from_row(row)
+                for row in await self.pool.fetch(sql)
+            }
+            self.logger.info(
+                f'Loaded settings for {len(self.server_settings)} servers.')
         except Exception as e:
             self.logger.warning(
-                f'Exception occured while getting user requests: {e}')
+                f'Exception occured while loading server settings: {e}')
+
+    async def __keep_listening(self):
+        """
+        Checks the settings listener every `LISTEN_CHECK` seconds and
+        connects it again if it was lost, reloading every server's
+        settings since changes may have been missed meanwhile
+        """
+        while True:
+            await sleep(LISTEN_CHECK)
+            listener = self.settings_listener
+            if listener is not None:
+                try:
+                    await wait_for(listener.fetchval('SELECT 1;'),
+                                   LISTEN_CHECK)
+                    continue
+                except Exception as e:
+                    self.logger.warning(
+                        f'Lost the server settings listener: {e}')
+                    listener.terminate()
+                    self.settings_listener = None
+            await self.__listen_server_settings()
 
-        top_requests_sql = """
-        SELECT title, medium, COUNT(title) FROM requests
-        WHERE requester = ($1)
-        GROUP BY title, medium ORDER BY COUNT(title) DESC, title ASC LIMIT 5
+    def __on_server_changed(self, conn, pid, channel, payload):
+        """
+        Reloads a server's settings when they were changed
+        """
+        ensure_future(self.__reload_server(int(payload)))
+
+    async def __reload_server(self, server_id):
+        """
+        Reads one server's settings into the in-memory map
+        :param server_id: the server ID
+        """
+        sql = f"""
+        SELECT {', '.join(SERVER_SETTINGS)} FROM servers
+        WHERE server = ($1);
         """
         try:
-            top_requests = await self.pool.fetch(top_requests_sql, user_id)
-            user_stats['top_requests'] = []
-            for request in top_requests:
-                user_stats['top_requests'].append(request)
+            row = await self.pool.fetchrow(sql, server_id)
         except Exception as e:
             self.logger.warning(
-                f'Exception occured while getting user requests: {e}')
+                f'Exception occured while reloading server settings: {e}')
+            return
+        if row is None:
+            self.server_settings.pop(server_id, None)
+        else:
+            self.server_settings[server_id] = self.__settings_from_row(row)
 
-        request_rank = """
-        SELECT row FROM
-        (SELECT requester, count(1), ROW_NUMBER() over (ORDER BY COUNT(1) DESC)
-            as row
-        FROM requests GROUP BY requester) as overallrequestrank
-        WHERE requester = ($1)
-        """
+    @staticmethod
+    def __settings_from_row(row) -> dict:
+        return {
+            setting: default if row[setting] is None else row[setting]
+            for setting, default in SERVER_SETTINGS.items()
+        }
 
+    async def add_server(self, server_id):
+        """
+        Adds a server to the database
+        :param server_id: ID of the server to put into the database
+        """
+        sql = """
+        INSERT INTO servers (server)
+        VALUES ($1) ON CONFLICT DO NOTHING;
+        """
         try:
-            user_stats['rank'] = int(
-                await self.pool.fetchval(request_rank, user_id))
+            await self.pool.execute(sql, server_id)
         except Exception as e:
-            self.logger.warning(
-                f'Exception occured while getting user request rank: {e}'
-            )
+            self.logger.warning(f'Exception occured while adding server: {e}')
 
-        unique_requests = """
-        SELECT COUNT(DISTINCT (title, medium))
-        FROM requests
-        WHERE requester = ($1)
+    async def toggle_server_setting(self, server_id, setting):
+        """
+        Toggles one of the server settings, adding the server if needed,
+        and tells the other processes about it
+        :param server_id: the server ID
+        :param setting: one of `SERVER_SETTINGS`
+        :return: the new value of the setting, or None if it failed
+        """
+        if setting not in SERVER_SETTINGS:
+            raise ValueError(f'Unknown server setting {setting}')
+        sql = f"""
+        INSERT INTO servers AS s (server, {setting})
+        VALUES ($1, NOT ($2))
+        ON CONFLICT (server)
+        DO UPDATE SET {setting} = NOT COALESCE(s.{setting}, $2)
+        RETURNING {', '.join(SERVER_SETTINGS)};
         """
         try:
-            user_stats['unique_requests'] = int(
-                await self.pool.fetchval(unique_requests, user_id))
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    row = await conn.fetchrow(
+                        sql, server_id, SERVER_SETTINGS[setting])
+                    await conn.execute(
+                        'SELECT pg_notify($1, $2);',
+                        SERVERS_CHANNEL, str(server_id))
         except Exception as e:
             self.logger.warning(
-                f'Exception occured while getting user request rank: {e}'
-            )
-
-        return user_stats
+                f'Exception occured while toggling server setting: {e}')
+            return None
+        self.server_settings[server_id] = self.__settings_from_row(row)
+        return row[setting]
 
-    async def get_server_stats(self, server_id) -> dict:
-        server_stats = {}
-        server_stats['global_requests'] = await self.__global_requests()
+    def get_server_setting(self, server_id, setting) -> bool:
+        """
+        Looks a server setting up in memory
+        :param server_id: the server ID, or None outside of servers
+        :param setting: one of `SERVER_SETTINGS`
+        :return: the value of the setting
+        """
+        settings = self.server_settings.get(server_id)
+        if settings is None:
+            return SERVER_SETTINGS[setting]
+        return settings[setting]
 
-        server_request_sql = """
-        SELECT COUNT(*) FROM requests
-        WHERE server = ($1);
+    async def get_cached_search(self, search, medium, sites):
+        """
+        Gets an unexpired search result from the shared cache
+        :param search: the normalized search text
+        :param medium: the medium value
+        :param sites: the comma separated site values
+        :return: a record with the JSON `data`, the seconds it stays
+            `fresh` for (negative once stale) and the remaining `ttl`
+            in seconds, or None
+        """
+        sql = """
+        SELECT data,
+        EXTRACT(EPOCH FROM refresh - current_timestamp)::float8 AS fresh,
+        EXTRACT(EPOCH FROM expires - current_timestamp)::float8 AS ttl
+        FROM search_cache
+        WHERE search = ($1) AND medium = ($2) AND sites = ($3)
+        AND expires > current_timestamp;
         """
         try:
-            count = await self.pool.fetchval(server_request_sql, server_id)
-            server_stats['server_requests'] = count
+            return await self.pool.fetchrow(sql, search, medium, sites)
         except Exception as e:
             self.logger.warning(
-                f'Exception occured while getting server requests: {e}')
+                f'Exception occured while getting cached search: {e}')
 
-        top_requests_sql = """
-        SELECT title, medium, COUNT(title) FROM requests
-        WHERE server = ($1)
-        GROUP BY title, medium ORDER BY COUNT(title) DESC, title ASC LIMIT 5
+    async def set_cached_search(self, search, medium, sites, data,
+                                fresh, ttl):
+        """
+        Adds or replaces a search result in the shared cache
+        :param search: the normalized search text
+        :param medium: the medium value
+        :param sites: the comma separated site values
+        :param data: the search result as a JSON string
+        :param fresh: seconds until the result should be refreshed
+        :param ttl: seconds until the result expires
+        """
+        sql = """
+        INSERT INTO search_cache (search, medium, sites, data,
+                                  refresh, expires)
+        VALUES ($1, $2, $3, $4,
+                current_timestamp + ($5 * interval '1 second'),
+                current_timestamp + ($6 * interval '1 second'))
+        ON CONFLICT (search, medium, sites)
+        DO UPDATE SET data = EXCLUDED.data, refresh = EXCLUDED.refresh,
+                      expires = EXCLUDED.expires;
         """
         try:
-            top_requests = await self.pool.fetch(top_requests_sql, server_id)
-            server_stats['top_requests'] = []
-            for request in top_requests:
-                server_stats['top_requests'].append(request)
+            await self.pool.execute(
+                sql, search, medium, sites, data, fresh, ttl)
         except Exception as e:
             self.logger.warning(
-                f'Exception occured while getting server requests: {e}')
+                f'Exception occured while caching search: {e}')
 
-        request_rank = """
-        SELECT row FROM
-        (SELECT server, count(1), ROW_NUMBER() over (ORDER BY COUNT(1) DESC)
-            as row
-        FROM requests GROUP BY server) as overallrequestrank
-        WHERE server = ($1)
+    async def __get_stats(self, column, id_) -> dict:
+        """
+        Gets the request stats for a requester or server from the rollups
+        :param column: either 'requester' or 'server'
+        :param id_: the requester or server ID
+        :return: a dict with the `requests`, `unique_requests`, `rank` and
+            `top_requests` of the ID, and the `global_requests`
         """
+        totals, titles = ROLLUPS[column]
+        stats = {}
 
+        totals_sql = f"""
+        SELECT g.requests AS global_requests,
+        COALESCE(t.requests, 0) AS requests,
+        COALESCE(t.titles, 0) AS unique_requests,
+        (SELECT count(*) FROM {totals}
+            WHERE requests > COALESCE(t.requests, 0)) + 1 AS rank
+        FROM request_totals g
+        LEFT JOIN {totals} t ON t.{column} = ($1);
+        """
         try:
-            server_stats['rank'] = int(
-                await self.pool.fetchval(request_rank, server_id))
+            row = await self.pool.fetchrow(totals_sql, id_)
+            stats.update(row)
         except Exception as e:
             self.logger.warning(
-                f'Exception occured while getting server request rank: {e}'
-            )
+                f'Exception occured while getting {column} requests: {e}')
 
-        unique_requests = """
-        SELECT COUNT(DISTINCT (title, medium))
-        FROM requests
-        WHERE server = ($1)
+        top_requests_sql = f"""
+        SELECT title, medium, requests AS count FROM {titles}
+        WHERE {column} = ($1)
+        ORDER BY requests DESC, title ASC LIMIT 5;
         """
         try:
-            server_stats['unique_requests'] = int(
-                await self.pool.fetchval(unique_requests, server_id))
+            stats['top_requests'] = await self.pool.fetch(
+                top_requests_sql, id_)
         except Exception as e:
             self.logger.warning(
-                f'Exception occured while getting server request rank: {e}'
-            )
+                f'Exception occured while getting top {column} requests: {e}')
+
+        return stats
+
+    async def get_user_stats(self, user_id) -> dict:
+        user_stats = await self.__get_stats('requester', user_id)
+        if 'requests' in user_stats:
+            user_stats['user_requests'] = user_stats.pop('requests')
+        return user_stats
 
-        return server_stats
\ No newline at end of file
+    async def get_server_stats(self, server_id) -> dict:
+        server_stats = await self.__get_stats('server', server_id)
+        if 'requests' in server_stats:
+            server_stats['server_requests'] = server_stats.pop('requests')
+        return server_stats
@@ -1,6 +1,25 @@
 """
 Collection of helpers
 """
+from discord import Message
+from discord.http import Route
+
+# Discord's limits for the embeds of a single message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARS = 6000
+
+# Messages with several embeds are sent with the `embeds` array, which API
+# v7 used by discord.py 1.3.4 doesn't know about. Those requests go to this
+# version of the API instead.
+EMBEDS_API = 'https://discord.com/api/v10'
+
+
+class EmbedsRoute(Route):
+    """
+    A discord.py `Route` to `EMBEDS_API` rather than the version the
+    installed discord.py talks to
+    """
+    BASE = EMBEDS_API
 
 
 def get_name_with_discriminator(member):
@@ -10,3 +29,36 @@ def get_name_with_discriminator(member):
     :return: the name of a member with discriminator
     """
     return member.display_name + '#' + member.discriminator
+
+
+async def send_embeds(channel, embeds):
+    """
+    Sends several embeds as a single message. discord.py only sends one
+    embed per message, so anything more goes to `EMBEDS_API` through the
+    HTTP client of discord.py, keeping its rate limiting.
+    :param channel: the channel to send to
+    :param embeds: a list of at most `MAX_EMBEDS` embeds
+    :return: the message that was sent
+    """
+    if len(embeds) == 1:
+        return await channel.send(embed=embeds[0])
+    state = channel._state
+    data = await state.http.request(
+        EmbedsRoute('POST', '/channels/{channel_id}/messages',
+              channel_id=channel.id),
+        json={'embeds': [embed.to_dict() for embed in embeds]})
+    return Message(state=state, channel=channel, data=data)
+
+
+async def edit_embeds(message, embeds):
+    """
+    Replaces the embeds of a message sent by `send_embeds`
+    :param message: the message to edit
+    :param embeds: the new list of embeds
+    """
+    if len(embeds) == 1:
+        return await message.edit(embed=embeds[0])
+    await message._state.http.request(
+        EmbedsRoute('PATCH', '/channels/{channel_id}/messages/{message_id}',
+              channel_id=message.channel.id, message_id=message.id),
+        json={'embeds': [embed.to_dict() for embed in embeds]})
@@ -0,0 +1,551 @@
+"""
+The HTTP client shared by every upstream source
+"""
+from asyncio import TimeoutError, sleep
+from collections import Counter
+from random import uniform
+from time import monotonic
+from typing import Tuple
+from urllib.parse import urlsplit
+
+from aiohttp import ClientError, ClientResponse, ClientSession, \
+    ClientTimeout, TCPConnector
+from aiohttp_wrapper import HTTPStatusError, SessionManager
+
+# Responses worth trying again, anything else is returned as it is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# The hosts of every site, without www., so they share one `Upstream`
+UPSTREAM_HOSTS = {
+    'anilist': ('anilist.co', 'graphql.anilist.co'),
+    'kitsu': ('kitsu.io',),
+    'mal': ('myanimelist.net',),
+    'anidb': ('anidb.net', 'api.anidb.net'),
+    'animeplanet': ('anime-planet.com',),
+    'mangaupdates': ('mangaupdates.com',),
+    'lndb': ('lndb.info',),
+    'novelupdates': ('novelupdates.com',),
+    'hummingbird': ('hummingbird.me',),
+}
+
+
+def make_connector(limit: int = 100, limit_per_host: int = 10,
+                   dns_ttl: int = 300, keepalive: float = 30) -> TCPConnector:
+    """
+    Builds the connector every session shares, so they share one pool of
+    kept alive connections and one DNS cache
+    :param limit: the most connections open at once
+    :param limit_per_host: the most connections open to one host
+    :param dns_ttl: seconds a DNS lookup is cached
+    :param keepalive: seconds an idle connection is kept open
+    :return: a `TCPConnector`
+    """
+    return TCPConnector(limit=limit, limit_per_host=limit_per_host,
+                        ttl_dns_cache=dns_ttl, keepalive_timeout=keepalive)
+
+
+def retry_after(response):
+    """
+    :param response: a response
+    :return: the seconds its Retry-After header asks to wait, or None
+    """
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised instead of making a request to an upstream whose circuit is
+    open, or that is rate limited for longer than the caller may wait
+    """
+
+
+class RateLimiter():
+    """
+    A token bucket whose rate adapts to the upstream. A throttled or
+    failed request halves the rate, down to `min_rate`, at most once a
+    second so a burst of them counts once. Every successful request adds
+    `increase` back, up to the rate it started with. A Retry-After header
+    holds every request back until it has passed.
+    """
+    __slots__ = ('rate', 'max_rate', 'min_rate', 'increase', 'burst',
+                 'tokens', 'updated', 'paused_until', 'slowed')
+
+    def __init__(self, rate: float = 5, burst: float = 10,
+                 min_rate: float = 0.2, increase: float = 0.1):
+        """
+        :param rate: the most requests a second
+        :param burst: the most requests made at once after a quiet spell
+        :param min_rate: the rate is never halved below this
+        :param increase: how much every successful request adds to the rate
+        """
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.increase = increase
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.paused_until = 0
+        self.slowed = float('-inf')
+
+    def reserve(self, max_wait: float = None) -> float:
+        """
+        Takes a token, which may be one that is only added later
+        :param max_wait: the longest the caller may wait for it, None to
+            wait as long as it takes
+        :return: seconds to wait before the token may be used
+        :raises UpstreamUnavailable: if that is longer than `max_wait`
+        """
+        now = self.__refill()
+        wait = max((1 - self.tokens) / self.rate, self.paused_until - now, 0)
+        if max_wait is not None and wait > max_wait:
+            raise UpstreamUnavailable(f'rate limited for {wait:.1f}s')
+        self.tokens -= 1
+        return wait
+
+    async def acquire(self, max_wait: float = None):
+        """
+        Waits for a token
+        :param max_wait: the longest the caller may wait for it, None to
+            wait as long as it takes
+        :raises UpstreamUnavailable: if it would have to wait longer
+        """
+        wait = self.reserve(max_wait)
+        if wait:
+            await sleep(wait)
+
+    def succeeded(self):
+        """
+        Speeds the bucket up after a successful request
+        """
+        self.__refill()
+        self.rate = min(self.rate + self.increase, self.max_rate)
+
+    def throttled(self, retry_after: float = None):
+        """
+        Slows the bucket down after a throttled or failed request
+        :param retry_after: seconds the upstream asked us to wait, if any
+        """
+        now = self.__refill()
+        if now - self.slowed >= 1:
+            self.slowed = now
+            self.rate = max(self.rate / 2, self.min_rate)
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+    def __refill(self) -> float:
+        """
+        Adds the tokens earned since the last call
+        :return: the current monotonic time
+        """
+        now = monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+
+class CircuitBreaker():
+    """
+    Turns requests away after `threshold` failures in a row. Once the
+    circuit has been open for `cooldown` seconds a single probe is let
+    through. The circuit closes if it succeeds and opens again for twice
+    as long, up to `max_cooldown`, if it fails.
+    """
+    __slots__ = ('threshold', 'base_cooldown', 'max_cooldown', 'cooldown',
+                 'failures', 'opened_until', 'probing')
+
+    def __init__(self, threshold: int = 5, cooldown: float = 10,
+                 max_cooldown: float = 300):
+        """
+        :param threshold: failures in a row that open the circuit
+        :param cooldown: seconds the circuit first stays open for
+        :param max_cooldown: the longest the circuit stays open for
+        """
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_until = 0
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        """
+        :return: 'closed', 'open' or 'half-open'
+        """
+        if self.failures < self.threshold:
+            return 'closed'
+        if self.probing or monotonic() >= self.opened_until:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """
+        :return: whether a request may be made, if it is the probe of a
+            half-open circuit no other request may be until it is over
+        """
+        if self.failures < self.threshold:
+            return True
+        if self.probing or monotonic() < self.opened_until:
+            return False
+        self.probing = True
+        return True
+
+    def succeeded(self):
+        """
+        Closes the circuit
+        """
+        self.failures = 0
+        self.probing = False
+        self.cooldown = self.base_cooldown
+
+    def failed(self):
+        """
+        Counts a failure, opening the circuit once there are `threshold`
+        in a row or the probe failed
+        """
+        if self.probing:
+            self.probing = False
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_until = monotonic() + self.cooldown
+
+    def abandoned(self):
+        """
+        Forgets a request that ended without telling whether the upstream
+        works, so the next one can be the probe
+        """
+        self.probing = False
+
+
+class Upstream():
+    """
+    The `RateLimiter` and `CircuitBreaker` every request to one site
+    goes through. Connection errors, timeouts and server errors count
+    as failures, 429s only slow the site down.
+    """
+    __slots__ = ('name', 'limiter', 'breaker', 'max_wait', 'last_error',
+                 'stats')
+
+    def __init__(self, name: str, rate: float = 5, burst: float = 10,
+                 min_rate: float = 0.2, increase: float = 0.1,
+                 max_wait: float = 2, threshold: int = 5,
+                 cooldown: float = 10, max_cooldown: float = 300):
+        """
+        :param name: the site or host name
+        :param rate: the most requests a second
+        :param burst: the most requests made at once after a quiet spell
+        :param min_rate: the rate is never halved below this
+        :param increase: how much every successful request adds to the rate
+        :param max_wait: the longest a request waits for the rate limit
+            before giving up, None to wait as long as it takes
+        :param threshold: failures in a row that open the circuit
+        :param cooldown: seconds the circuit first stays open for
+        :param max_cooldown: the longest the circuit stays open for
+        """
+        self.name = name
+        self.limiter = RateLimiter(rate, burst, min_rate, increase)
+        self.breaker = CircuitBreaker(threshold, cooldown, max_cooldown)
+        self.max_wait = max_wait
+        self.last_error = float('-inf')
+        self.stats = Counter()
+
+    @property
+    def available(self) -> bool:
+        """
+        :return: whether requests are being let through
+        """
+        return self.breaker.state != 'open'
+
+    def failing_since(self, since: float) -> bool:
+        """
+        :param since: a monotonic time
+        :return: whether a request failed or was turned away since then
+        """
+        return self.last_error >= since
+
+    def may_wait(self, delay: float) -> bool:
+        """
+        :param delay: seconds a request would wait
+        :return: whether that is within `max_wait`
+        """
+        return self.max_wait is None or delay <= self.max_wait
+
+    async def acquire(self):
+        """
+        Waits until a request may be made
+        :raises UpstreamUnavailable: if the circuit is open or the rate
+            limit would make it wait longer than `max_wait`
+        """
+        if not self.breaker.allow():
+            self.stats['rejected'] += 1
+            self.last_error = monotonic()
+            raise UpstreamUnavailable(f'{self.name} is unavailable')
+        try:
+            await self.limiter.acquire(self.max_wait)
+        except UpstreamUnavailable:
+            self.breaker.abandoned()
+            self.stats['rejected'] += 1
+            self.last_error = monotonic()
+            raise
+        except BaseException:
+            self.breaker.abandoned()
+            raise
+
+    def record(self, response):
+        """
+        Adapts to the status of a response
+        :param response: the response to a request made after `acquire`
+        """
+        if response.status == 429:
+            self.stats['throttled'] += 1
+            self.limiter.throttled(retry_after(response))
+            self.breaker.abandoned()
+        elif response.status >= 500:
+            self.failed()
+        else:
+            self.stats['succeeded'] += 1
+            self.limiter.succeeded()
+            self.breaker.succeeded()
+
+    def failed(self, timed_out: bool = False):
+        """
+        Counts a request that failed to connect, timed out or was
+        answered with a server error
+        :param timed_out: whether it timed out
+        """
+        self.stats['timed_out' if timed_out else 'failed'] += 1
+        self.last_error = monotonic()
+        self.limiter.throttled()
+        self.breaker.failed()
+
+
+class Upstreams():
+    """
+    The `Upstream` of every site in `UPSTREAM_HOSTS`, found by name or
+    by the host of a url. Other hosts get an `Upstream` of their own,
+    named after the host.
+    """
+    __slots__ = ('defaults', 'sites', 'hosts')
+
+    def __init__(self, options: dict = None):
+        """
+        :param options: a dict of site name to `Upstream` keyword
+            arguments, the ones under 'default' apply to every site,
+            e.g. {'default': {'rate': 5}, 'anidb': {'threshold': 3}}
+        """
+        options = options or {}
+        self.defaults = options.get('default') or {}
+        self.sites = {}
+        self.hosts = {}
+        for name, hosts in UPSTREAM_HOSTS.items():
+            upstream = Upstream(
+                name, **{**self.defaults, **(options.get(name) or {})})
+            self.sites[name] = upstream
+            for host in hosts:
+                self.hosts[host] = upstream
+
+    def __contains__(self, name):
+        return name in self.sites
+
+    def __getitem__(self, name) -> Upstream:
+        return self.sites[name]
+
+    def __iter__(self):
+        return iter(self.sites.values())
+
+    def for_url(self, url) -> Upstream:
+        """
+        :param url: a request url
+        :return: the `Upstream` of its host
+        """
+        host = (urlsplit(str(url)).hostname or '').lower()
+        if host.startswith('www.'):
+            host = host[4:]
+        try:
+            return self.hosts[host]
+        except KeyError:
+            upstream = Upstream(host, **self.defaults)
+            self.sites[host] = self.hosts[host] = upstream
+            return upstream
+
+
+class RetryPolicy():
+    """
+    Retries requests that failed to connect, timed out or were answered
+    with one of `RETRY_STATUSES`, waiting as long as the Retry-After header
+    asks or backing off exponentially with jitter otherwise.
+    """
+    __slots__ = ('retries', 'backoff', 'max_backoff')
+
+    def __init__(self, retries: int = 2, backoff: float = 0.5,
+                 max_backoff: float = 10):
+        """
+        :param retries: how many times a request is retried
+        :param backoff: the longest wait before the first retry, doubled
+            for every retry after it
+        :param max_backoff: the longest wait before any retry
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt, response=None) -> float:
+        """
+        :param attempt: how many attempts have failed so far, minus one
+        :param response: the response of the failed attempt, if any
+        :return: seconds to wait before the next attempt
+        """
+        wait = retry_after(response) if response is not None else None
+        if wait is not None:
+            return min(wait, self.max_backoff)
+        return uniform(0, min(self.backoff * 2 ** attempt, self.max_backoff))
+
+    async def request(self, session, upstream, method, url,
+                      **kwargs) -> ClientResponse:
+        """
+        Makes a request, retrying it if it failed in a way worth retrying.
+        Every upstream request is a read, so POSTs are retried as well.
+        Every attempt goes through the `Upstream` of the url, so retries
+        stop as soon as its circuit opens, or when they would wait longer
+        than its `max_wait`.
+        :param session: the `ClientSession` to use
+        :param upstream: the `Upstream` of the url
+        :param method: the HTTP method
+        :param url: the request url
+        :param kwargs: passed on to `ClientSession.request`
+        :return: the response of the last attempt
+        :raises UpstreamUnavailable: if the upstream turned a request away
+        """
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            await upstream.acquire()
+            try:
+                response = await session.request(method, url, **kwargs)
+            except (ClientError, TimeoutError) as e:
+                upstream.failed(isinstance(e, TimeoutError))
+                delay = self.delay(attempt)
+                if last or not upstream.may_wait(delay):
+                    raise
+                await sleep(delay)
+                continue
+            except BaseException:
+                upstream.breaker.abandoned()
+                raise
+            upstream.record(response)
+            if last or response.status not in RETRY_STATUSES:
+                return response
+            delay = self.delay(attempt, response)
+            if not upstream.may_wait(delay):
+                return response
+            response.release()
+            await sleep(delay)
+
+
+class HTTPClient(SessionManager):
+    """
+    A `SessionManager` that makes every request through one tuned session,
+    with connection limits, keep-alive, DNS caching, the same timeouts
+    and `RetryPolicy` for every source, and the `Upstream` of each site
+    in front of it. aiohttp asks for gzip/deflate and decompresses
+    responses on its own.
+    """
+    __slots__ = ('connector_options', 'timeout', 'policy', 'upstreams')
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 10,
+                 dns_ttl: int = 300, keepalive: float = 30,
+                 timeout: float = 10, connect_timeout: float = 3,
+                 retries: int = 2, backoff: float = 0.5,
+                 upstreams: dict = None):
+        """
+        :param limit: the most connections open at once
+        :param limit_per_host: the most connections open to one host
+        :param dns_ttl: seconds a DNS lookup is cached
+        :param keepalive: seconds an idle connection is kept open
+        :param timeout: seconds a request may take in total, unless the
+            caller passes its own
+        :param connect_timeout: seconds connecting may take
+        :param retries: how many times a failed request is retried
+        :param backoff: the longest wait before the first retry
+        :param upstreams: the options of every `Upstream`, see `Upstreams`
+        """
+        super().__init__()
+        self.connector_options = {
+            'limit': limit,
+            'limit_per_host': limit_per_host,
+            'dns_ttl': dns_ttl,
+            'keepalive': keepalive
+        }
+        self.timeout = ClientTimeout(total=timeout, connect=connect_timeout)
+        self.policy = RetryPolicy(retries, backoff)
+        self.upstreams = Upstreams(upstreams)
+
+    async def client(self) -> ClientSession:
+        """
+        :return: the shared session, created on first use
+        """
+        if not self.session:
+            self.session = ClientSession(
+                connector=make_connector(**self.connector_options),
+                timeout=self.timeout)
+        return self.session
+
+    async def get(self, url, range_: Tuple[int, int] = (200, 299), *,
+                  allow_redirects=True, **kwargs) -> ClientResponse:
+        """
+        Makes an HTTP GET request
+        :param url: the request url
+        :param range_: the accepted range of status codes, inclusive
+        :param allow_redirects: whether redirects are followed
+        :param kwargs: passed on to `ClientSession.request`
+        :return: the response
+        :raises HTTPStatusError: if the status code isn't in the range
+        :raises UpstreamUnavailable: if the site turned the request away
+        """
+        response = await self.policy.request(
+            await self.client(), self.upstreams.for_url(url), 'GET', url,
+            allow_redirects=allow_redirects, **kwargs)
+        return await self.__check(response, range_)
+
+    async def post(self, url, range_: Tuple[int, int] = (200, 299), *,
+                   data=None, **kwargs) -> ClientResponse:
+        """
+        Makes an HTTP POST request
+        :param url: the request url
+        :param range_: the accepted range of status codes, inclusive
+        :param data: the request body
+        :param kwargs: passed on to `ClientSession.request`
+        :return: the response
+        :raises HTTPStatusError: if the status code isn't in the range
+        :raises UpstreamUnavailable: if the site turned the request away
+        """
+        response = await self.policy.request(
+            await self.client(), self.upstreams.for_url(url), 'POST', url,
+            data=data, **kwargs)
+        return await self.__check(response, range_)
+
+    async def close(self):
+        """
+        Closes the session and every connection it kept open
+        """
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def __check(self, response, range_):
+        """
+        :return: the response if its status is in `range_`
+        :raises HTTPStatusError: if it isn't
+        """
+        low, high = range_
+        if low <= response.status <= high:
+            return response
+        async with response:
+            raise HTTPStatusError(
+                response.status, self.codes.get(response.status))
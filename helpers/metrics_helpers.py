@@ -0,0 +1,309 @@
+"""
+Collects metrics and serves them in the Prometheus text format
+"""
+from asyncio import CancelledError, ensure_future, get_event_loop, sleep
+from bisect import bisect_left
+from time import perf_counter
+
+from aiohttp import web
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                   5, 10, 30)
+
+
+def format_labels(labels) -> str:
+    """
+    :param labels: a dict of label names to values
+    :return: the labels as written after a metric name
+    """
+    if not labels:
+        return ''
+    pairs = ','.join(
+        f'{name}="{escape_label(value)}"' for name, value in labels.items())
+    return f'{{{pairs}}}'
+
+
+def escape_label(value) -> str:
+    """
+    :param value: a label value
+    :return: the value with backslashes, quotes and newlines escaped
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def ratio(part, whole) -> float:
+    """
+    :return: part / whole, or 0 if whole is 0
+    """
+    return part / whole if whole else 0.0
+
+
+class Timer():
+    """
+    Observes the seconds spent in a `with` block
+    """
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        """
+        :param histogram: the `Histogram` to observe into
+        """
+        self.histogram = histogram
+        self.started = 0
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histogram.observe(perf_counter() - self.started)
+
+
+class Histogram():
+    """
+    Counts observations into fixed buckets. Observing is a bisect and
+    three additions, so it can stay on in production.
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: the sorted upper bounds of the buckets
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        :param value: the observed value
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def time(self) -> Timer:
+        """
+        :return: a context manager observing the time spent in it
+        """
+        return Timer(self)
+
+    def samples(self, name, labels) -> list:
+        """
+        :param name: the metric name
+        :param labels: a dict of the labels of the histogram
+        :return: the lines of the histogram, buckets being cumulative
+        """
+        lines = []
+        total = 0
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            lines.append(f'{name}_bucket'
+                         f'{format_labels(dict(labels, le=bound))} {total}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+class Metrics():
+    """
+    The metrics of one process. Latencies are recorded into histograms as
+    they happen. Everything else is read from the counters and queues the
+    bot already keeps by collectors that only run when the metrics are
+    scraped, so they cost nothing in between.
+    """
+    __slots__ = ('prefix', 'histograms', 'collectors', 'lag', 'watcher',
+                 'runner')
+
+    def __init__(self, prefix: str = 'discordoragi'):
+        """
+        :param prefix: put in front of every metric name
+        """
+        self.prefix = prefix
+        self.histograms = {}
+        self.collectors = []
+        self.lag = 0.0
+        self.watcher = None
+        self.runner = None
+
+    def histogram(self, name, buckets=DEFAULT_BUCKETS,
+                  **labels) -> Histogram:
+        """
+        Gets a histogram, creating it on first use. Keep the result
+        rather than calling this for every observation.
+        :param name: the metric name, without the prefix
+        :param buckets: the sorted upper bounds of its buckets
+        :param labels: the labels telling it apart from the histograms
+            with the same name
+        :return: the histogram
+        """
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(buckets)
+        return self.histograms[key]
+
+    def add_collector(self, collect):
+        """
+        :param collect: a function returning a list of
+            (name, type, labels, value) read when the metrics are scraped,
+            the type being counter or gauge
+        """
+        self.collectors.append(collect)
+
+    def render(self) -> str:
+        """
+        :return: every metric in the Prometheus text format
+        """
+        families = {}
+        for (name, labels), histogram in self.histograms.items():
+            name = f'{self.prefix}_{name}'
+            family = families.setdefault(name, ('histogram', []))
+            family[1].extend(histogram.samples(name, dict(labels)))
+        for collect in self.collectors:
+            for name, kind, labels, value in collect():
+                name = f'{self.prefix}_{name}'
+                family = families.setdefault(name, (kind, []))
+                family[1].append(f'{name}{format_labels(labels)} {value}')
+        lines = []
+        for name, (kind, samples) in families.items():
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    async def start(self, host: str = '127.0.0.1', port: int = None,
+                    lag_interval: float = 1):
+        """
+        Starts measuring the event loop lag and serving the metrics
+        :param host: the address to listen on
+        :param port: the port to listen on, None to not serve them
+        :param lag_interval: seconds between two lag measurements
+        """
+        lag = self.histogram('event_loop_lag_seconds')
+        self.add_collector(lambda: [
+            ('event_loop_lag_last_seconds', 'gauge', {}, self.lag)])
+        self.watcher = ensure_future(self.__watch_loop(lag, lag_interval))
+        if port is None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.__handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def close(self):
+        """
+        Stops measuring the lag and serving the metrics
+        """
+        if self.watcher is not None:
+            self.watcher.cancel()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def __handle(self, request):
+        return web.Response(
+            text=self.render(), content_type='text/plain',
+            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def __watch_loop(self, histogram, interval):
+        """
+        Sleeps for `interval` seconds over and over, counting how much
+        longer than that every sleep took as the event loop lag
+        :param histogram: the histogram the lag is observed into
+        :param interval: the seconds slept
+        """
+        loop = get_event_loop()
+        try:
+            while True:
+                started = loop.time()
+                await sleep(interval)
+                self.lag = max(loop.time() - started - interval, 0)
+                histogram.observe(self.lag)
+        except CancelledError:
+            pass
+
+
+def cache_metrics(cache):
+    """
+    :param cache: a `SearchCache`
+    :return: a collector for `Metrics.add_collector` reporting its hits,
+        misses, hit ratio, size and shared lookups
+    """
+    def collect():
+        stats = cache.stats
+        hits = stats['memory_hits'] + stats['stale_hits'] + \
+            stats['database_hits']
+        metrics = [
+            ('search_cache_total', 'counter', {'result': result}, count)
+            for result, count in stats.items()
+        ]
+        metrics.extend([
+            ('search_cache_hit_ratio', 'gauge', {},
+             ratio(hits, hits + stats['misses'])),
+            ('search_cache_entries', 'gauge', {}, len(cache.memory)),
+            ('search_cache_known_misses', 'gauge', {}, len(cache.misses)),
+            ('search_cache_refreshes_running', 'gauge', {},
+             len(cache.refreshes.flights)),
+            ('search_lookups_running', 'gauge', {}, len(cache.flights.flights))
+        ])
+        metrics.extend(
+            ('search_lookups_total', 'counter', {'kind': kind}, count)
+            for kind, count in cache.flights.stats.items())
+        return metrics
+    return collect
+
+
+def upstream_metrics(upstreams):
+    """
+    :param upstreams: the `Upstreams` of an `HTTPClient`
+    :return: a collector for `Metrics.add_collector` reporting the
+        requests, rate limit and circuit of every site
+    """
+    def collect():
+        metrics = []
+        for upstream in upstreams:
+            site = {'site': upstream.name}
+            metrics.extend(
+                ('upstream_requests_total', 'counter',
+                 dict(site, result=result), count)
+                for result, count in upstream.stats.items())
+            metrics.append(('upstream_rate', 'gauge', site,
+                            upstream.limiter.rate))
+            metrics.append(('upstream_available', 'gauge', site,
+                            int(upstream.available)))
+        return metrics
+    return collect
+
+
+def database_metrics(db_controller):
+    """
+    :param db_controller: a `PostgresController`
+    :return: a collector for `Metrics.add_collector` reporting the requests
+        waiting to be written
+    """
+    def collect():
+        return [('request_queue_depth', 'gauge', {},
+                 db_controller.request_queue.qsize())]
+    return collect
+
+
+def worker_metrics(pool):
+    """
+    :param pool: a `WorkerPool`
+    :return: a collector for `Metrics.add_collector` reporting the jobs sent
+        to the search workers and how many are waiting on each
+    """
+    def collect():
+        metrics = [
+            ('search_worker_jobs_total', 'counter', {'result': result}, count)
+            for result, count in pool.stats.items()
+        ]
+        metrics.extend(
+            ('search_worker_queue_depth', 'gauge', {'worker': worker.path},
+             worker.load)
+            for worker in pool.workers)
+        return metrics
+    return collect
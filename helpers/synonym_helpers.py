@@ -0,0 +1,110 @@
+"""
+In-memory index of the roboragi synonyms database
+"""
+from json import loads
+from os import stat
+from sqlite3 import Error, connect
+from time import monotonic
+
+from minoshiro import Medium, Site
+from minoshiro.web_api import lndb, mu, nu
+
+from .cache_helpers import normalize_search
+
+ANIDB_URL = 'https://anidb.net/perl-bin/animedb.pl?show=anime&aid='
+
+MEDIUMS = {
+    'Anime': Medium.ANIME,
+    'Manga': Medium.MANGA,
+    'LN': Medium.LN
+}
+
+
+def synonym_urls(links) -> dict:
+    """
+    Builds the secondary site urls that a synonym already knows the ids of
+    :param links: the links dict of a synonym
+    :return: a dict of {Site: {'url': url}}
+    """
+    urls = {}
+    if links.get('adb'):
+        urls[Site.ANIDB] = {'url': f'{ANIDB_URL}{links["adb"]}'}
+    if links.get('mu'):
+        urls[Site.MANGAUPDATES] = {'url': mu.get_manga_url_by_id(links['mu'])}
+    if links.get('lndb'):
+        urls[Site.LNDB] = {'url': lndb.get_light_novel_by_id(links['lndb'])}
+    if links.get('nu'):
+        urls[Site.NOVELUPDATES] = {
+            'url': nu.get_light_novel_by_id(links['nu'])}
+    return urls
+
+
+class SynonymResolver():
+    """
+    Loads the synonyms table once into a dict keyed on
+    (medium, normalized name), so a lookup is a single dict access instead
+    of a full table scan. The file is checked for changes at most once
+    every `check_interval` seconds and reloaded when it changes.
+    """
+    __slots__ = ('path', 'logger', 'check_interval', 'synonyms', 'mtime',
+                 'next_check')
+
+    def __init__(self, path, logger, check_interval: int = 60):
+        """
+        :param path: path to the sqlite synonyms database
+        :param logger: logger object used for logging
+        :param check_interval: seconds between checks for a changed file
+        """
+        self.path = path
+        self.logger = logger
+        self.check_interval = check_interval
+        self.synonyms = {}
+        self.mtime = None
+        self.next_check = 0
+        self.reload_if_changed()
+
+    def __len__(self):
+        return len(self.synonyms)
+
+    def load(self):
+        """
+        Reads every synonym from the database into memory
+        """
+        synonyms = {}
+        conn = connect(self.path)
+        try:
+            for name, type_, db_links in conn.execute(
+                    'SELECT name, type, dbLinks FROM synonyms'):
+                medium = MEDIUMS.get(type_)
+                if medium is None or not name:
+                    continue
+                synonyms.setdefault(
+                    (medium, normalize_search(name)), loads(db_links))
+        finally:
+            conn.close()
+        self.synonyms = synonyms
+        self.logger.info(f'Loaded {len(synonyms)} synonyms.')
+
+    def reload_if_changed(self):
+        """
+        Reloads the synonyms if the file changed since it was last read
+        """
+        self.next_check = monotonic() + self.check_interval
+        try:
+            mtime = stat(self.path).st_mtime
+            if mtime != self.mtime:
+                self.load()
+                self.mtime = mtime
+        except (OSError, Error, ValueError) as e:
+            self.logger.warning(f'Error loading synonyms: {e}')
+
+    def resolve(self, search, medium):
+        """
+        Looks a search up in the synonyms
+        :param search: the search text
+        :param medium: the Medium searched for
+        :return: the links dict for the synonym, or None
+        """
+        if monotonic() >= self.next_check:
+            self.reload_if_changed()
+        return self.synonyms.get((medium, normalize_search(search)))
@@ -0,0 +1,194 @@
+"""
+Fuzzy title matching that only scores the titles sharing enough trigrams
+with the search, instead of every title like difflib.get_close_matches.
+It pays off when one index is kept for a large set of titles, building
+one costs more than difflib takes to score a few dozen titles once.
+"""
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from heapq import heappush, heappushpop, nlargest
+
+
+def trigrams(text) -> Counter:
+    """
+    :param text: the text to split
+    :return: a Counter of the trigrams of the text padded with two spaces
+        on both sides, so every character is in three trigrams
+    """
+    padded = f'  {text}  '
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def max_ratio(a, b, shared) -> float:
+    """
+    The highest ratio a `SequenceMatcher` can give two texts of length `a`
+    and `b` that share `shared` trigrams, by the reasoning of `min_shared`
+    """
+    total = a + b
+    if not total:
+        return 1.0
+    edits = max(0, -(-(max(a, b) + 2 - shared) // 3))
+    return (total - edits) / total
+
+
+def min_shared(a, b, cutoff) -> int:
+    """
+    The fewest trigrams two texts of length `a` and `b` can share if the
+    ratio of a `SequenceMatcher` on them is at least `cutoff`.
+
+    That ratio is 2M / (a + b) for M matching characters, so at most
+    (1 - cutoff) * (a + b) characters have to be inserted or deleted to
+    turn one text into the other, and each of those changes at most three
+    trigrams.
+    :return: the number of trigrams, can be 0 or less
+    """
+    edits = int((1 - cutoff) * (a + b) + 1e-9)
+    return max(a, b) + 2 - 3 * edits
+
+
+def ratio_scorer(word, cutoff):
+    """
+    Scores titles the way difflib.get_close_matches does
+    :param word: the normalized search
+    :param cutoff: the lowest score that matters
+    :return: a function taking a title and returning its score, or 0 if
+        it is certainly below `cutoff`
+    """
+    matcher = SequenceMatcher()
+    matcher.set_seq2(word)
+
+    def score(title):
+        matcher.set_seq1(title)
+        if matcher.real_quick_ratio() >= cutoff and \
+                matcher.quick_ratio() >= cutoff:
+            return matcher.ratio()
+        return 0.0
+
+    return score
+
+
+class TitleIndex():
+    """
+    A trigram index of titles. The candidates for a search are the titles
+    sharing at least `min_shared` trigrams with it, which are then scored
+    by `scorer`, most shared trigrams first, until no candidate left can
+    beat the matches found. With the default scorer this returns exactly
+    what difflib.get_close_matches would, apart from titles being
+    deduplicated.
+
+    Every title can carry values, e.g. the ids of the entries it belongs
+    to, see `add` and `get`.
+    """
+    __slots__ = ('normalize', 'scorer', 'titles', 'sizes', 'values', 'ids',
+                 'postings', 'lengths')
+
+    def __init__(self, titles=(), normalize=str.lower, scorer=ratio_scorer):
+        """
+        :param titles: the titles to index
+        :param normalize: a function applied to titles and searches
+        :param scorer: a function taking the normalized search and the
+            cutoff, returning a function that scores a title
+        """
+        self.normalize = normalize
+        self.scorer = scorer
+        self.titles = []
+        self.sizes = []
+        self.values = []
+        self.ids = {}
+        self.postings = defaultdict(list)
+        self.lengths = defaultdict(list)
+        for title in titles:
+            self.add(title)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, title, value=None):
+        """
+        Adds a title to the index
+        :param title: the title
+        :param value: a value to keep for the title, if any
+        """
+        title = self.normalize(title)
+        try:
+            id_ = self.ids[title]
+        except KeyError:
+            id_ = len(self.titles)
+            self.ids[title] = id_
+            self.titles.append(title)
+            self.sizes.append(len(title))
+            self.values.append([])
+            for gram, count in trigrams(title).items():
+                for occurrence in range(count):
+                    self.postings[gram, occurrence].append(id_)
+            self.lengths[len(title)].append(id_)
+        if value is not None:
+            self.values[id_].append(value)
+
+    def get(self, title) -> list:
+        """
+        :param title: the title
+        :return: the values kept for the title
+        """
+        id_ = self.ids.get(self.normalize(title))
+        return [] if id_ is None else self.values[id_]
+
+    def candidates(self, word, cutoff) -> dict:
+        """
+        :param word: the normalized search
+        :param cutoff: the lowest score that matters
+        :return: the ids of every title that might score at least `cutoff`,
+            with the number of trigrams they share with `word`
+        """
+        a = len(word)
+        found = {}
+        # The fewest shared trigrams for each title length, titles of
+        # lengths left out can't reach the cutoff at all
+        need = [a + 3] * (max(self.lengths, default=0) + 1)
+        for length, ids in self.lengths.items():
+            total = a + length
+            if (2.0 * min(a, length) / total if total else 1.0) >= cutoff:
+                need[length] = min_shared(a, length, cutoff)
+                if need[length] <= 0:
+                    found.update((id_, 0) for id_ in ids)
+        shared = Counter()
+        for gram, count in trigrams(word).items():
+            for occurrence in range(count):
+                shared.update(self.postings.get((gram, occurrence), ()))
+        sizes = self.sizes
+        found.update(
+            (id_, count) for id_, count in shared.items()
+            if count >= need[sizes[id_]])
+        return found
+
+    def get_close_matches(self, word, n: int = 3, cutoff: float = 0.6):
+        """
+        Same as difflib.get_close_matches over the indexed titles
+        :param word: the search
+        :param n: the most matches to return
+        :param cutoff: the lowest score of a match, from 0 to 1
+        :return: up to `n` normalized titles, best first
+        """
+        if not n > 0:
+            raise ValueError(f'n must be > 0: {n!r}')
+        if not 0.0 <= cutoff <= 1.0:
+            raise ValueError(f'cutoff must be in [0.0, 1.0]: {cutoff!r}')
+        word = self.normalize(word)
+        a = len(word)
+        score = self.scorer(word, cutoff)
+        candidates = sorted(
+            ((max_ratio(a, len(self.titles[id_]), shared), id_)
+             for id_, shared in self.candidates(word, cutoff).items()),
+            reverse=True)
+        result = []
+        for best, id_ in candidates:
+            if len(result) >= n and best < result[0][0]:
+                break
+            title = self.titles[id_]
+            title_score = score(title)
+            if title_score >= cutoff:
+                if len(result) < n:
+                    heappush(result, (title_score, title))
+                else:
+                    heappushpop(result, (title_score, title))
+        return [title for _, title in nlargest(n, result)]
@@ -0,0 +1,248 @@
+"""
+Sends searches to worker processes over Unix sockets
+"""
+from asyncio import Lock, ensure_future, get_event_loop, \
+    open_unix_connection, start_unix_server, wait_for
+from collections import Counter
+from itertools import count
+from json import dumps, loads
+from os import unlink
+from time import monotonic
+from zlib import crc32
+
+# Longest line either side reads, results carry whole descriptions
+LINE_LIMIT = 2 ** 24
+
+# Seconds to wait before connecting again to a worker that was down
+RECONNECT_DELAY = 1
+
+
+def worker_path(socket_path, index) -> str:
+    """
+    :param socket_path: the socket path set in config.yml
+    :param index: which of the search workers
+    :return: the socket path of the worker
+    """
+    return f'{socket_path}.{index}'
+
+
+def worker_paths(socket_path, processes) -> list:
+    """
+    :param socket_path: the socket path set in config.yml
+    :param processes: the number of search workers
+    :return: the socket path of every worker
+    """
+    return [worker_path(socket_path, index) for index in range(processes)]
+
+
+def encode(message) -> bytes:
+    """
+    :param message: a JSON serializable dict
+    :return: the message as one line
+    """
+    return dumps(message).encode() + b'\n'
+
+
+async def serve(path, handle, logger):
+    """
+    Answers the jobs sent to a Unix socket. Every line read is a job with
+    an `id`, answered by a line with the same `id` and whatever `handle`
+    returned, or the `error` it raised. The jobs of a connection run
+    concurrently and are answered as they finish, each answer waiting
+    until the connection can take more.
+    :param path: the socket path
+    :param handle: a coroutine function taking a job and returning a dict
+    :param logger: logger object used for logging
+    :return: the server
+    """
+    async def answer(job, writer, lock):
+        try:
+            result = await handle(job)
+        except Exception as e:
+            logger.warning(f'Error running {job.get("op")} job: {e}')
+            result = {'error': str(e)}
+        result['id'] = job['id']
+        # Only one drain may wait on a writer at a time
+        async with lock:
+            writer.write(encode(result))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    async def connected(reader, writer):
+        lock = Lock()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                ensure_future(answer(loads(line), writer, lock))
+        finally:
+            writer.close()
+
+    try:
+        unlink(path)
+    except FileNotFoundError:
+        pass
+    server = await start_unix_server(connected, path, limit=LINE_LIMIT)
+    logger.info(f'Serving searches on {path}')
+    return server
+
+
+class WorkerConnection():
+    """
+    A connection to one search worker, carrying any number of jobs at
+    once. It is opened on the first job and again on the first job after
+    it was lost.
+    """
+    __slots__ = ('path', 'writer', 'pending', 'lock', 'retry_at')
+
+    def __init__(self, path):
+        """
+        :param path: the socket path of the worker
+        """
+        self.path = path
+        self.writer = None
+        self.pending = {}
+        self.lock = Lock()
+        self.retry_at = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None
+
+    @property
+    def load(self) -> int:
+        """
+        :return: the number of jobs waiting on the worker
+        """
+        return len(self.pending)
+
+    async def request(self, job, timeout) -> dict:
+        """
+        Sends a job and waits for its result
+        :param job: a dict with a unique `id`
+        :param timeout: seconds to wait for the result
+        :return: the result
+        :raises ConnectionError: if the worker can't be reached or the
+            connection was lost before the result arrived
+        :raises TimeoutError: if the result took longer than `timeout`
+        """
+        await self.__connect()
+        future = get_event_loop().create_future()
+        self.pending[job['id']] = future
+        try:
+            async with self.lock:
+                if self.writer is None:
+                    raise ConnectionError(f'Lost {self.path}')
+                self.writer.write(encode(job))
+                await self.writer.drain()
+            return await wait_for(future, timeout)
+        finally:
+            self.pending.pop(job['id'], None)
+            # The connection may be lost while the job is being written
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    async def __connect(self):
+        """
+        Connects to the worker unless already connected
+        :raises ConnectionError: if it can't be reached
+        """
+        async with self.lock:
+            if self.writer is not None:
+                return
+            if monotonic() < self.retry_at:
+                raise ConnectionError(f'{self.path} is down')
+            try:
+                reader, self.writer = await open_unix_connection(
+                    self.path, limit=LINE_LIMIT)
+            except OSError as e:
+                self.retry_at = monotonic() + RECONNECT_DELAY
+                raise ConnectionError(f'{self.path} is down: {e}')
+            ensure_future(self.__read(reader))
+
+    async def __read(self, reader):
+        """
+        Hands every result to the job waiting on it, failing the jobs
+        still waiting once the connection is lost
+        :param reader: the reader of the connection
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                result = loads(line)
+                future = self.pending.get(result.pop('id'))
+                if future is not None and not future.done():
+                    future.set_result(result)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.writer.close()
+            self.writer = None
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError(f'Lost {self.path}'))
+
+
+class WorkerPool():
+    """
+    Sends every job for the same cache key to the same search worker, so
+    its lookups are shared and cached in one place, moving on to the next
+    worker only if that one can't be reached.
+    """
+    __slots__ = ('workers', 'timeout', 'ids', 'stats')
+
+    def __init__(self, paths, timeout: float = 30):
+        """
+        :param paths: the socket path of every worker
+        :param timeout: seconds a job may take in a worker
+        """
+        self.workers = [WorkerConnection(path) for path in paths]
+        self.timeout = timeout
+        self.ids = count()
+        self.stats = Counter()
+
+    @property
+    def load(self) -> int:
+        """
+        :return: the number of jobs waiting on every worker
+        """
+        return sum(worker.load for worker in self.workers)
+
+    def route(self, key) -> list:
+        """
+        :param key: the cache key of a job, a tuple of str and int
+        :return: the workers to try in order, starting from the one the
+            key belongs to. crc32 is used as `hash` differs between
+            processes.
+        """
+        start = crc32('\t'.join(map(str, key)).encode()) % len(self.workers)
+        return self.workers[start:] + self.workers[:start]
+
+    async def request(self, job, key) -> dict:
+        """
+        Runs a job on the worker its cache key belongs to
+        :param job: a JSON serializable dict
+        :param key: the cache key of the job, see `route`
+        :return: the result
+        :raises ConnectionError: if no worker could be reached
+        :raises TimeoutError: if the result took longer than `timeout`
+        :raises RuntimeError: if the job failed in the worker
+        """
+        job['id'] = next(self.ids)
+        for worker in self.route(key):
+            try:
+                result = await worker.request(job, self.timeout)
+            except ConnectionError:
+                self.stats['unreachable'] += 1
+                continue
+            self.stats['jobs'] += 1
+            if 'error' in result:
+                raise RuntimeError(result['error'])
+            return result
+        raise ConnectionError('No search worker could be reached')
@@ -0,0 +1,215 @@
+"""
+Runs the bot as several processes, each running some of its shards
+    python launcher.py
+How many processes and shards is set in the sharding section of
+config/config.yml. The searches can also be run by their own processes, set
+in the search_workers section, leaving the shard processes to talk to
+Discord. Every process reads the same config, so they share the database,
+the cache table and the synonyms, and a process that crashes is started
+again.
+"""
+from asyncio import get_event_loop
+from logging import INFO, basicConfig, getLogger
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from signal import SIGINT, SIGTERM, signal
+from time import monotonic
+
+import yaml
+from asyncpg import create_pool
+
+from helpers.database_helpers import make_tables
+from helpers.worker_helpers import worker_paths
+from run import DEFAULT_SOCKET, run, run_search_worker
+
+# Discord lets a bot identify one shard every 5 seconds
+IDENTIFY_DELAY = 5
+
+
+def shard_groups(shard_count, processes) -> list:
+    """
+    Splits the shards between the processes as evenly as possible
+    :param shard_count: the number of shards
+    :param processes: the number of processes
+    :return: a list with the shard ids of every process
+    """
+    size, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (index < extra)
+        groups.append(list(range(start, end)))
+        start = end
+    return [group for group in groups if group]
+
+
+class Supervisor():
+    """
+    Starts a process for every target and restarts the ones that crash,
+    waiting `restart_delay` seconds, doubled for every crash in a row up to
+    `max_restart_delay`. A process that stays up for `stable_after` seconds
+    starts counting from zero again. Processes that exit cleanly are not
+    restarted.
+    """
+    __slots__ = ('targets', 'restart_delay', 'max_restart_delay',
+                 'stable_after', 'logger', 'context', 'running', 'crashes',
+                 'starts', 'stopping')
+
+    def __init__(self, targets, logger, restart_delay=5,
+                 max_restart_delay=300, stable_after=600):
+        """
+        :param targets: a (name, function, args, delay) tuple for every
+            process, delay being the seconds to wait before starting the
+            next one
+        :param logger: logger object used for logging
+        :param restart_delay: seconds waited before restarting a process
+        :param max_restart_delay: the longest wait before a restart
+        :param stable_after: seconds a process has to stay up for its
+            crashes to be forgotten
+        """
+        self.targets = targets
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_after = stable_after
+        self.logger = logger
+        self.context = get_context('spawn')
+        self.running = {}
+        self.crashes = [0] * len(targets)
+        self.starts = {}
+        self.stopping = False
+
+    def start(self, index):
+        """
+        Starts the process of a target
+        :param index: the index of the target
+        """
+        name, target, args, _ = self.targets[index]
+        process = self.context.Process(target=target, args=args, name=name)
+        process.start()
+        self.running[process.sentinel] = (index, process, monotonic())
+        self.logger.info(f'Started {process.name} as pid {process.pid}')
+
+    def stop(self, *_):
+        """
+        Stops restarting processes and ends the ones running
+        """
+        self.stopping = True
+
+    def supervise(self):
+        """
+        Starts every process and watches them until `stop` is called or
+        every process exited cleanly
+        """
+        start_at = monotonic()
+        for index, (_, _, _, delay) in enumerate(self.targets):
+            self.starts[index] = start_at
+            start_at += delay
+        while (self.running or self.starts) and not self.stopping:
+            timeout = min([1] + [
+                start_at - monotonic() for start_at in self.starts.values()])
+            for sentinel in wait(list(self.running), max(timeout, 0)):
+                self.__exited(*self.running.pop(sentinel))
+            now = monotonic()
+            for index, start_at in list(self.starts.items()):
+                if start_at <= now and not self.stopping:
+                    del self.starts[index]
+                    self.start(index)
+        self.__shutdown()
+
+    def __exited(self, index, process, started):
+        """
+        Schedules the restart of a process that crashed
+        :param index: the index of its target
+        :param process: the process
+        :param started: the monotonic time it was started at
+        """
+        process.join()
+        if process.exitcode == 0 or self.stopping:
+            self.logger.info(f'{process.name} exited')
+            return
+        if monotonic() - started >= self.stable_after:
+            self.crashes[index] = 0
+        delay = min(self.restart_delay * 2 ** self.crashes[index],
+                    self.max_restart_delay)
+        self.crashes[index] += 1
+        self.starts[index] = monotonic() + delay
+        self.logger.warning(
+            f'{process.name} exited with {process.exitcode}, '
+            f'restarting it in {delay}s')
+
+    def __shutdown(self, timeout=30):
+        """
+        Asks every process to close and kills the ones that don't
+        :param timeout: seconds they are given to close
+        """
+        processes = [process for _, process, _ in self.running.values()]
+        for process in processes:
+            process.terminate()
+        deadline = monotonic() + timeout
+        for process in processes:
+            process.join(max(deadline - monotonic(), 0))
+            if process.is_alive():
+                self.logger.warning(f'Killing {process.name}')
+                process.kill()
+                process.join()
+        self.running.clear()
+
+
+async def prepare(database_config):
+    """
+    Makes the tables once, so the processes don't race to make them and
+    are started with the tables already made
+    :param database_config: the database_info section of config.yml
+    """
+    pool = await create_pool(**database_config)
+    try:
+        await make_tables(pool, 'discordoragi')
+    finally:
+        await pool.close()
+
+
+def launch():
+    basicConfig(
+        level=INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logger = getLogger('launcher')
+    with open('config/config.yml', 'r') as yml_config:
+        config = yaml.load(yml_config)
+    sharding = config.get('sharding') or {}
+    processes = sharding.get('processes', 1)
+    shard_count = sharding.get('shard_count') or processes
+    workers = config.get('search_workers') or {}
+    worker_count = workers.get('processes', 0)
+    get_event_loop().run_until_complete(prepare(config['database_info']))
+    groups = shard_groups(shard_count, processes)
+    logger.info(f'Running {shard_count} shards in {len(groups)} processes '
+                f'and {worker_count} search workers')
+    total = len(groups) + worker_count
+    paths = worker_paths(workers.get('socket', DEFAULT_SOCKET), worker_count)
+    # Every process serves its metrics on the next port
+    port = (config.get('metrics') or {}).get('port')
+    ports = [port and port + index for index in range(total)]
+    # The workers start first, shard processes far enough apart for each to
+    # identify all of its shards
+    targets = [
+        (f'search-worker-{index}', run_search_worker,
+         (index, total, ports[index]), 0)
+        for index in range(worker_count)
+    ] + [
+        (f'shards-{group[0]}-{group[-1]}', run,
+         (group, shard_count, total, paths, ports[worker_count + index],
+          True),
+         IDENTIFY_DELAY * len(group))
+        for index, group in enumerate(groups)
+    ]
+    supervisor = Supervisor(
+        targets, logger,
+        restart_delay=sharding.get('restart_delay', 5),
+        max_restart_delay=sharding.get('max_restart_delay', 300),
+        stable_after=sharding.get('stable_after', 600))
+    signal(SIGINT, supervisor.stop)
+    signal(SIGTERM, supervisor.stop)
+    supervisor.supervise()
+
+
+if __name__ == '__main__':
+    launch()
@@ -0,0 +1,42 @@
+"""
+Runs the optional database migrations
+    python migrate.py partition-requests
+"""
+from asyncio import get_event_loop
+from logging import INFO, basicConfig, getLogger
+from sys import argv
+
+import yaml
+from asyncpg import create_pool
+
+from helpers.database_helpers import make_tables, partition_requests
+
+MIGRATIONS = {
+    'partition-requests': partition_requests
+}
+
+
+async def migrate(name):
+    logger = getLogger('discordoragi')
+    with open('config/config.yml', 'r') as yml_config:
+        config = yaml.load(yml_config)
+    pool = await create_pool(**config['database_info'])
+    try:
+        await make_tables(pool, 'discordoragi')
+        logger.info(f'Running {name}...')
+        await MIGRATIONS[name](pool)
+        logger.info(f'{name} done.')
+    finally:
+        await pool.close()
+
+
+def run():
+    if len(argv) != 2 or argv[1] not in MIGRATIONS:
+        print(f'usage: python migrate.py [{"|".join(MIGRATIONS)}]')
+        return
+    basicConfig(level=INFO)
+    get_event_loop().run_until_complete(migrate(argv[1]))
+
+
+if __name__ == '__main__':
+    run()
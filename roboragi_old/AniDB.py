@@ -4,13 +4,13 @@ Handles all AniDB information
 '''
 
 from pyquery import PyQuery as pq
-import aiohttp
+import Http
 import urllib
 import difflib
 import traceback
 import pprint
 
-session = aiohttp.ClientSession()
+session = Http.Session()
 
 async def getAnimeURL(searchText):
     cleanSearchText = urllib.parse.quote(searchText)
@@ -4,7 +4,7 @@ Anilist.py
 Handles all of the connections to Anilist.
 """
 import DatabaseHandler
-import aiohttp
+import Http
 import urllib
 import difflib
 import traceback
@@ -13,7 +13,7 @@ import asyncio
 ANICLIENT = ''
 ANISECRET = ''
 
-session = aiohttp.ClientSession()
+session = Http.Session()
 
 try:
     import Config
@@ -56,36 +56,45 @@ async def setup():
             global access_token
             access_token = request['access_token']
     except Exception as e:
-        print('Error getting Anilist token: '+ e)
+        print('Error getting Anilist token: {}'.format(e))
+
+#Makes a request to the Anilist api. Only a 401 means the token expired, so only then is a new one fetched and the
+#request made again. Rate limits and server errors are already retried by the session, and once Anilist keeps failing
+#its circuit opens and requests raise Http.UpstreamUnavailable straight away instead of waiting to time out.
+async def get(url, **params):
+    for attempt in range(2):
+        params['access_token'] = access_token
+        async with session.get(url, params=params) as resp:
+            if resp.status != 401:
+                resp.raise_for_status()
+                return await resp.json()
+        await setup()
+    raise Exception("Anilist rejected a fresh access token for {}".format(url))
 
 #Returns the closest anime (as a Json-like object) it can find using the given searchtext
 async def getAnimeDetails(searchText):
-    cachedAnime = DatabaseHandler.checkForMalEntry('anilistanime', searchText)
+    cachedAnime = await DatabaseHandler.runInThread(DatabaseHandler.checkForMalEntry, 'anilistanime', searchText)
     if cachedAnime is not None:
         if cachedAnime['update']:
             print("found cached anime, needs update in anilist")
-            return await getAnimeDetailsById(cachedAnime['id'])
+            #Falls back to the old copy when Anilist can't be reached
+            return await getAnimeDetailsById(cachedAnime['id']) or await DatabaseHandler.runInThread(DatabaseHandler.getCachedEntry, 'anilistanime', cachedAnime['id'])
         else:
             print("found cached anime, doesn't need update in anilist")
             return cachedAnime['content']
     try:
         #htmlSearchText = escape(searchText)
         htmlSearchText = urllib.parse.quote(searchText)
-        async with session.get("https://anilist.co/api/anime/search/" + htmlSearchText, params={'access_token':access_token}, timeout=10) as resp:          
-            if resp.status != 200:
-                await setup()
-                request = await session.get("https://anilist.co/api/anime/search/" + htmlSearchText, params={'access_token':access_token}, timeout=10)
-            
-            request = await resp.json()
-            
-            #Of the given list of shows, we try to find the one we think is closest to our search term
-            closestAnime = getClosestAnime(searchText, request)
+        request = await get("https://anilist.co/api/anime/search/" + htmlSearchText)
+        
+        #Of the given list of shows, we try to find the one we think is closest to our search term
+        closestAnime = getClosestAnime(searchText, request)
 
-            if closestAnime:
-                fullDetails = await getFullAnimeDetails(closestAnime['id'])
-                return fullDetails
-            else:
-                return None
+        if closestAnime:
+            fullDetails = await getFullAnimeDetails(closestAnime['id'])
+            return fullDetails
+        else:
+            return None
             
     except Exception as e:
         traceback.print_exc()
@@ -101,22 +110,13 @@ async def getAnimeDetailsById(animeID):
 #Gets the "full" anime details (which aren't displayed when we search using the basic function). Gives us cool data like time until the next episode is aired.
 async def getFullAnimeDetails(animeID):
     try:
-        async with session.get("https://anilist.co/api/anime/" + str(animeID), params={'access_token':access_token}, timeout=10) as resp:
-            if resp.status != 200:
-                await setup()
-                resp = await session.get("https://anilist.co/api/anime/" + str(animeID), params={'access_token':access_token}, timeout=10)
-                
-            
-            if resp.status == 200:
-                request = await resp.json()
-                request['genres'] = [genre for genre in request['genres'] if genre]
-                request['synonyms'] = [synonym for synonym in request['synonyms'] if synonym]
+        request = await get("https://anilist.co/api/anime/" + str(animeID))
+        request['genres'] = [genre for genre in request['genres'] if genre]
+        request['synonyms'] = [synonym for synonym in request['synonyms'] if synonym]
 
-                return request
-            else:
-                return None
+        return request
     except Exception as e:
-        print("Error finding anime:{} in anilist.\nError:{}".format(searchText, e))
+        print("Error finding anime:{} in anilist.\nError:{}".format(animeID, e))
         #traceback.print_exc()
         return None
 
@@ -161,46 +161,37 @@ def getClosestAnime(searchText, animeList):
 async def getMangaWithAuthor(searchText, authorName):
     try:
         
-        async with session.get("https://anilist.co/api/manga/search/" + searchText, params={'access_token':access_token}, timeout=10) as resp:
-            if resp.status !=200:
-                await setup()
-                resp = await session.get("https://anilist.co/api/manga/search/" + searchText, params={'access_token':access_token}, timeout=10)
-
-            
-            request = await resp.json()
-            closestManga = getListOfCloseManga(searchText, request)
-            fullMangaList = []
-
-            for manga in closestManga:
-                try:
-                    async with session.get("https://anilist.co/api/manga/" + str(manga['id']) + "/staff", params={'access_token':access_token}, timeout=10) as fullManga:
-                        if fullManga.status !=200:
-                            await setup()
-                            fullManga = await session.get("https://anilist.co/api/manga/" + str(manga['id']) + "/staff", params={'access_token':access_token}, timeout=10)    
-
-                        fullMangaJson = await fullManga.json()   
-                        fullMangaList.append(fullMangaJson)
-                except:
-                    pass
-
-            potentialHits = []
-            for manga in fullMangaList:
-                for staff in manga['staff']:
-                    isRightName = True
-                    fullStaffName = staff['name_first'] + ' ' + staff['name_last']
-                    authorNamesSplit = authorName.split(' ')
-
-                    for name in authorNamesSplit:
-                        if not (name.lower() in fullStaffName.lower()):
-                            isRightName = False
-
-                    if isRightName:
-                        potentialHits.append(manga)
-
-            if potentialHits:
-                return getClosestManga(searchText, potentialHits)
+        request = await get("https://anilist.co/api/manga/search/" + searchText)
+        closestManga = getListOfCloseManga(searchText, request)
+        fullMangaList = []
+
+        for manga in closestManga:
+            try:
+                fullMangaJson = await get("https://anilist.co/api/manga/" + str(manga['id']) + "/staff")
+                fullMangaList.append(fullMangaJson)
+            except Http.UpstreamUnavailable:
+                break
+            except:
+                pass
+
+        potentialHits = []
+        for manga in fullMangaList:
+            for staff in manga['staff']:
+                isRightName = True
+                fullStaffName = staff['name_first'] + ' ' + staff['name_last']
+                authorNamesSplit = authorName.split(' ')
+
+                for name in authorNamesSplit:
+                    if not (name.lower() in fullStaffName.lower()):
+                        isRightName = False
+
+                if isRightName:
+                    potentialHits.append(manga)
+
+        if potentialHits:
+            return getClosestManga(searchText, potentialHits)
 
-            return None
+        return None
         
     except Exception as e:
         traceback.print_exc()
@@ -211,33 +202,28 @@ async def getLightNovelDetails(searchText):
 
 #Returns the closest manga series given a specific search term
 async def getMangaDetails(searchText, isLN=False):
-    cachedAnime = DatabaseHandler.checkForMalEntry('anilistmanga', searchText, isLN)
+    cachedAnime = await DatabaseHandler.runInThread(DatabaseHandler.checkForMalEntry, 'anilistmanga', searchText, isLN)
     if cachedAnime is not None:
         if cachedAnime['update']:
             print("found cached anime, needs update in anilist")
-            return await getMangaDetailsById(cachedAnime['id'])
+            #Falls back to the old copy when Anilist can't be reached
+            return await getMangaDetailsById(cachedAnime['id']) or await DatabaseHandler.runInThread(DatabaseHandler.getCachedEntry, 'anilistmanga', cachedAnime['id'])
         else:
             print("found cached anime, doesn't need update in anilist")
             return cachedAnime['content']
     try:
-        async with session.get("https://anilist.co/api/manga/search/" + searchText, params={'access_token':access_token}, timeout=10) as resp:
-            if resp.status != 200:
-                await setup()
-                resp = await session.get("https://anilist.co/api/manga/search/" + searchText, params={'access_token':access_token}, timeout=10)
-            
-            request = await resp.json()
-            closestManga = getClosestManga(searchText, request, isLN)
+        request = await get("https://anilist.co/api/manga/search/" + searchText)
+        closestManga = getClosestManga(searchText, request, isLN)
 
-            if (closestManga is not None):
-                response = await session.get("https://anilist.co/api/manga/" + str(closestManga['id']), params={'access_token':access_token}, timeout=10)
-                json = await response.json()
+        if (closestManga is not None):
+            json = await get("https://anilist.co/api/manga/" + str(closestManga['id']))
 
-                json['genres'] = [genre for genre in json['genres'] if genre]
-                json['synonyms'] = [synonym for synonym in json['synonyms'] if synonym]
+            json['genres'] = [genre for genre in json['genres'] if genre]
+            json['synonyms'] = [synonym for synonym in json['synonyms'] if synonym]
 
-                return json
-            else:
-                return None
+            return json
+        else:
+            return None
         
     except Exception as e:
         print("Error finding manga:{} in anilist.\nError:{}".format(searchText, e))
@@ -247,9 +233,7 @@ async def getMangaDetails(searchText, isLN=False):
 #Returns the closest manga series given an id
 async def getMangaDetailsById(mangaId):
     try:
-        async with session.get("https://anilist.co/api/manga/" + str(mangaId), params={'access_token':access_token}, timeout=10) as resp:
-            request = await resp.json()
-            return request
+        return await get("https://anilist.co/api/manga/" + str(mangaId))
     except Exception as e:
         
         return None
@@ -328,8 +312,7 @@ def getClosestManga(searchText, mangaList, isLN=False):
 ################################THESE ARE FOR POPULATING THE CACHE #####################################
 async def getGenres(medium):
     try:
-        async with session.get("https://anilist.co/api/genre_list/".format(medium), params={'access_token':access_token}, timeout=10)as resp:
-            return await resp.json()
+        return await get("https://anilist.co/api/genre_list/")
     
     except Exception as e:
         print(e)
@@ -337,15 +320,7 @@ async def getGenres(medium):
 
 async def GetTop40ByGenre(medium, genre):
     try:
-        async with session.get("https://anilist.co/api/browse/{}".format(medium), params={'access_token':access_token, 'genres':genre, 'sort':'popularity'}, timeout=10) as resp:
-            if resp.status != 200:
-                await setup()
-                resp = await session.get("https://anilist.co/api/manga/search/" + searchText, params={'access_token':access_token}, timeout=10)
-                if resp.status != 200:
-                    print("Failed to get api info error code {}".format(resp.status))
-            
-            request = await resp.json()
-            return request
+        return await get("https://anilist.co/api/browse/{}".format(medium), genres=genre, sort='popularity')
     except Exception as e:
         print(e)
         return None
@@ -353,16 +328,7 @@ async def GetTop40ByGenre(medium, genre):
 # Returns a json with the 40 anime from the 'page' of populartiy
 async def get_page_by_popularity(medium, page):
     try:
-        async with session.get("https://anilist.co/api/browse/{}".format(medium), params={'access_token':access_token, 'sort':'popularity-desc', 'page':  page}, timeout=10) as resp:
-            if resp.status != 200:
-                await setup()
-                resp = await session.get("https://anilist.co/api/browse/{}".format(medium), params={'access_token':access_token, 'sort':'popularity', 'page':  page}, timeout=10)
-                if resp.status != 200:
-                    print("Failed to get ani-api info error code {}".format(resp.status))
-            
-            request = await resp.json()
-            return request
-        pass
+        return await get("https://anilist.co/api/browse/{}".format(medium), sort='popularity-desc', page=page)
     except Exception as e:
         print(e)
         return None
@@ -31,7 +31,7 @@ async def on_ready():
 
 @Discord.client.event
 async def on_server_join(server):
-    DatabaseHandler.addServerToDatabase(server.id)
+    await DatabaseHandler.runInThread(DatabaseHandler.addServerToDatabase, server.id)
     print("Added server {} to database".format(server.id))
     
 async def process_message(message, is_edit=False):
@@ -75,7 +75,7 @@ async def process_message(message, is_edit=False):
     if re.search('({!command.*?}|{{!command.*?}}|<!command.*?>|<<!command.*?>>)', cleanMessage, re.S) is not None:
         if 'toggleexpanded' in cleanMessage.lower() and (isAdmin or isServerMod):
             try:
-                allowedStatus = DatabaseHandler.toggleAllowExpanded(message.server.id)
+                allowedStatus = await DatabaseHandler.runInThread(DatabaseHandler.toggleAllowExpanded, message.server.id)
                 print("Toggled allowExpanded for server {}".format(message.server.id))
                 if allowedStatus.lower() == 'true':
                     await Discord.client.send_message(message.channel, "Expanded requests are now allowed.")
@@ -88,7 +88,7 @@ async def process_message(message, is_edit=False):
 
         if 'addserver' in cleanMessage.lower() and (isOwner == True):
             try:
-                DatabaseHandler.addServerToDatabase(message.server.id)
+                await DatabaseHandler.runInThread(DatabaseHandler.addServerToDatabase, message.server.id)
                 await Discord.client.send_message(message.channel, "Server has been added.")
                 return
             except Exception as e:
@@ -105,23 +105,23 @@ async def process_message(message, is_edit=False):
     if re.search('({!stats.*?}|{{!stats.*?}}|<!stats.*?>|<<!stats.*?>>)', cleanMessage, re.S) is not None and sender is not None:
         for mention in mentionArray:
             if not canEmbed:
-                messageReply = CommentBuilder.buildStatsComment(server=message.server, username=mention)
+                messageReply = await CommentBuilder.buildStatsComment(server=message.server, username=mention)
             else:
-                localEm = CommentBuilder.buildStatsEmbed(server=message.server, username=mention)
+                localEm = await CommentBuilder.buildStatsEmbed(server=message.server, username=mention)
                 await Discord.client.send_message(message.channel, embed=localEm)
                 return None
     if re.search('({!sstats}|{{!sstats}}|<!sstats>|<<!sstats>>)', cleanMessage, re.S) is not None:
         if not canEmbed:
-            messageReply = CommentBuilder.buildStatsComment(server = message.server)
+            messageReply = await CommentBuilder.buildStatsComment(server = message.server)
         else:
-            localEm = CommentBuilder.buildStatsEmbed(server = message.server)
+            localEm = await CommentBuilder.buildStatsEmbed(server = message.server)
             await Discord.client.send_message(message.channel, embed=localEm)
             return None
     elif re.search('({!stats.*?}|{{!stats.*?}}|<!stats.*?>|<<!stats.*?>>)', cleanMessage, re.S) is not None:
         if not canEmbed:
-            messageReply = CommentBuilder.buildStatsComment()
+            messageReply = await CommentBuilder.buildStatsComment()
         else:
-            localEm = CommentBuilder.buildStatsEmbed()
+            localEm = await CommentBuilder.buildStatsEmbed()
             await Discord.client.send_message(message.channel, embed=localEm)
             return None
     else:
@@ -134,7 +134,7 @@ async def process_message(message, is_edit=False):
         numOfRequest = 0
         numOfExpandedRequest = 0
         forceNormal = False
-        expandedAllowed = DatabaseHandler.checkServerConfig('allowexpanded', message.server.id)
+        expandedAllowed = await DatabaseHandler.runInThread(DatabaseHandler.checkServerConfig, 'allowexpanded', message.server.id)
         if expandedAllowed == False:
             forceNormal = True
         for match in re.finditer("\{{2}([^}]*)\}{2}|\<{2}([^>]*)\>{2}", cleanMessage, re.S):
@@ -339,7 +339,7 @@ async def process_message(message, is_edit=False):
             if is_edit:
                 return None
             else:
-                DatabaseHandler.addMessage(message.id, message.author.id, message.server.id, False)
+                await DatabaseHandler.runInThread(DatabaseHandler.addMessage, message.id, message.author.id, message.server.id, False)
         except:
             traceback.print_exc()
 
@@ -349,10 +349,10 @@ async def on_message(message):
     from DiscordoragiSearch import isValidMessage #local import here to fix attribute not found error
     print('Message recieved')
     #Is the message valid (i.e. it's not made by Discordoragi and I haven't seen it already). If no, try to add it to the "already seen pile" and skip to the next message. If yes, keep going.
-    if not (isValidMessage(message)):
+    if not (await isValidMessage(message)):
         try:
-            if not (DatabaseHandler.messageExists(message.id)):
-                DatabaseHandler.addMessage(message.id, message.author.id, message.server.id, False)
+            if not (await DatabaseHandler.runInThread(DatabaseHandler.messageExists, message.id)):
+                await DatabaseHandler.runInThread(DatabaseHandler.addMessage, message.id, message.author.id, message.server.id, False)
         except Exception:
             traceback.print_exc()
             pass
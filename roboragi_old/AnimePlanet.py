@@ -1,5 +1,5 @@
 from pyquery import PyQuery as pq
-import aiohttp
+import Http
 import difflib
 import traceback
 import pprint
@@ -7,7 +7,7 @@ import collections
 
 BASE_URL = "http://www.anime-planet.com"
 
-session = aiohttp.ClientSession()
+session = Http.Session()
 
 def sanitiseSearchText(searchText):
     return searchText.replace('(TV)', 'TV')
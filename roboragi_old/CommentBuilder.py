@@ -32,7 +32,7 @@ def cleanupDescription(desc):
     return reply
 
 #Builds an anime comment from MAL/Anilist data
-def buildAnimeComment(isExpanded, mal, ani, ap, anidb):
+async def buildAnimeComment(isExpanded, mal, ani, ap, anidb):
     try:
         comment = ''
 
@@ -99,10 +99,10 @@ def buildAnimeComment(isExpanded, mal, ani, ap, anidb):
             except:
                 print('No full details for Anilist')
 
-        stats = DatabaseHandler.getRequestStats(title, 'Anime')
+        stats = await DatabaseHandler.runInThread(DatabaseHandler.getRequestStats, title, 'Anime')
 
         if ani is not None:
-            stats = DatabaseHandler.getRequestStats(ani['title_romaji'],'Anime')
+            stats = await DatabaseHandler.runInThread(DatabaseHandler.getRequestStats, ani['title_romaji'],'Anime')
 
         #---------- BUILDING THE COMMENT ----------#
                 
@@ -213,7 +213,7 @@ def buildAnimeComment(isExpanded, mal, ani, ap, anidb):
         return None
 
 #Builds a manga comment from MAL/Anilist/MangaUpdates data
-def buildMangaComment(isExpanded, mal, ani, mu, ap):
+async def buildMangaComment(isExpanded, mal, ani, mu, ap):
     try:
         comment = ''
 
@@ -285,7 +285,7 @@ def buildMangaComment(isExpanded, mal, ani, mu, ap):
             except Exception as e:
                 print(e)
 
-        stats = DatabaseHandler.getRequestStats(title,'Manga')
+        stats = await DatabaseHandler.runInThread(DatabaseHandler.getRequestStats, title,'Manga')
         
         #---------- BUILDING THE COMMENT ----------#
                 
@@ -400,7 +400,7 @@ def buildMangaComment(isExpanded, mal, ani, mu, ap):
         return None
 
 #Builds a manga comment from MAL/Anilist/MangaUpdates data
-def buildLightNovelComment(isExpanded, mal, ani, nu, lndb):
+async def buildLightNovelComment(isExpanded, mal, ani, nu, lndb):
     try:
         comment = ''
 
@@ -472,7 +472,7 @@ def buildLightNovelComment(isExpanded, mal, ani, nu, lndb):
             except Exception as e:
                 print(e)
 
-        stats = DatabaseHandler.getRequestStats(title,'LN')
+        stats = await DatabaseHandler.runInThread(DatabaseHandler.getRequestStats, title,'LN')
         
         #---------- BUILDING THE COMMENT ----------#
                 
@@ -587,13 +587,13 @@ def buildLightNovelComment(isExpanded, mal, ani, nu, lndb):
         return None
 
 #Builds a stats comment. If it is basic stats the default server id is the Discordoragi help server
-def buildStatsComment(server=None, username=None, serverID="171004769069039616"):
+async def buildStatsComment(server=None, username=None, serverID="171004769069039616"):
     try:
         statComment = ''
         receipt = '(S) Request successful: Stats'
         
         if username:
-            userStats = DatabaseHandler.getUserStats(username)
+            userStats = await DatabaseHandler.runInThread(DatabaseHandler.getUserStats, username)
             
             if userStats:
                 statComment += 'Some stats on ' + username + ':\n\n'
@@ -613,7 +613,7 @@ def buildStatsComment(server=None, username=None, serverID="171004769069039616")
         elif server:
             serverID = server.id
             server = str(server)
-            serverStats = DatabaseHandler.getSubredditStats(server.lower())
+            serverStats = await DatabaseHandler.runInThread(DatabaseHandler.getSubredditStats, server.lower())
             
             if serverStats:
                 statComment += '**' + server +' Stats**\n\n'
@@ -644,7 +644,7 @@ def buildStatsComment(server=None, username=None, serverID="171004769069039616")
                
             receipt += ' - ' + server
         else:
-            basicStats = DatabaseHandler.getBasicStats(serverID)
+            basicStats = await DatabaseHandler.runInThread(DatabaseHandler.getBasicStats, serverID)
             
             #The overall stats section
             statComment += '**Overall Stats**\n\n'
@@ -679,7 +679,7 @@ def buildStatsComment(server=None, username=None, serverID="171004769069039616")
         return None
 
 # Builds an embed using the same data
-def buildAnimeEmbed(isExpanded, mal, ani, ap, anidb):
+async def buildAnimeEmbed(isExpanded, mal, ani, ap, anidb):
     try:
         comment = ''
         descComment = ''
@@ -760,10 +760,10 @@ def buildAnimeEmbed(isExpanded, mal, ani, ap, anidb):
             except:
                 print('No full details for Anilist')
 
-        stats = DatabaseHandler.getRequestStats(title, 'Anime')
+        stats = await DatabaseHandler.runInThread(DatabaseHandler.getRequestStats, title, 'Anime')
 
         if ani is not None:
-            stats = DatabaseHandler.getRequestStats(ani['title_romaji'],'Anime')
+            stats = await DatabaseHandler.runInThread(DatabaseHandler.getRequestStats, ani['title_romaji'],'Anime')
 
         #---------- BUILDING THE COMMENT ----------#
 
@@ -881,7 +881,7 @@ def buildAnimeEmbed(isExpanded, mal, ani, ap, anidb):
         return None
 
 #sets up the embed for Mangas
-def buildMangaEmbed(isExpanded, mal, ani, mu, ap):
+async def buildMangaEmbed(isExpanded, mal, ani, mu, ap):
     try:
         comment = ''
         descComment = ''
@@ -965,7 +965,7 @@ def buildMangaEmbed(isExpanded, mal, ani, mu, ap):
             except Exception as e:
                 print(e)
 
-        stats = DatabaseHandler.getRequestStats(title,'Manga')
+        stats = await DatabaseHandler.runInThread(DatabaseHandler.getRequestStats, title,'Manga')
         
         #---------- BUILDING THE COMMENT ----------#
 
@@ -1087,7 +1087,7 @@ def buildMangaEmbed(isExpanded, mal, ani, mu, ap):
         return None
 
 #sets up the embed for Light Novels
-def buildLightNovelEmbed(isExpanded, mal, ani, nu, lndb):
+async def buildLightNovelEmbed(isExpanded, mal, ani, nu, lndb):
     try:
         comment = ''
         descComment= ''
@@ -1174,7 +1174,7 @@ def buildLightNovelEmbed(isExpanded, mal, ani, nu, lndb):
             except Exception as e:
                 print(e)
 
-        stats = DatabaseHandler.getRequestStats(title,'LN')
+        stats = await DatabaseHandler.runInThread(DatabaseHandler.getRequestStats, title,'LN')
         
         #---------- BUILDING THE COMMENT ----------#
 
@@ -1289,7 +1289,7 @@ def buildLightNovelEmbed(isExpanded, mal, ani, nu, lndb):
         #traceback.print_exc()
         return None
 
-def buildStatsEmbed(server=None, username=None, serverID="171004769069039616"):
+async def buildStatsEmbed(server=None, username=None, serverID="171004769069039616"):
     try:
         userNick = ''
         statComment = ''
@@ -1301,7 +1301,7 @@ def buildStatsEmbed(server=None, username=None, serverID="171004769069039616"):
                 userNick = reqMember.nick
             else:
                 userNick = reqMember.name
-            userStats = DatabaseHandler.getUserStats(username)
+            userStats = await DatabaseHandler.runInThread(DatabaseHandler.getUserStats, username)
             
             if userStats:
                 statComment += 'Some stats on ' + userNick + ':\n\n'
@@ -1317,7 +1317,7 @@ def buildStatsEmbed(server=None, username=None, serverID="171004769069039616"):
                 
             receipt += ' - ' + userNick
         elif server:
-            serverStats = DatabaseHandler.getSubredditStats(server)
+            serverStats = await DatabaseHandler.runInThread(DatabaseHandler.getSubredditStats, server)
             
             if serverStats:
                 statComment += '**' + server.name +' Stats**\n\n'
@@ -1340,7 +1340,7 @@ def buildStatsEmbed(server=None, username=None, serverID="171004769069039616"):
                
             receipt += ' - ' + server.name
         else:
-            basicStats = DatabaseHandler.getBasicStats(serverID)
+            basicStats = await DatabaseHandler.runInThread(DatabaseHandler.getBasicStats, serverID)
             
             #The overall stats section
             statComment += '**Overall Stats**\n\n'
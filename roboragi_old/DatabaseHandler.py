@@ -5,9 +5,12 @@ Handles all connections to the database. The database runs on PostgreSQL and is
 
 import psycopg2
 from psycopg2 import sql
-from psycopg2.extras import Json, DictCursor
+from psycopg2.extras import Json, DictCursor, execute_values
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import functools
 from math import sqrt
 import traceback
 import discord
@@ -29,6 +32,13 @@ except ImportError:
 conn = psycopg2.connect("dbname='" + DBNAME + "' user='" + DBUSER + "' host='" + DBHOST + "' password='" + DBPASSWORD + "'")
 cur = conn.cursor()
 
+#Every query runs on this one thread, so the shared connection is never used by two threads at once
+dbThread = ThreadPoolExecutor(max_workers=1)
+
+#Runs a database call on the database thread, so coroutines waiting on postgres don't block the event loop
+async def runInThread(func, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(dbThread, functools.partial(func, *args, **kwargs))
+
 #Sets up the database and creates the databases if they haven't already been made.
 def setup():
     try:
@@ -56,6 +66,7 @@ def setup():
         cur.execute('ROLLBACK')
         conn.commit()
 
+    #The cache tables are also created by make_tables in helpers/database_helpers.py, which adds the indexes checkForMalEntry relies on
     #Create malAnime table
     try:
         cur.execute('CREATE TABLE malanime ( id varchar(16) PRIMARY KEY, name varchar(320) ,  synonyms varchar(320)[], accesstimestamp timestamp DEFAULT current_timestamp, dict JSONB)')
@@ -105,6 +116,18 @@ setup()
 #--------------------------------------#
 # Server config
 
+#serverid -> serverconfig row, so checking a setting doesn't hit the database for every message
+serverConfigCache = {}
+
+def getServerConfig(serverId):
+    serverId = str(serverId)
+    if serverId not in serverConfigCache:
+        cur = conn.cursor(cursor_factory = DictCursor)
+        cur.execute('SELECT * FROM serverconfig WHERE serverid = (%s)', [serverId])
+        row = cur.fetchone()
+        serverConfigCache[serverId] = dict(row) if row is not None else None
+    return serverConfigCache[serverId]
+
 def addServerToDatabase(serverId):
     try:
         
@@ -113,6 +136,7 @@ def addServerToDatabase(serverId):
         row = cur.fetchone()
         if row is None:
             cur.execute('INSERT INTO serverconfig (serverid, allowexpanded, allowstats) VALUES (%s, %s, %s)', [serverId, 'true', 'true'])
+            serverConfigCache.pop(str(serverId), None)
     except:
         traceback.print_exc()
         cur.execute('ROLLBACK')
@@ -129,6 +153,7 @@ def toggleAllowExpanded(serverId):
             else:
                 toggledSetting = 'true'
             cur.execute('UPDATE serverconfig SET allowexpanded= %s WHERE serverid = %s', [toggledSetting, serverId])
+            serverConfigCache.pop(str(serverId), None)
             return toggledSetting
     except:
         traceback.print_exc()
@@ -137,9 +162,7 @@ def toggleAllowExpanded(serverId):
 
 def checkServerConfig(setting, serverId):
     try:
-        cur = conn.cursor(cursor_factory = DictCursor)
-        cur.execute('SELECT * FROM serverconfig WHERE serverid = (%s)', [str(serverId)])
-        row = cur.fetchone()
+        row = getServerConfig(serverId)
         if row is not None:
             if row[setting] == 'true':
                 return True
@@ -166,7 +189,7 @@ def addMalEntry(table, anime):
         if anime['english']:
             animeSyn.append(anime['english'].lower())
 
-        cur.execute(sql.SQL("SELECT * FROM {} WHERE id = (%s)").format(sql.Identifier(table)), [str(animeID)])
+        cur.execute(sql.SQL("SELECT accesstimestamp FROM {} WHERE id = (%s)").format(sql.Identifier(table)), [str(animeID)])
         row = cur.fetchone()
         
         if row is not None:
@@ -217,7 +240,7 @@ def addAniEntry(table, anime):
         elif anime['title_romaji']:
             animeSyn.append(anime['title_romaji'].lower())
 
-        cur.execute(sql.SQL("SELECT * FROM {} WHERE id = (%s)").format(sql.Identifier(table)), [str(animeID)])
+        cur.execute(sql.SQL("SELECT accesstimestamp FROM {} WHERE id = (%s)").format(sql.Identifier(table)), [str(animeID)])
         row = cur.fetchone()
         
         if row is not None:
@@ -244,27 +267,27 @@ def addAniEntry(table, anime):
         cur.execute('ROLLBACK')
         conn.commit()
 
+#Looks for a cached entry. The dict is only read when the entry is fresh, stale entries just return their id.
 def checkForMalEntry(table, name, animeId = None, isLN = None):
     try:
         cur = conn.cursor(cursor_factory=DictCursor)
-        nameInList = '{'+name.lower().strip()+'}'
+        name = name.lower().strip()
+        nameInList = '{'+name+'}'
+        probe = sql.SQL("SELECT id, accesstimestamp <= localtimestamp - interval '1 day' AS update, CASE WHEN accesstimestamp > localtimestamp - interval '1 day' THEN dict END AS dict FROM {} ").format(sql.Identifier(table))
         if animeId is not None:
-            cur.execute(sql.SQL("SELECT * FROM {} WHERE id = (%s)").format(sql.Identifier(table)), [str(animeId)])
+            cur.execute(probe + sql.SQL("WHERE id = (%s)"), [str(animeId)])
         else:
+            #Entries whose own title matches beat ones that only list it as a synonym
             if table == 'malmanga' or table == 'anilistmanga':
-                if isLN:
-                    cur.execute(sql.SQL("SELECT * FROM {} WHERE medium = %s AND synonyms @> %s").format(sql.Identifier(table)), ['light novel', nameInList])
-                else:
-                    cur.execute(sql.SQL("SELECT * FROM {} WHERE medium = %s AND synonyms @> %s").format(sql.Identifier(table)), ['manga', nameInList])
+                cur.execute(probe + sql.SQL("WHERE medium = %s AND (name = %s OR synonyms @> %s) ORDER BY name = %s DESC LIMIT 1"), ['light novel' if isLN else 'manga', name, nameInList, name])
             else:
-                cur.execute(sql.SQL("SELECT * FROM {} WHERE synonyms @> %s").format(sql.Identifier(table)), [nameInList])
+                cur.execute(probe + sql.SQL("WHERE name = %s OR synonyms @> %s ORDER BY name = %s DESC LIMIT 1"), [name, nameInList, name])
         row = cur.fetchone() 
         cachedReply = {}
 
         if row is not None:
             #print("found cached entry")
-            timeDiff = datetime.datetime.now() - row['accesstimestamp']
-            if timeDiff.days >= 1:
+            if row['update']:
                 cachedReply['update'] = True
                 cachedReply['id'] = row['id']
             else:
@@ -280,65 +303,79 @@ def checkForMalEntry(table, name, animeId = None, isLN = None):
         cur.execute('ROLLBACK')
         conn.commit()
 
-def PopulateCache(table, content):
-    setup()
-    novelOrManga = 'manga'
+#Returns the cached dict of an entry however old it is, for when the site it came from can't be reached
+def getCachedEntry(table, animeId):
     try:
         cur = conn.cursor(cursor_factory=DictCursor)
-        if table == 'malanime' or table == 'malmanga':
-            animeName = content['title']
-            animeID = content['id']
-            synonyms = content['synonyms']
-            if 'novel' in content['type']:
-                print("adding ln to mal")
-                novelOrManga = 'light novel'
-            animeSyn = []
-            animeSyn.append(animeName.lower())
-            if content['synonyms']:
-                for synonym in content['synonyms']:
-                    animeSyn.append(synonym.lower().strip())
-            if content['english']:
-                animeSyn.append(content['english'].lower())
-        else:
-            if content['title_english']:
-                animeName = content['title_english']
-            elif content['title_romaji']:
-                animeName = content['title_romaji']
-            if content['type'] == 'Novel':
-                print("light novel being added to ani")
-                novelOrManga = 'light novel'
-            animeID = content['id']
-            synonyms = content['synonyms']
-            animeSyn = []
-            animeSyn.append(animeName.lower())
-            if content['synonyms']:
-                for synonym in content['synonyms']:
-                    animeSyn.append(synonym.lower().strip())
-            
+        cur.execute(sql.SQL("SELECT dict FROM {} WHERE id = (%s)").format(sql.Identifier(table)), [str(animeId)])
+        row = cur.fetchone()
+        return row['dict'] if row is not None else None
+    except Exception as e:
+        traceback.print_exc()
+        cur.execute('ROLLBACK')
+        conn.commit()
 
-            if content['title_english']:
-                animeSyn.append(content['title_english'].lower())
-            elif content['title_romaji']:
-                animeSyn.append(content['title_romaji'].lower())
+#Builds the cache row for an entry. Entries go in already expired, so the first request for one refreshes it.
+def cacheRow(table, content):
+    novelOrManga = 'manga'
+    if table == 'malanime' or table == 'malmanga':
+        animeName = content['title']
+        if 'novel' in content['type']:
+            novelOrManga = 'light novel'
+        animeSyn = []
+        animeSyn.append(animeName.lower())
+        if content['synonyms']:
+            for synonym in content['synonyms']:
+                animeSyn.append(synonym.lower().strip())
+        if content['english']:
+            animeSyn.append(content['english'].lower())
+    else:
+        animeName = content['title_english'] or content['title_romaji']
+        if content['type'] == 'Novel':
+            novelOrManga = 'light novel'
+        animeSyn = []
+        animeSyn.append(animeName.lower())
+        if content['synonyms']:
+            for synonym in content['synonyms']:
+                animeSyn.append(synonym.lower().strip())
+        if content['title_english']:
+            animeSyn.append(content['title_english'].lower())
+        elif content['title_romaji']:
+            animeSyn.append(content['title_romaji'].lower())
 
-        cur.execute(sql.SQL("SELECT * FROM {} WHERE id = (%s)").format(sql.Identifier(table)), [str(animeID)])
-        row = cur.fetchone()
-        
-        if row is not None:
-            return
-        else:
-            expired_date = "1999-01-08 04:05:06"
-            if table =='malmanga' or table == 'anilistmanga':
-                cur.execute(sql.SQL("INSERT into {} (id, name, medium, synonyms, accesstimestamp, dict) values (%s, %s, %s, %s, %s, %s)").format(sql.Identifier(table)), [ str(animeID), animeName.lower(), novelOrManga, animeSyn, expired_date, Json(content)])
-                conn.commit()
-                return
-            cur.execute(sql.SQL("INSERT into {} (id, name, synonyms, accesstimestamp, dict) values (%s, %s, %s, %s, %s)").format(sql.Identifier(table)), [ str(animeID), animeName.lower(), animeSyn, expired_date, Json(content)])        
-        print("Added {} to the {}:\n".format(animeName, table))
+    expired_date = "1999-01-08 04:05:06"
+    if table == 'malmanga' or table == 'anilistmanga':
+        return (str(content['id']), animeName.lower(), novelOrManga, animeSyn, expired_date, Json(content))
+    return (str(content['id']), animeName.lower(), animeSyn, expired_date, Json(content))
+
+def PopulateCache(table, content):
+    return PopulateCacheBatch(table, [content])
+
+#Adds many entries to a cache table in one statement, skipping ones that are already cached. Returns whether the batch was written.
+def PopulateCacheBatch(table, contents):
+    rows = []
+    for content in contents:
+        try:
+            rows.append(cacheRow(table, content))
+        except Exception as e:
+            print("Skipping {} entry {}: {}".format(table, content.get('id'), e))
+    if not rows:
+        return True
+
+    if table == 'malmanga' or table == 'anilistmanga':
+        columns = sql.SQL('(id, name, medium, synonyms, accesstimestamp, dict)')
+    else:
+        columns = sql.SQL('(id, name, synonyms, accesstimestamp, dict)')
+    cur = conn.cursor()
+    try:
+        execute_values(cur, sql.SQL("INSERT INTO {} {} VALUES %s ON CONFLICT (id) DO NOTHING").format(sql.Identifier(table), columns), rows, page_size=len(rows))
         conn.commit()
+        return True
     except Exception as e:
         traceback.print_exc()
         cur.execute('ROLLBACK')
         conn.commit()
+        return False
 
 #--------------------------------------#
 
@@ -41,14 +41,14 @@ except sqlite3.Error:
     traceback.print_exc()
 
 #Checks if the message is valid (i.e. not already seen, not a post by Roboragi and the parent commenter isn't Roboragi)
-def isValidMessage(message):
+async def isValidMessage(message):
     try:
-        if (DatabaseHandler.messageExists(message.id)):
+        if (await DatabaseHandler.runInThread(DatabaseHandler.messageExists, message.id)):
             return False
 
         try:
             if (message.author.name == USERNAME):
-                DatabaseHandler.addMessage(message.id, message.author.id, message.server.id, False)
+                await DatabaseHandler.runInThread(DatabaseHandler.addMessage, message.id, message.author.id, message.server.id, False)
                 return False
         except:
             pass
@@ -165,26 +165,26 @@ async def buildMangaReply(searchText, message, isExpanded, canEmbed, blockTracki
                                     break
                                 ap = await AniP.getMangaURL(synonym)
                 if not blockTracking:
-                    DatabaseHandler.addRequest(titleToAdd, 'Manga', message.author.id, message.server.id)
+                    await DatabaseHandler.runInThread(DatabaseHandler.addRequest, titleToAdd, 'Manga', message.author.id, message.server.id)
             except:
                 traceback.print_exc()
                 pass
         if mal:
             try:
-                DatabaseHandler.addMalEntry('malmanga', mal)
+                await DatabaseHandler.runInThread(DatabaseHandler.addMalEntry, 'malmanga', mal)
             except:
                 traceback.print_exc()
                 pass
         if ani:
             try:
-                DatabaseHandler.addAniEntry('anilistmanga', ani)
+                await DatabaseHandler.runInThread(DatabaseHandler.addAniEntry, 'anilistmanga', ani)
             except:
                 traceback.print_exc()
                 pass
         if not canEmbed:
-            return CommentBuilder.buildMangaComment(isExpanded, mal, ani, mu, ap)
+            return await CommentBuilder.buildMangaComment(isExpanded, mal, ani, mu, ap)
         else:
-            return CommentBuilder.buildMangaEmbed(isExpanded, mal, ani, mu, ap)
+            return await CommentBuilder.buildMangaEmbed(isExpanded, mal, ani, mu, ap)
     except Exception as e:
         traceback.print_exc()
         return None
@@ -217,15 +217,15 @@ async def buildMangaReplyWithAuthor(searchText, authorName, message, isExpanded,
                     titleToAdd = ani['title_english']
                 
                 if not blockTracking:
-                    DatabaseHandler.addRequest(titleToAdd, 'Manga', message.author.id, message.server.id)
+                    await DatabaseHandler.runInThread(DatabaseHandler.addRequest, titleToAdd, 'Manga', message.author.id, message.server.id)
             except:
                 traceback.print_exc()
                 pass
             
             if not canEmbed:
-                return CommentBuilder.buildMangaComment(isExpanded, mal, ani, mu, ap)
+                return await CommentBuilder.buildMangaComment(isExpanded, mal, ani, mu, ap)
             else:
-                return CommentBuilder.buildMangaEmbed(isExpanded, mal, ani, mu, ap)
+                return await CommentBuilder.buildMangaEmbed(isExpanded, mal, ani, mu, ap)
     
     except Exception as e:
         traceback.print_exc()
@@ -325,27 +325,27 @@ async def buildAnimeReply(searchText, message, isExpanded, canEmbed, blockTracki
                         titleToAdd = ani['result']['title_romaji']
 
                 if not blockTracking:
-                    DatabaseHandler.addRequest(titleToAdd, 'Anime', message.author.id, message.server.id)
+                    await DatabaseHandler.runInThread(DatabaseHandler.addRequest, titleToAdd, 'Anime', message.author.id, message.server.id)
             except:
                 traceback.print_exc()
                 pass
         if mal['result']:
             print('trying to add an anime to cache')
             try:
-                DatabaseHandler.addMalEntry('malanime', mal['result'])
+                await DatabaseHandler.runInThread(DatabaseHandler.addMalEntry, 'malanime', mal['result'])
             except:
                 traceback.print_exc()
                 pass
         if ani:
             try:
-                DatabaseHandler.addAniEntry('anilistanime', ani['result'])
+                await DatabaseHandler.runInThread(DatabaseHandler.addAniEntry, 'anilistanime', ani['result'])
             except:
                 traceback.print_exc()
                 pass
         if not canEmbed:
-            return CommentBuilder.buildAnimeComment(isExpanded, mal['result'], ani['result'], ap['result'], adb['result'])
+            return await CommentBuilder.buildAnimeComment(isExpanded, mal['result'], ani['result'], ap['result'], adb['result'])
         else:
-            return CommentBuilder.buildAnimeEmbed(isExpanded, mal['result'], ani['result'], ap['result'], adb['result'])
+            return await CommentBuilder.buildAnimeEmbed(isExpanded, mal['result'], ani['result'], ap['result'], adb['result'])
 
     except Exception as e:
         traceback.print_exc()
@@ -442,26 +442,26 @@ async def buildLightNovelReply(searchText, isExpanded, message, canEmbed, blockT
                         titleToAdd = ani['result']['title_english']
 
                 if (str(message.server).lower is not 'nihilate') and (str(message.server).lower is not 'roboragi') and not blockTracking:
-                    DatabaseHandler.addRequest(titleToAdd, 'LN', message.author.id, message.server.id)
+                    await DatabaseHandler.runInThread(DatabaseHandler.addRequest, titleToAdd, 'LN', message.author.id, message.server.id)
             except:
                 traceback.print_exc()
                 pass
         if mal['result']:
             try:
-                DatabaseHandler.addMalEntry('malmanga', mal['result'])
+                await DatabaseHandler.runInThread(DatabaseHandler.addMalEntry, 'malmanga', mal['result'])
             except:
                 traceback.print_exc()
                 pass
         if ani['result']:
             try:
-                DatabaseHandler.addAniEntry('anilistmanga', ani['result'])
+                await DatabaseHandler.runInThread(DatabaseHandler.addAniEntry, 'anilistmanga', ani['result'])
             except:
                 traceback.print_exc()
                 pass
         if not canEmbed:
-            return CommentBuilder.buildLightNovelComment(isExpanded, mal['result'], ani['result'], nu['result'], lndb['result'])
+            return await CommentBuilder.buildLightNovelComment(isExpanded, mal['result'], ani['result'], nu['result'], lndb['result'])
         else:
-            return CommentBuilder.buildLightNovelEmbed(isExpanded, mal['result'], ani['result'], nu['result'], lndb['result'])
+            return await CommentBuilder.buildLightNovelEmbed(isExpanded, mal['result'], ani['result'], nu['result'], lndb['result'])
     except Exception as e:
         traceback.print_exc()
         return None
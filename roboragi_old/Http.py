@@ -0,0 +1,79 @@
+'''
+Http.py
+The HTTP client every source shares. Loads helpers/http_helpers.py from the Discord bot directly, since this folder isn't a package,
+so both bots use the same connection limits, timeouts, retry policy, rate limits and circuit breakers.
+'''
+
+import aiohttp
+import importlib.util
+import os
+
+_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'helpers', 'http_helpers.py')
+_spec = importlib.util.spec_from_file_location('http_helpers', _path)
+http_helpers = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(http_helpers)
+
+RetryPolicy = http_helpers.RetryPolicy
+Upstreams = http_helpers.Upstreams
+UpstreamUnavailable = http_helpers.UpstreamUnavailable
+
+TIMEOUT = aiohttp.ClientTimeout(total=10, connect=3)
+
+#Created on the first request, since it needs a running event loop
+connector = None
+
+#Every site's rate limit and circuit breaker, shared by the Sessions that don't bring their own.
+#Looked up on every request, so a script can swap in its own before it starts.
+defaultUpstreams = Upstreams()
+
+#Stands in for an aiohttp.ClientSession. Every Session sends its requests through the one shared connector,
+#so they share its connection pool, per-host limits, keep-alive and DNS cache.
+#A request to a site whose circuit is open raises UpstreamUnavailable instead of waiting for it to time out.
+class Session:
+    def __init__(self, headers=None, policy=None, upstreams=None):
+        self.headers = headers
+        self.policy = policy or RetryPolicy()
+        self.upstreams = upstreams
+        self.session = None
+
+    def client(self):
+        global connector
+        if connector is None or connector.closed:
+            connector = http_helpers.make_connector()
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=connector, connector_owner=False, timeout=TIMEOUT, headers=self.headers)
+        return self.session
+
+    def get(self, url, **kwargs):
+        return Request(self, 'GET', url, kwargs)
+
+    def post(self, url, **kwargs):
+        return Request(self, 'POST', url, kwargs)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+#Can be awaited or used with `async with`, like the request aiohttp's own get and post return
+class Request:
+    def __init__(self, session, method, url, kwargs):
+        self.session = session
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+        self.response = None
+
+    def __await__(self):
+        return self.session.policy.request(self.session.client(), (self.session.upstreams or defaultUpstreams).for_url(self.url), self.method, self.url, **self.kwargs).__await__()
+
+    async def __aenter__(self):
+        self.response = await self
+        return self.response
+
+    async def __aexit__(self, *exc_info):
+        self.response.release()
+
+#Closes every connection the sessions kept open
+async def close():
+    if connector is not None:
+        await connector.close()
@@ -2,13 +2,13 @@
 Hummingbird.py
 Handles all of the connections to Hummingbird.
 '''
-import aiohttp
+import Http
 import difflib
 import requests
 import traceback
 import pprint
 
-session = aiohttp.ClientSession()
+session = Http.Session()
 
 def getSynonyms(request):
     synonyms = []
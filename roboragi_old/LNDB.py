@@ -5,13 +5,13 @@ Handles all LNDB information
 
 from pyquery import PyQuery as pq
 import requests
-import aiohttp
+import Http
 import difflib
 import traceback
 import pprint
 import collections
 
-session = aiohttp.ClientSession()
+session = Http.Session()
 
 async def getLightNovelURL(searchText):
     try:
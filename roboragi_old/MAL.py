@@ -8,11 +8,15 @@ Handles all of the connections to MyAnimeList.
 import xml.etree.cElementTree as ET
 import DatabaseHandler
 import aiohttp
+import Http
 import traceback
 import pprint
 import difflib
 import urllib
 
+#Base url of the MAL api, PreCache points this at a local stub when testing
+MAL_API = 'https://myanimelist.net/api'
+
 try:
     import Config
     print('Setting up MAL Connection')
@@ -22,14 +26,14 @@ except ImportError:
     pass
 
 try:
-    mal = aiohttp.ClientSession(headers = {'Authorization': MALAUTH, 'User-Agent': MALUSERAGENT})
+    mal = Http.Session(headers = {'Authorization': MALAUTH, 'User-Agent': MALUSERAGENT})
 except Exception as e:
     print(e)
 
 
 #Sets up the connection to MAL.
 def setup():
-    mal = aiohttp.ClientSession(headers = {'Authorization': MALAUTH, 'User-Agent': MALUSERAGENT})
+    mal = Http.Session(headers = {'Authorization': MALAUTH, 'User-Agent': MALUSERAGENT})
 
 def getSynonyms(request):
     synonyms = []
@@ -42,7 +46,7 @@ def getSynonyms(request):
 
 #Returns the closest anime (as a Json-like object) it can find using the given searchtext. MAL returns XML (bleh) so we have to convert it ourselves.
 async def getAnimeDetails(searchText, animeId=None):
-    cachedAnime = DatabaseHandler.checkForMalEntry('malanime', searchText, animeId)
+    cachedAnime = await DatabaseHandler.runInThread(DatabaseHandler.checkForMalEntry, 'malanime', searchText, animeId)
     if cachedAnime is not None:
         if cachedAnime['update']:
             print("found cached anime, needs update in mal")
@@ -54,7 +58,7 @@ async def getAnimeDetails(searchText, animeId=None):
     cleanSearchText = urllib.parse.quote(searchText)
     try:
         try:
-            async with mal.get('https://myanimelist.net/api/anime/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
+            async with mal.get(MAL_API + '/anime/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
                 if resp.status != 200:
                     print("Searching for {} failed with error code {}".format(searchText.rstrip(), resp.status))
                 request = await resp.text()
@@ -62,7 +66,7 @@ async def getAnimeDetails(searchText, animeId=None):
             print(e)
             setup()
             try:
-                async with mal.get('https://myanimelist.net/api/anime/search.xml?q=' + searchText.rstrip(), timeout=10) as resp:
+                async with mal.get(MAL_API + '/anime/search.xml?q=' + searchText.rstrip(), timeout=10) as resp:
                     request = await resp.text()
             except aiohttp.exceptions.RequestException as e:  # This is the correct syntax
                 print(e) 
@@ -190,12 +194,12 @@ async def getMangaCloseToDescription(searchText, descriptionToCheck):
     cleanSearchText = urllib.parse.quote(searchText)
     try:
         try:
-            async with mal.get('https://myanimelist.net/api/manga/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
+            async with mal.get(MAL_API + '/manga/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
                 request = await resp.text()
             
         except:
             setup()
-            async with mal.get('https://myanimelist.net/api/manga/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
+            async with mal.get(MAL_API + '/manga/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
                  request = await resp.text()
             
 
@@ -251,7 +255,7 @@ async def getLightNovelDetails(searchText, lnId=None):
 
 #Returns the closest manga series given a specific search term. Again, MAL returns XML, so we conver it ourselves
 async def getMangaDetails(searchText, mangaId=None, isLN=False):
-    cachedManga = DatabaseHandler.checkForMalEntry('malmanga', searchText, mangaId, isLN)
+    cachedManga = await DatabaseHandler.runInThread(DatabaseHandler.checkForMalEntry, 'malmanga', searchText, mangaId, isLN)
     if cachedManga is not None:
         if cachedManga['update']:
             print("found cached anime, needs update in mal")
@@ -262,13 +266,13 @@ async def getMangaDetails(searchText, mangaId=None, isLN=False):
     cleanSearchText = urllib.parse.quote(searchText)
     try:
         try:
-            async with mal.get('https://myanimelist.net/api/manga/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
+            async with mal.get(MAL_API + '/manga/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
                 request = await resp.text()
                             
         except Exception as e:
             print(e)
             setup()
-            async with mal.get('https://myanimelist.net/api/manga/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
+            async with mal.get(MAL_API + '/manga/search.xml?q=' + cleanSearchText.rstrip(), timeout=10) as resp:
                 request = await resp.text()
             
 
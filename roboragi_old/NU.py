@@ -4,13 +4,13 @@ Handles all NovelUpdates information
 '''
 
 from pyquery import PyQuery as pq
-import aiohttp
+import Http
 import difflib
 import traceback
 import pprint
 import collections
 
-req = aiohttp.ClientSession()
+req = Http.Session()
 
 async def getLightNovelURL(searchText):
     try:
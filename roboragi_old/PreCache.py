@@ -1,82 +1,251 @@
-import aiohttp
+'''
+PreCache.py
+Warms the anilist and mal cache tables with the most popular titles.
+
+Pages are fetched a few at a time, every upstream site has its own token
+bucket, rows are written in batches and every finished page is recorded
+in a checkpoint file, so a run that dies picks up where it stopped.
+
+    python PreCache.py --anime 20000 --manga 20000 --genres
+
+Point it at PreCacheStub.py to try it without touching the real sites:
+
+    python PreCache.py --anilist-url http://localhost:8080/api --mal-url http://localhost:8080/api
+'''
+import argparse
 import asyncio
 import DatabaseHandler
-import Anilist
+import Http
+import json
 import MAL
-import traceback
-import urllib
 import math
+import os
+import time
 
+PAGE_SIZE = 40
 
-async def setup():
-    end_index = input("How many anime titles do you want?  ")
-    #result = await top_n_by_popularity('anime', end_index)
-    result2 = await top_n_by_popularity('manga', end_index)
-    result3 = await top40ByGenre('manga')
+ANICLIENT = ''
+ANISECRET = ''
 
-async def top40ByGenre(medium):
-    errorList = []
-    genres = await Anilist.getGenres(medium)
-    for entry in genres:
-        top40 = await Anilist.GetTop40ByGenre(medium, entry['genre'])
-        for entry in top40:
-            print("Working on anilist id: {}".format(entry['id']))
-            try:
-                DatabaseHandler.PopulateCache('anilist{}'.format(medium), entry)
-            except Exception as e:
-                print("{} failed with exception {}".format(entry['id'], e))
+try:
+    import Config
+    ANICLIENT = Config.aniclient
+    ANISECRET = Config.anisecret
+except ImportError:
+    pass
+
+
+#Allows `rate` requests a second on average, in bursts of up to `burst`.
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+#Talks to the anilist api, getting a new token when the old one expires.
+#Rate limits and server errors are retried by the session's policy.
+class Anilist:
+    def __init__(self, session, url, bucket):
+        self.session = session
+        self.url = url
+        self.bucket = bucket
+        self.access_token = ''
+
+    async def authenticate(self):
+        await self.bucket.acquire()
+        async with self.session.post(self.url + '/auth/access_token', params={'grant_type': 'client_credentials', 'client_id': ANICLIENT, 'client_secret': ANISECRET}) as resp:
+            resp.raise_for_status()
+            request = await resp.json()
+            self.access_token = request['access_token']
+
+    async def get(self, path, **params):
+        for attempt in range(2):
+            await self.bucket.acquire()
+            params['access_token'] = self.access_token
+            async with self.session.get(self.url + path, params=params) as resp:
+                if resp.status != 401:
+                    resp.raise_for_status()
+                    return await resp.json()
+            await self.authenticate()
+        raise RuntimeError("Anilist rejected a fresh access token for {}".format(path))
+
+    async def get_page_by_popularity(self, medium, page):
+        return await self.get('/browse/{}'.format(medium), sort='popularity-desc', page=page)
+
+    async def get_genres(self):
+        return await self.get('/genre_list/')
+
+    async def get_top_40_by_genre(self, medium, genre):
+        return await self.get('/browse/{}'.format(medium), genres=genre, sort='popularity-desc')
+
+
+#Remembers which pages have been written, so a restarted run skips them.
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.done = set(json.load(f))
+        except FileNotFoundError:
+            self.done = set()
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def add(self, key):
+        self.done.add(key)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(sorted(self.done), f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+#Collects rows from every running page and writes them in batches of `batch_size`,
+#or whatever has arrived after `flush_interval` seconds.
+class CacheWriter:
+    def __init__(self, batch_size, flush_interval=1):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue()
+
+    #Returns once the rows are committed
+    async def write(self, rows):
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((rows, future))
+        await future
+
+    async def close(self):
+        await self.queue.put(None)
+
+    async def run(self):
+        closed = False
+        while not closed:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch, futures = list(item[0]), [item[1]]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    closed = True
+                    break
+                batch.extend(item[0])
+                futures.append(item[1])
+            await self.flush(batch, futures)
+
+    async def flush(self, batch, futures):
+        tables = {}
+        for table, content in batch:
+            tables.setdefault(table, []).append(content)
+        written = all([await DatabaseHandler.runInThread(DatabaseHandler.PopulateCacheBatch, table, contents) for table, contents in tables.items()])
+        print("Wrote {} rows".format(len(batch)))
+        for future in futures:
+            if written:
+                future.set_result(None)
+            else:
+                future.set_exception(RuntimeError("Writing the batch failed"))
+
+
+class PreCache:
+    def __init__(self, anilist, writer, checkpoint, mal_bucket=None, concurrency=4):
+        self.anilist = anilist
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.mal_bucket = mal_bucket
+        self.pages = asyncio.Semaphore(concurrency)
+
+    async def mal_details(self, medium, entry):
+        animeName = entry['title_romaji'] or entry['title_english']
+        await self.mal_bucket.acquire()
+        if medium == 'anime':
+            return await MAL.getAnimeDetails(animeName)
+        return await MAL.getMangaDetails(animeName)
+
+    #Fetches one page of entries, looks them up on MAL and waits for all of it to be written
+    async def warm(self, key, medium, fetch):
+        if key in self.checkpoint:
+            return
+        async with self.pages:
             try:
-                animeName = None
-                if entry['title_romaji']:
-                    animeName = entry['title_romaji']
-                else:
-                    animeName = entry['title_english']
-                if medium == 'anime':
-                    malanime = await MAL.getAnimeDetails(animeName)
-                elif medium == 'manga':
-                    malanime = await MAL.getMangaDetails(animeName)
-                if malanime:
-                    try:
-                        DatabaseHandler.PopulateCache('mal{}'.format(medium), malanime)
-                    except Exception as e:
-                        print("{} failed with exception {}".format(malanime['id'], e))
+                entries = await fetch() or []
+                rows = [('anilist{}'.format(medium), entry) for entry in entries]
+                if self.mal_bucket:
+                    found = await asyncio.gather(*[self.mal_details(medium, entry) for entry in entries])
+                    rows.extend(('mal{}'.format(medium), malanime) for malanime in found if malanime)
+                await self.writer.write(rows)
+                self.checkpoint.add(key)
+                print("Finished {} ({} rows)".format(key, len(rows)))
             except Exception as e:
-                print("debug 1 error: {}".format(e))
+                print("{} failed with exception {}".format(key, e))
 
-async def top_n_by_popularity(medium, n):
-    count = 1
-    final_page = math.ceil(float(n)/float(40))
-    while count < final_page:
-        try:
-            print("\n\n-------------Starting page {}------------\n\n".format(count))
-            page_entries = await Anilist.get_page_by_popularity(medium, count)
-            for entry in page_entries:
-                    print("Working on anilist id: {}".format(entry['id']))
-                    try:
-                        DatabaseHandler.PopulateCache('anilist{}'.format(medium), entry)
-                    except Exception as e:
-                        print("{} failed with exception {}\n".format(entry['id'], e))
-                    try:
-                        animeName = None
-                        if entry['title_romaji']:
-                            animeName = entry['title_romaji']
-                        else:
-                            animeName = entry['title_english']
-                        if medium == 'anime':
-                            malanime = await MAL.getAnimeDetails(animeName)
-                        elif medium == 'manga':
-                            malanime = await MAL.getMangaDetails(animeName)
-                        if malanime:
-                            try:
-                                DatabaseHandler.PopulateCache('mal{}'.format(medium), malanime)
-                            except Exception as e:
-                                print("{} failed with exception {}\n".format(malanime['id'], e))
-                    except Exception as e:
-                        print("debug 1 error: {}\n".format(e))
-            count +=1
-        except Exception as e:
-            count +=1
-            print(e)
-
-loop = asyncio.get_event_loop()
-loop.run_until_complete(setup())
+    async def top_n_by_popularity(self, medium, n):
+        final_page = math.ceil(float(n) / PAGE_SIZE)
+        await asyncio.gather(*[
+            self.warm('{}:page:{}'.format(medium, page), medium, lambda page=page: self.anilist.get_page_by_popularity(medium, page))
+            for page in range(1, final_page + 1)])
+
+    async def top40ByGenre(self, medium):
+        genres = await self.anilist.get_genres()
+        await asyncio.gather(*[
+            self.warm('{}:genre:{}'.format(medium, entry['genre']), medium, lambda genre=entry['genre']: self.anilist.get_top_40_by_genre(medium, genre))
+            for entry in genres])
+
+
+async def setup(args):
+    writer = CacheWriter(args.batch_size)
+    writing = asyncio.ensure_future(writer.run())
+    MAL.MAL_API = args.mal_url
+    #A warm-up can afford to wait out rate limits for longer than a reply can. Its own buckets already pace
+    #every site, so the shared limiter is held above them and only steps in when a site sends Retry-After.
+    rate = args.anilist_rate + args.mal_rate
+    Http.defaultUpstreams = Http.Upstreams({'default': {'max_wait': None, 'rate': rate, 'min_rate': rate, 'burst': rate}})
+    session = Http.Session(policy=Http.RetryPolicy(retries=5, backoff=2, max_backoff=60))
+    anilist = Anilist(session, args.anilist_url, TokenBucket(args.anilist_rate, args.anilist_rate))
+    await anilist.authenticate()
+    mal_bucket = TokenBucket(args.mal_rate, args.mal_rate) if args.mal_rate else None
+    precache = PreCache(anilist, writer, Checkpoint(args.checkpoint), mal_bucket, args.concurrency)
+    started = time.monotonic()
+    for medium in ('anime', 'manga'):
+        if getattr(args, medium):
+            await precache.top_n_by_popularity(medium, getattr(args, medium))
+        if args.genres:
+            await precache.top40ByGenre(medium)
+    await writer.close()
+    await writing
+    await session.close()
+    await MAL.mal.close()
+    await Http.close()
+    print("Done in {:.1f}s".format(time.monotonic() - started))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Warms the anilist and mal cache tables.')
+    parser.add_argument('--anime', type=int, default=0, help='how many of the most popular anime to cache')
+    parser.add_argument('--manga', type=int, default=0, help='how many of the most popular manga to cache')
+    parser.add_argument('--genres', action='store_true', help='also cache the top 40 of every genre')
+    parser.add_argument('--concurrency', type=int, default=4, help='pages worked on at once')
+    parser.add_argument('--batch-size', type=int, default=200, help='rows written per statement')
+    parser.add_argument('--anilist-rate', type=float, default=1.5, help='anilist requests per second')
+    parser.add_argument('--mal-rate', type=float, default=1, help='mal requests per second, 0 skips mal')
+    parser.add_argument('--anilist-url', default='https://anilist.co/api')
+    parser.add_argument('--mal-url', default=MAL.MAL_API)
+    parser.add_argument('--checkpoint', default='precache.checkpoint', help='file recording the finished pages, delete it to start over')
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(setup(parser.parse_args()))
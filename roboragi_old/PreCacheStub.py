@@ -0,0 +1,74 @@
+'''
+PreCacheStub.py
+A stand-in for the anilist and mal apis that PreCache.py talks to, so a
+warm-up can be tried, timed and killed halfway through without hitting
+the real sites.
+
+    python PreCacheStub.py --port 8080 --latency 0.2 --error-rate 0.05
+'''
+import argparse
+import asyncio
+import random
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+GENRES = ['Action', 'Comedy', 'Drama', 'Romance', 'Slice of Life']
+
+def entry(medium, id):
+    return {
+        'id': id,
+        'title_romaji': '{} {}'.format(medium, id),
+        'title_english': '{} {} english'.format(medium, id),
+        'synonyms': ['{} {} synonym'.format(medium, id)],
+        'type': 'Novel' if medium == 'manga' and id % 5 == 0 else 'TV' if medium == 'anime' else 'Manga',
+        'popularity': 100000 - id
+    }
+
+def mal_entry(medium, title):
+    return ('<entry><id>{id}</id><title>{title}</title><english></english><synonyms>{title} mal</synonyms>'
+            '<episodes>12</episodes><chapters>10</chapters><volumes>2</volumes><score>8</score><type>{type}</type>'
+            '<status>Finished</status><start_date></start_date><end_date></end_date><synopsis></synopsis><image></image></entry>'
+            ).format(id=abs(hash(title)) % 10 ** 6, title=escape(title), type='TV' if medium == 'anime' else 'Manga')
+
+def make_app(latency, error_rate):
+    @web.middleware
+    async def flaky(request, handler):
+        await asyncio.sleep(latency)
+        if random.random() < error_rate:
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        return await handler(request)
+
+    async def access_token(request):
+        return web.json_response({'access_token': 'stub'})
+
+    async def genre_list(request):
+        return web.json_response([{'genre': genre} for genre in GENRES])
+
+    async def browse(request):
+        medium = request.match_info['medium']
+        if 'genres' in request.query:
+            offset = 50000 + GENRES.index(request.query['genres']) * 20
+        else:
+            offset = (int(request.query.get('page', 1)) - 1) * 40
+        return web.json_response([entry(medium, offset + i + 1) for i in range(40)])
+
+    async def mal_search(request):
+        medium = request.match_info['medium']
+        title = request.query.get('q', '')
+        return web.Response(text='<{0}>{1}</{0}>'.format(medium, mal_entry(medium, title)), content_type='text/xml')
+
+    app = web.Application(middlewares=[flaky])
+    app.router.add_post('/api/auth/access_token', access_token)
+    app.router.add_get('/api/genre_list/', genre_list)
+    app.router.add_get('/api/browse/{medium}', browse)
+    app.router.add_get('/api/{medium}/search.xml', mal_search)
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves fake anilist and mal responses for PreCache.py.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with a 429')
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, args.error_rate), port=args.port)
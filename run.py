@@ -2,19 +2,101 @@
 Actually runs the code
 """
 from bot import Discordoragi
+from bot.discordoragi import get_logger, share_pool
 from cogs import Search
+from cogs.search import Lookups
+from helpers import HTTPClient, Metrics, PostgresController
+from helpers.metrics_helpers import database_metrics, upstream_metrics
+from helpers.worker_helpers import serve, worker_path
 from asyncio import get_event_loop
+from signal import SIGINT, SIGTERM
+import yaml
 
+# Where the search workers listen when config.yml doesn't say
+DEFAULT_SOCKET = '/tmp/discordoragi-search'
 
-def run():
+
+def run(shard_ids=None, shard_count=None, processes=1, search_workers=(),
+        metrics_port=None, prepared=False):
+    """
+    Runs the bot, or some of its shards when started by launcher.py
+    :param shard_ids: the shards to run, None for all of them
+    :param shard_count: the number of shards across every process
+    :param processes: how many processes share the database
+    :param search_workers: the socket paths of the search workers, empty
+        to search in this process
+    :param metrics_port: the port the metrics are served on, None for the
+        one in config.yml
+    :param prepared: True if launcher.py already made the tables
+    """
     loop = get_event_loop()
-    bot = loop.run_until_complete(Discordoragi.get_bot())
+    bot = loop.run_until_complete(Discordoragi.get_bot(
+        shard_ids, shard_count, processes, search_workers, prepared))
     search_cog = loop.run_until_complete(Search.create_search(bot))
+    loop.run_until_complete(bot.metrics.start(
+        bot.metrics_config.get('host', '127.0.0.1'),
+        metrics_port or bot.metrics_config.get('port')))
     cogs = [
       search_cog
     ]
     bot.start_bot(cogs)
 
 
+async def start_search_worker(config, index, processes, metrics, logger):
+    """
+    Starts answering the lookups sent by the shard processes. The tables
+    were already made by launcher.py.
+    :param config: the loaded config.yml
+    :param index: which of the search workers this is
+    :param processes: how many processes share the database
+    :param metrics: the Metrics of the worker
+    :param logger: logger object used for logging
+    :return: the server, database controller and http client to close
+    """
+    database_config = share_pool(config['database_info'], processes)
+    session_manager = HTTPClient(**(config.get('http_info') or {}))
+    db_controller = await PostgresController.get_instance(
+        logger, database_config, create_tables=False,
+        **(config.get('request_log') or {}))
+    metrics.add_collector(upstream_metrics(session_manager.upstreams))
+    metrics.add_collector(database_metrics(db_controller))
+    lookups = await Lookups.create(
+        config.get('search_info') or {}, database_config, db_controller,
+        session_manager, logger, config['footer'], metrics)
+    socket_path = (config.get('search_workers') or {}).get(
+        'socket', DEFAULT_SOCKET)
+    server = await serve(
+        worker_path(socket_path, index), lookups.handle, logger)
+    return server, db_controller, session_manager
+
+
+def run_search_worker(index, processes=1, metrics_port=None):
+    """
+    Runs a search worker, started by launcher.py
+    :param index: which of the search workers this is
+    :param processes: how many processes share the database
+    :param metrics_port: the port the metrics are served on, None to not
+        serve them
+    """
+    with open('config/config.yml', 'r') as yml_config:
+        config = yaml.load(yml_config)
+    logger = get_logger(f' [search worker {index}]')
+    metrics = Metrics()
+    loop = get_event_loop()
+    server, db_controller, session_manager = loop.run_until_complete(
+        start_search_worker(config, index, processes, metrics, logger))
+    loop.run_until_complete(metrics.start(
+        (config.get('metrics') or {}).get('host', '127.0.0.1'),
+        metrics_port))
+    loop.add_signal_handler(SIGINT, loop.stop)
+    loop.add_signal_handler(SIGTERM, loop.stop)
+    loop.run_forever()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.run_until_complete(db_controller.close())
+    loop.run_until_complete(session_manager.close())
+    loop.run_until_complete(metrics.close())
+
+
 if __name__ == '__main__':
     run()
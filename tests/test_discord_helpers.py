@@ -0,0 +1,106 @@
+"""
+Checks the requests `send_embeds` and `edit_embeds` make, against a stubbed
+discord.py HTTP client
+"""
+from asyncio import new_event_loop
+from unittest import TestCase, main
+from unittest.mock import MagicMock
+
+from discord import Embed
+
+from helpers.discord_helpers import EMBEDS_API, edit_embeds, send_embeds
+
+CHANNEL_ID = 1234
+MESSAGE_ID = 5678
+
+
+class StubHTTP():
+    """
+    Records every request instead of making it
+    """
+    def __init__(self, response):
+        """
+        :param response: the payload every request answers with
+        """
+        self.response = response
+        self.requests = []
+
+    async def request(self, route, **kwargs):
+        self.requests.append((route, kwargs))
+        return self.response
+
+
+def message_payload(embeds):
+    return {
+        'id': str(MESSAGE_ID),
+        'channel_id': str(CHANNEL_ID),
+        'type': 0,
+        'content': '',
+        'author': {'id': '1', 'username': 'Discordoragi',
+                   'discriminator': '0001', 'avatar': None, 'bot': True},
+        'embeds': embeds,
+        'attachments': [],
+        'mentions': [],
+        'mention_roles': [],
+        'mention_everyone': False,
+        'pinned': False,
+        'tts': False,
+        'timestamp': '2020-01-01T00:00:00+00:00',
+        'edited_timestamp': None
+    }
+
+
+def run(coro):
+    loop = new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestEmbeds(TestCase):
+
+    def setUp(self):
+        self.embeds = [Embed(title=f'Title {i}') for i in range(3)]
+        payload = message_payload([embed.to_dict() for embed in self.embeds])
+        self.http = StubHTTP(payload)
+        self.channel = MagicMock(id=CHANNEL_ID)
+        self.channel._state.http = self.http
+
+    def test_send_embeds(self):
+        message = run(send_embeds(self.channel, self.embeds))
+        [(route, kwargs)] = self.http.requests
+        self.assertEqual(route.method, 'POST')
+        self.assertEqual(
+            route.url, f'{EMBEDS_API}/channels/{CHANNEL_ID}/messages')
+        self.assertEqual(kwargs, {
+            'json': {'embeds': [embed.to_dict() for embed in self.embeds]}
+        })
+        self.assertEqual(message.id, MESSAGE_ID)
+        self.assertEqual([embed.title for embed in message.embeds],
+                         ['Title 0', 'Title 1', 'Title 2'])
+
+    def test_edit_embeds(self):
+        message = MagicMock(id=MESSAGE_ID, channel=self.channel)
+        message._state.http = self.http
+        run(edit_embeds(message, self.embeds))
+        [(route, kwargs)] = self.http.requests
+        self.assertEqual(route.method, 'PATCH')
+        self.assertEqual(
+            route.url,
+            f'{EMBEDS_API}/channels/{CHANNEL_ID}/messages/{MESSAGE_ID}')
+        self.assertEqual(kwargs, {
+            'json': {'embeds': [embed.to_dict() for embed in self.embeds]}
+        })
+
+    def test_single_embed_uses_discord_py(self):
+        async def send(**kwargs):
+            return kwargs
+        self.channel.send = send
+        sent = run(send_embeds(self.channel, self.embeds[:1]))
+        self.assertEqual(sent, {'embed': self.embeds[0]})
+        self.assertEqual(self.http.requests, [])
+
+
+if __name__ == '__main__':
+    main()